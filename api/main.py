@@ -1,15 +1,21 @@
 from typing import Union
 from uuid import UUID
 import asyncio
+import hashlib
+import json
 import logging
+import time
+from collections import defaultdict, deque
 
-from fastapi import Depends, FastAPI, WebSocket, WebSocketDisconnect
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.websockets import WebSocketState
 
 from pydantic import BaseModel
-from pymongo import MongoClient
-from pymongo.database import Database
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
 from pydantic_settings import BaseSettings
 
 import aio_pika
@@ -25,15 +31,276 @@ class Settings(BaseSettings):
     mongo_password: str
     mongo_host: str
     mongo_port: str
+    # connections held by the one client the app shares between requests
+    mongo_pool_size: int = 50
+    # how far a websocket client can fall behind the feed and what happens when it does
+    feed_backlog: int = 1000
+    feed_slow_policy: str = 'drop-oldest'
+    feed_send_timeout: float = 10
+    # cached responses are dropped by feed messages, this is the backstop for changes nothing announces
+    cache_ttl: float = 60
     rabbit_user: str
     rabbit_password: str
     rabbit_host: str
 
+class WorldState:
+    '''
+        In memory copy of what the web client loads on start: the region with its city, the active
+        bands, the open dungeons and the running expeditions. It's loaded from Mongo once and then
+        kept current from the feed. Messages that carry their change are applied directly, the
+        ones that only name an entity get that entity fetched again, once, rather than once for
+        every connected client. That relies on the DM writing an entity before it sends a message
+        naming it.
+    '''
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self.region = None
+        self.bands = {}
+        self.dungeons = {}
+        self.expeditions = {}
+        # (sequence, encoded snapshot), a crowd of reconnects between two messages shares one
+        self.encoded = None
+
+    async def load(self):
+        self.region = await self._region()
+        self.bands = {b['id']: b async for b in self.db.bands.find({'active': True}, NO_ID)}
+        self.dungeons = {d['id']: d async for d in self.db.dungeons.find({'complete': False}, NO_ID)}
+        self.expeditions = {e['id']: e async for e in self.db.expeditions.find({'complete': False}, NO_ID)}
+        self.encoded = None
+
+    def snapshot(self, sequence: int) -> bytes:
+        if self.encoded is None or self.encoded[0] != sequence:
+            self.encoded = (sequence, json.dumps({
+                'type': 'SNAPSHOT',
+                'region': self.region,
+                'bands': list(self.bands.values()),
+                'dungeons': list(self.dungeons.values()),
+                'expeditions': list(self.expeditions.values()),
+                'seq': sequence
+            }).encode())
+        return self.encoded[1]
+
+    async def fetch(self, doc: dict) -> dict:
+        # whatever a message only names gets read back here, before it's applied, so nothing
+        # waits on Mongo while the feed is held up
+        kind = doc.get('type')
+        context = doc.get('context', {})
+        fetched = {}
+
+        if kind in ('REGION', 'DUNGEON-NEW', 'DUNGEON-DEL'):
+            fetched['region'] = await self._region()
+        if kind == 'DUNGEON-NEW':
+            fetched['dungeon'] = await self._find(self.db.dungeons, context.get('dungeon'))
+        elif kind == 'BANDS':
+            fetched['bands'] = await self.db.bands.find({'active': True}, NO_ID).to_list()
+        elif kind == 'BAND':
+            fetched['band'] = await self._find(self.db.bands, context.get('band'))
+        elif kind == 'EXPEDITION-NEW':
+            fetched['expedition'] = await self._find(self.db.expeditions, context.get('expedition'))
+        return fetched
+
+    def apply(self, doc: dict, fetched: dict):
+        kind = doc.get('type')
+        context = doc.get('context', {})
+
+        if kind in ('REGION', 'DUNGEON-NEW', 'DUNGEON-DEL'):
+            self.region = fetched.get('region')
+            if kind == 'DUNGEON-NEW':
+                self._store(self.dungeons, context.get('dungeon'), fetched.get('dungeon'))
+            elif kind == 'DUNGEON-DEL':
+                self.dungeons.pop(context.get('dungeon'), None)
+        elif kind == 'DUNGEONS':
+            if self.region:
+                self.region['dungeons'] = doc.get('coords', {})
+        elif kind == 'BANDS':
+            self.bands = {b['id']: b for b in fetched.get('bands', [])}
+        elif kind == 'BAND':
+            band = fetched.get('band')
+            self._store(self.bands, context.get('band'), band if band and band.get('active', True) else None)
+        elif kind == 'EXPEDITION-NEW':
+            self._store(self.expeditions, context.get('expedition'), fetched.get('expedition'))
+        elif kind == 'EXPEDITION-DEL':
+            self.expeditions.pop(context.get('expedition'), None)
+        elif kind == 'CURSOR':
+            expedition = self.expeditions.get(context.get('expedition'))
+            if expedition is not None:
+                expedition['location'] = doc.get('coords')
+        elif kind == 'BATTLE-UPDATE':
+            self._battle_update(context, doc.get('details', {}))
+        else:
+            # narrative and battle start/end don't touch state
+            return
+
+        self.encoded = None
+
+    def _battle_update(self, context: dict, details: dict):
+        # delver hit points aren't part of the snapshot, monsters live in their dungeon's rooms
+        dungeon = self.dungeons.get(context.get('dungeon'))
+        if dungeon is None:
+            return
+        for room in dungeon.get('rooms', []):
+            for occupant in room.get('occ', []):
+                if occupant.get('id') == details.get('target'):
+                    occupant['chp'] = details.get('newhp')
+                    occupant['status'] = details.get('status')
+
+    async def _region(self):
+        region = await self.db.regions.find_one({}, NO_ID)
+        if region is not None:
+            region['city'] = await self.db.cities.find_one({}, NO_ID)
+        return region
+
+    async def _find(self, collection, id: str):
+        if id is None:
+            return None
+        return await collection.find_one({'id': id}, NO_ID)
+
+    def _store(self, entities: dict, id: str, doc: dict):
+        if id is None:
+            return
+        if doc is None:
+            entities.pop(id, None)
+        else:
+            entities[id] = doc
+
+class CacheEntry:
+    def __init__(self, body: bytes, etag: str, expires: float):
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+
+class ResponseCache:
+    '''
+        Encoded responses for the read endpoints, keyed by endpoint and id and dropped when a feed
+        message says that data changed. Each entry carries an ETag so a client that sends it back
+        in If-None-Match gets an empty 304 instead of the body.
+
+        An entry is only stored if nothing evicted its endpoint while it was being fetched, so a
+        slow read can't put back data that a message has already made stale.
+    '''
+
+    # which endpoints each message type makes stale
+    EVICTS = {
+        'REGION': ('region', 'cities'),
+        'DUNGEONS': ('region',),
+        'DUNGEON-NEW': ('region', 'dungeons'),
+        'DUNGEON-DEL': ('region', 'dungeons'),
+        'BANDS': ('bands', 'band', 'cities'),
+        'BAND': ('bands', 'band')
+    }
+    # endpoints with an id, evicted for just the id named in the message context when there is one
+    SCOPED = {'band': 'band'}
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self.entries = defaultdict(dict)
+        self.generations = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    async def respond(self, request: Request, endpoint: str, id, fetch):
+        entry = self.entries[endpoint].get(id)
+        if entry is None or entry.expires < time.monotonic():
+            self.misses += 1
+            generation = self.generations[endpoint]
+            body = json.dumps(jsonable_encoder(await fetch()), ensure_ascii=False, separators=(',', ':')).encode()
+            entry = CacheEntry(body, '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest()), time.monotonic() + self.ttl)
+            if self.generations[endpoint] == generation:
+                self.entries[endpoint][id] = entry
+        else:
+            self.hits += 1
+
+        if entry.etag in self._tags(request.headers.get('if-none-match')):
+            self.not_modified += 1
+            return Response(status_code=304, headers={'ETag': entry.etag})
+        return Response(entry.body, media_type='application/json', headers={'ETag': entry.etag})
+
+    def invalidate(self, doc: dict):
+        context = doc.get('context', {})
+        for endpoint in ResponseCache.EVICTS.get(doc.get('type'), ()):
+            self.generations[endpoint] += 1
+            id = context.get(ResponseCache.SCOPED.get(endpoint))
+            if id is not None:
+                self.entries[endpoint].pop(id, None)
+            else:
+                self.entries[endpoint].clear()
+
+    def clear(self):
+        for endpoint in list(self.entries):
+            self.generations[endpoint] += 1
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            'entries': sum(len(e) for e in self.entries.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified
+        }
+
+    def _tags(self, header: str):
+        if not header:
+            return ()
+        # a weak match is good enough for a GET
+        return [t.strip().removeprefix('W/') for t in header.split(',')]
+
+class Subscriber:
+    def __init__(self, websocket: WebSocket, cursor: int, snapshot: bytes = None):
+        self.websocket = websocket
+        # sequence number of the last message handed to this socket
+        self.cursor = cursor
+        # sent ahead of any feed messages when the client asked for one
+        self.snapshot = snapshot
+        self.dropped = 0
+        self.task = None
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+    '''
+        Fans feed messages out to the websocket clients. Messages go into one shared, bounded log
+        and every connection has its own sender task working through the log at its own pace, so
+        broadcasting is an append no matter how many clients there are and a slow client only
+        holds itself up.
+
+        A client that falls more than backlog messages behind is a slow consumer. With the
+        drop-oldest policy it skips ahead to the oldest message still held, with disconnect it
+        gets closed and can reconnect when it's ready. A client that can't take a single message
+        within send_timeout seconds is treated as dead and closed under either policy.
+
+        With a WorldState attached every message is applied to it and tagged with its sequence
+        number before it goes out, and a client can ask for a snapshot on connect. Applying and
+        publishing happen together without an await in between, so a snapshot tagged n reflects
+        exactly the messages up to n and the client's feed carries on from n + 1. Any Mongo reads
+        a message needs are done before that, overlapping with earlier messages, and each message
+        then waits for the one before it so the feed keeps its order.
+    '''
+
+    DROP_OLDEST = 'drop-oldest'
+    DISCONNECT = 'disconnect'
+
+    def __init__(self, backlog: int = 1000, policy: str = DROP_OLDEST, send_timeout: float = 10):
+        if policy not in (ConnectionManager.DROP_OLDEST, ConnectionManager.DISCONNECT):
+            raise ValueError('Unknown slow consumer policy: {}'.format(policy))
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.messages = deque(maxlen=backlog)
+        # sequence number of the newest message in the log
+        self.sequence = 0
+        self.wakeup = asyncio.Event()
+        self.wakeup_scheduled = False
+        self.active_connections: dict[WebSocket, Subscriber] = {}
+        self.dropped = 0
+        self.disconnected = 0
+        self.world = None
+        self.cache = None
+        # done once the latest broadcast has been published, the next one waits on it
+        self.last_broadcast = None
+
+    async def initialize(self, host: str, world: WorldState = None, cache: ResponseCache = None):
+        self.world = world
+        self.cache = cache
 
-    async def initialize(self, host: str):
         self.rmq_connection = await aio_pika.connect_robust(host)
 
         self.channel = await self.rmq_connection.channel() 
@@ -42,25 +309,135 @@ class ConnectionManager:
         await self.queue.bind(self.exchange, routing_key='*')
         await self.queue.consume(self.broadcast)
 
-    async def connect(self, websocket: WebSocket):
-        LOG.info('!!! Websocket connect: {}.'.format(websocket))
+    async def connect(self, websocket: WebSocket, snapshot: bool = False):
+        LOG.info('Websocket connect: {}.'.format(websocket))
         await websocket.accept()
-        self.active_connections.append(websocket)
+        # new connections start from the next message, not the backlog
+        if snapshot and self.world:
+            subscriber = Subscriber(websocket, self.sequence, self.world.snapshot(self.sequence))
+        else:
+            subscriber = Subscriber(websocket, self.sequence)
+        subscriber.task = asyncio.create_task(self._send(subscriber))
+        self.active_connections[websocket] = subscriber
 
     def disconnect(self, websocket: WebSocket):
-        LOG.info('!!! Websocket disconnect {}'.format(websocket))
-        self.active_connections.remove(websocket)
+        subscriber = self.active_connections.pop(websocket, None)
+        if subscriber:
+            LOG.info('Websocket disconnect {}'.format(websocket))
+            if subscriber.task is not asyncio.current_task():
+                subscriber.task.cancel()
 
     async def broadcast(self, message: aio_pika.IncomingMessage):
-        LOG.info('!!! Websocket broadcasting {} to ({}) connections'.format(message.body, len(self.active_connections)))
-        for connection in self.active_connections:
-            if connection.application_state == WebSocketState.DISCONNECTED:
-                LOG.info('Skipping disconnected websocket {}'.format(connection))
-            else:
-                await connection.send_text(message.body)
+        previous = self.last_broadcast
+        done = asyncio.get_running_loop().create_future()
+        self.last_broadcast = done
+        try:
+            try:
+                doc = json.loads(message.body)
+            except ValueError:
+                doc = None
+            # only objects can carry a type and a seq, anything else is passed along as it came
+            if not isinstance(doc, dict):
+                doc = None
+            try:
+                fetched = await self.world.fetch(doc) if self.world and doc is not None else None
+            finally:
+                # a failed read still waits its turn, so the next message can't overtake earlier ones
+                if previous is not None:
+                    await previous
+
+            # nothing from here on awaits, see the class docs
+            if doc is None:
+                LOG.info('Passing along a feed message that is not a JSON object')
+                if self.cache:
+                    self.cache.clear()
+                self.publish(message.body)
+                return
+
+            if self.cache:
+                self.cache.invalidate(doc)
+            if self.world:
+                self.world.apply(doc, fetched)
+            doc['seq'] = self.sequence + 1
+            self.publish(json.dumps(doc).encode())
+        finally:
+            # the next message goes ahead even if this one failed
+            done.set_result(None)
+
+    def publish(self, body: bytes):
+        # message bodies are only worth formatting when someone is looking
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('Websocket broadcasting {} to ({}) connections'.format(body, len(self.active_connections)))
+        self.messages.append(body)
+        self.sequence += 1
+
+        # waking the senders touches every one of them, so leave it to the loop instead of doing
+        # it here, a burst of messages then only costs one wakeup
+        if not self.wakeup_scheduled:
+            self.wakeup_scheduled = True
+            asyncio.get_running_loop().call_soon(self._wake)
+
+    def _wake(self):
+        # everyone waiting on the old event wakes up, later waiters get the new one
+        self.wakeup_scheduled = False
+        wakeup = self.wakeup
+        self.wakeup = asyncio.Event()
+        wakeup.set()
+
+    async def _send(self, subscriber: Subscriber):
+        websocket = subscriber.websocket
+        try:
+            if subscriber.snapshot:
+                async with asyncio.timeout(self.send_timeout):
+                    await websocket.send_bytes(subscriber.snapshot)
+                subscriber.snapshot = None
+
+            while True:
+                if subscriber.cursor == self.sequence:
+                    await self.wakeup.wait()
+                    continue
+
+                oldest = self.sequence - len(self.messages) + 1
+                if subscriber.cursor + 1 < oldest:
+                    missed = oldest - subscriber.cursor - 1
+                    if self.policy == ConnectionManager.DISCONNECT:
+                        LOG.info('Closing slow websocket {}, {} messages behind'.format(websocket, missed))
+                        await self._close(websocket)
+                        break
+                    subscriber.dropped += missed
+                    self.dropped += missed
+                    subscriber.cursor = oldest - 1
+
+                # bump the cursor before the await so a publish during the send can't shift the index
+                body = self.messages[subscriber.cursor + 1 - oldest]
+                subscriber.cursor += 1
+                try:
+                    async with asyncio.timeout(self.send_timeout):
+                        await websocket.send_bytes(body)
+                except TimeoutError:
+                    LOG.info('Closing stuck websocket {}'.format(websocket))
+                    await self._close(websocket)
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # the socket died underneath us, the receive loop may never notice so clean up here
+            LOG.info('Dropping dead websocket {}: {}'.format(websocket, e))
+        finally:
+            self.disconnect(websocket)
+
+    async def _close(self, websocket: WebSocket):
+        self.disconnected += 1
+        try:
+            # 1013 is try again later, the close can stall on a full socket as well so don't wait long
+            async with asyncio.timeout(1):
+                await websocket.close(code=1013)
+        except Exception:
+            pass
 
-manager = ConnectionManager()
 settings = Settings()
+manager = ConnectionManager(settings.feed_backlog, settings.feed_slow_policy, settings.feed_send_timeout)
+cache = ResponseCache(settings.cache_ttl)
 app = FastAPI()
 
 origins = settings.api_origins.split(',')
@@ -74,130 +451,166 @@ app.add_middleware(
 )
 
 def db_session():
-    client = MongoClient('mongodb://{}:{}@{}:{}'.format(settings.mongo_user, settings.mongo_password, settings.mongo_host, settings.mongo_port))
-    db = client.dungeondb
-    try:
-        yield db
-    finally:
-        client.close()
+    return app.state.mongo.dungeondb
+
+async def read_events(db: AsyncDatabase, object_id: str, page: int, before: Union[str, None], transient: bool):
+    '''
+        Newest first events for one object. Each event carries its id, pass the last one back as
+        before to get the next page, that walks the (object, _id) index instead of skipping over
+        everything in front of it. Page numbers still work but get slower the deeper they go.
+        Transient events are the battle blow by blow, leave them out with transient=false.
+    '''
+    query = {'object': object_id}
+    if not transient:
+        query['transient'] = {'$ne': True}
+    if before is not None:
+        try:
+            query['_id'] = {'$lt': ObjectId(before)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail='Bad event id: {}'.format(before))
+
+    d = db.events.find(query).sort({'_id': -1})
+    if before is None:
+        d = d.skip((page - 1) * DEFAULT_PAGING)
+    events = await d.limit(DEFAULT_PAGING).to_list()
+    for e in events:
+        e['id'] = str(e.pop('_id'))
+        e.pop('expire_at', None)
+    return events
 
 @app.on_event("startup")
 async def startup_event():
-    await manager.initialize('amqp://{}:{}@{}/'.format(settings.rabbit_user, settings.rabbit_password, settings.rabbit_host))
+    # one async client for the life of the app, requests borrow connections from its pool
+    app.state.mongo = AsyncMongoClient(
+        'mongodb://{}:{}@{}:{}'.format(settings.mongo_user, settings.mongo_password, settings.mongo_host, settings.mongo_port),
+        maxPoolSize=settings.mongo_pool_size)
+
+    world = WorldState(app.state.mongo.dungeondb)
+    await world.load()
+    await manager.initialize('amqp://{}:{}@{}/'.format(settings.rabbit_user, settings.rabbit_password, settings.rabbit_host), world, cache)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await app.state.mongo.close()
 
 @app.get("/")
 def read_root():
     return {"Oh": "Hello there"}
 
 @app.get('/delver/')
-def read_delvers(db: Database = Depends(db_session)):
+async def read_delvers(db: AsyncDatabase = Depends(db_session)):
     ds = []
-    for d in db.delvers.find():
+    async for d in db.delvers.find():
         d.pop('_id')
         ds.append(d)
     return ds
 
 @app.get("/delver/{delver_id}")
-def read_delver(delver_id: UUID, db: Database = Depends(db_session)):
-    d = db.delvers.find_one({'id': str(delver_id)})
+async def read_delver(delver_id: UUID, db: AsyncDatabase = Depends(db_session)):
+    d = await db.delvers.find_one({'id': str(delver_id)})
     d.pop('_id')
     return d
 
 @app.get("/delver/{delver_id}/events")
-def read_delver_events(delver_id: UUID, db: Database = Depends(db_session), page: int = 1):
-    d = db.events.find({'object': str(delver_id)}, NO_ID).skip( (page - 1) * DEFAULT_PAGING).limit(DEFAULT_PAGING).sort({'_id': -1})
-    return list(d)
+async def read_delver_events(delver_id: UUID, db: AsyncDatabase = Depends(db_session), page: int = 1, before: Union[str, None] = None, transient: bool = True):
+    return await read_events(db, str(delver_id), page, before, transient)
 
 @app.get('/bands/')
-def read_bands(db: Database = Depends(db_session)):
-    bs = []
-    for b in db.bands.find({'active': True}):
-        b.pop('_id')
-        bs.append(b)
-    return bs
+async def read_bands(request: Request, db: AsyncDatabase = Depends(db_session)):
+    async def fetch():
+        return await db.bands.find({'active': True}, NO_ID).to_list()
+    return await cache.respond(request, 'bands', None, fetch)
 
 @app.get("/band/{band_id}")
-def read_band(band_id: UUID, db: Database = Depends(db_session), include_exp: bool = True):
-    b = db.bands.find_one({'id': str(band_id)}, NO_ID)
+async def read_band(request: Request, band_id: UUID, db: AsyncDatabase = Depends(db_session), include_exp: bool = True):
+    async def fetch():
+        return await db.bands.find_one({'id': str(band_id)}, NO_ID)
     if include_exp:
-        e = db.expeditions.find_one({}, NO_ID)
+        # the expedition changes on every step, so this one always goes to Mongo
+        b = await fetch()
+        e = await db.expeditions.find_one({}, NO_ID)
         b['expedition'] = e
-    return b
+        return b
+    return await cache.respond(request, 'band', str(band_id), fetch)
 
 @app.get("/band/{band_id}/delvers")
-def read_band_delvers(band_id: UUID, db: Database = Depends(db_session)):
-    band = db.bands.find_one({'id': str(band_id)})
-    delvers = list(db.delvers.find({'id': {'$in': band['members']}}))
+async def read_band_delvers(band_id: UUID, db: AsyncDatabase = Depends(db_session)):
+    band = await db.bands.find_one({'id': str(band_id)})
+    delvers = await db.delvers.find({'id': {'$in': band['members']}}).to_list()
     for d in delvers:
         d.pop('_id')
 
     return delvers
 
 @app.get("/band/{band_id}/events")
-def read_band(band_id: UUID, db: Database = Depends(db_session), page: int = 1):
-    d = db.events.find({'object': str(band_id)}, NO_ID).skip( (page - 1) * DEFAULT_PAGING).limit(DEFAULT_PAGING).sort({'_id': -1})
-    return list(d)
+async def read_band_events(band_id: UUID, db: AsyncDatabase = Depends(db_session), page: int = 1, before: Union[str, None] = None, transient: bool = True):
+    return await read_events(db, str(band_id), page, before, transient)
 
 @app.get("/dungeon/")
-def read_dungeons(db: Database = Depends(db_session)):
+async def read_dungeons(db: AsyncDatabase = Depends(db_session)):
     ds = []
-    for d in db.dungeons.find({"complete": False}):
+    async for d in db.dungeons.find({"complete": False}):
         d.pop('_id')
         ds.append(d)
     return ds
 
 @app.get("/dungeon/basic")
-def read_dungeons_basic(db: Database = Depends(db_session)):
-    return list(db.dungeons.find({}, {"_id": 0, "cells": 0, "rooms": 0}))
+async def read_dungeons_basic(request: Request, db: AsyncDatabase = Depends(db_session)):
+    async def fetch():
+        return await db.dungeons.find({}, {"_id": 0, "cells": 0, "rooms": 0}).to_list()
+    return await cache.respond(request, 'dungeons', None, fetch)
 
 @app.get("/dungeon/{dungeon_id}")
-def read_dungeon(dungeon_id: UUID, db: Database = Depends(db_session)):
-    d = db.dungeons.find_one({'id': str(dungeon_id)})
+async def read_dungeon(dungeon_id: UUID, db: AsyncDatabase = Depends(db_session)):
+    d = await db.dungeons.find_one({'id': str(dungeon_id)})
     d.pop('_id')
     return d
 
 @app.get("/expeditions/")
-def read_active_expedition(db: Database = Depends(db_session)):
-    return list(db.expeditions.find({"complete": False}, {"_id": 0}))
+async def read_active_expedition(db: AsyncDatabase = Depends(db_session)):
+    return await db.expeditions.find({"complete": False}, {"_id": 0}).to_list()
 
 @app.get("/expedition/{exp_id}")
-def read_expedition(exp_id: UUID, db: Database = Depends(db_session)):
-    e = db.expeditions.find_one({'id': str(exp_id)})
+async def read_expedition(exp_id: UUID, db: AsyncDatabase = Depends(db_session)):
+    e = await db.expeditions.find_one({'id': str(exp_id)})
     e.pop('_id')
     return e
 
 # deprecated
 @app.get("/expedition/{exp_id}/delvers")
-def read_expedition_delvers(exp_id: UUID, db: Database = Depends(db_session)):
-    exp = db.expeditions.find_one({'id': str(exp_id)})
-    delvers = list(db.delvers.find({'id': {'$in': exp['party']}}))
+async def read_expedition_delvers(exp_id: UUID, db: AsyncDatabase = Depends(db_session)):
+    exp = await db.expeditions.find_one({'id': str(exp_id)})
+    delvers = await db.delvers.find({'id': {'$in': exp['party']}}).to_list()
     for d in delvers:
         d.pop('_id')
 
     return delvers
 
 @app.get("/region/")
-def read_region(db: Database = Depends(db_session)):
-    r = db.regions.find_one({}, NO_ID)
-    c = db.cities.find_one({}, NO_ID)
-    r['city'] = c
-    return r
+async def read_region(request: Request, db: AsyncDatabase = Depends(db_session)):
+    async def fetch():
+        r = await db.regions.find_one({}, NO_ID)
+        c = await db.cities.find_one({}, NO_ID)
+        r['city'] = c
+        return r
+    return await cache.respond(request, 'region', None, fetch)
 
 @app.get("/cities/")
-def read_region(db: Database = Depends(db_session)):
-    c = db.cities.find_one({}, NO_ID)
-    return c
+async def read_cities(request: Request, db: AsyncDatabase = Depends(db_session)):
+    async def fetch():
+        return await db.cities.find_one({}, NO_ID)
+    return await cache.respond(request, 'cities', None, fetch)
 
 @app.get("/region/events")
-def read_region_events(db: Database = Depends(db_session), page: int = 1):
-    r = db.regions.find_one({}, NO_ID)
-    d = db.events.find({'object': r['id']}, NO_ID).skip( (page - 1) * DEFAULT_PAGING).limit(DEFAULT_PAGING).sort({'_id': -1})
-    return list(d)
+async def read_region_events(db: AsyncDatabase = Depends(db_session), page: int = 1, before: Union[str, None] = None, transient: bool = True):
+    r = await db.regions.find_one({}, NO_ID)
+    return await read_events(db, r['id'], page, before, transient)
 
 @app.websocket("/feed/dungeon")
 # async def websocket_endpoint(websocket: WebSocket, queue: aio_pika.Queue = Depends(mq_channel)):
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, snapshot: bool = False):
+    # snapshot=true gets the current world state first, see WorldState
+    await manager.connect(websocket, snapshot)
     try:
         while True:
             # the client isn't currently sending us anything but this is the correct move
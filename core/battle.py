@@ -5,9 +5,6 @@ import uuid
 import core.dice
 import core.critters
 
-# this is bad, but the emitter system needs an overhaul so we can live with this for now
-from core.mdb import MongoService 
-
 from definitions.model import Moves
 
 class Team:
@@ -53,7 +50,7 @@ class Battle:
     BATTAL = 2
     OVER = 3
 
-    def __init__(self, processCallback, emitter):
+    def __init__(self, processCallback, emitter, eventSaver=None):
         self.teams = {}
         self.teamCount = 0
         self.conditions = []
@@ -62,6 +59,7 @@ class Battle:
         self.roundCount = 0
         self.processCallback = processCallback
         self.emitter = emitter
+        self.eventSaver = eventSaver
 
     def start(self):
         self.processMessage('Lets fight!')
@@ -81,6 +79,11 @@ class Battle:
         if callable(self.emitter):
             self.emitter(message)
 
+    def saveEvent(self, type, objects, message):
+        # battle chatter is only interesting while it's happening so it's always transient
+        if callable(self.eventSaver):
+            self.eventSaver(type, objects, message, True)
+
     def round(self):
         return self.roundCount
 
@@ -256,7 +259,7 @@ class Battle:
 
         self.processMessage(descriptor)
 
-        MongoService.save_event('battle', [fellah.id, target.id], descriptor, True)
+        self.saveEvent('battle', [fellah.id, target.id], descriptor)
         self.emit({
             'type': 'NARRATIVE',
             'message': descriptor
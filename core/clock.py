@@ -0,0 +1,37 @@
+import time
+
+
+class RealClock:
+    '''
+        Ties simulated time to the wall clock, one simulated second per real second.
+    '''
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.simulated = 0
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+            self.simulated += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def rate(self):
+        # simulated seconds per wall second
+        elapsed = self.elapsed()
+        return self.simulated / elapsed if elapsed else 0
+
+
+class VirtualClock(RealClock):
+    '''
+        Fast forward clock, waiting is instant so the DM runs the same event sequence as fast as it can.
+    '''
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.simulated += seconds
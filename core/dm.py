@@ -1,10 +1,13 @@
 import random
-import time
 
+from core.clock import RealClock
 from core.dice import Dice
 import core.dungeon.generate
+from core.dungeon.pool import DungeonPool
 import core.expedition
+from core.mdb import Persister
 import core.region
+from core.scheduler import Scheduler
 
 
 class DungeonMaster:
@@ -24,17 +27,43 @@ class DungeonMaster:
         'exp_delay': 500 # time after an expedition before a band can start another to allow downtime
     }
 
+    DUNGEON_SETTINGS = {
+        'DEFAULT_HEIGHT': 10,
+        'DEFAULT_WIDTH': 30,
+        'ROOM_HEIGHT_RANGE': (3,4),
+        'ROOM_WIDTH_RANGE': (3,8),
+        'MAX_SPARENESS_RUNS': 5,
+        'MAX_ROOM_ATTEMPTS': 100,
+        # flat array maps, carved with the numpy passes when numpy is installed
+        'COMPACT_GRID': True,
+        'VECTORIZE': True
+    }
+
     def __init__(self, options):
         self.db = options.get('db')
         self.emitfn = options.get('rabbit')
         self.outputfn = options.get('output')
         self.band_count = options.get('bands')
         self.dungeon_count = options.get('dungeons')
+        self.clock = options.get('clock') or RealClock()
+
+        # size of the pre-generated dungeon stock, zero or missing means always generate inline
+        self.pool = None
+        if options.get('pool'):
+            self.pool = DungeonPool(DungeonMaster.DUNGEON_SETTINGS, options.get('pool'), options.get('pool_workers'))
+
+        # everything that persists goes through the same backend as the DM's own events
+        if self.db:
+            Persister.service = self.db
     
     def eventsaver(self, type, object, msg, transient=False):
         self.db.save_event(type, object, msg, transient)
 
     def setup(self):
+        # get the workers carving while everything else is built
+        if self.pool:
+            self.pool.top_up()
+
         # build region
         self.region = core.region.RegionGenerate.generate_region()
         self.region.save()
@@ -59,7 +88,7 @@ class DungeonMaster:
         self.region.persist()
         self.region.emit_dungeon_locales()
 
-        self.to_do = []
+        self.to_do = Scheduler()
         self.current_time = 1
 
         # setup initial recurring todos
@@ -85,17 +114,19 @@ class DungeonMaster:
                 time = duration
             task['schedule'] = self.current_time + time
 
-        self.to_do.append(task)
+        self.to_do.add(task)
+
+    def shutdown(self):
+        if self.pool:
+            self.pool.shutdown()
+        # push out anything the db is still holding on to
+        if self.db:
+            self.db.flush()
 
     def build_dungeon(self):
-        dungeon = core.dungeon.generate.DungeonFactoryAlpha.generateDungeon({
-                'DEFAULT_HEIGHT': 10,
-                'DEFAULT_WIDTH': 30,
-                'ROOM_HEIGHT_RANGE': (3,4),
-                'ROOM_WIDTH_RANGE': (3,8),
-                'MAX_SPARENESS_RUNS': 5,
-                'MAX_ROOM_ATTEMPTS': 100
-            })
+        dungeon = self.pool.take() if self.pool else None
+        if dungeon is None:
+            dungeon = core.dungeon.generate.DungeonFactoryAlpha.generateDungeon(DungeonMaster.DUNGEON_SETTINGS)
 
         for room in dungeon.rooms:
             for i in range(4):
@@ -119,8 +150,10 @@ class DungeonMaster:
 
         return band
 
-    def run(self):
-        while True:
+    def run(self, until=None):
+        # until is a simulated time to stop at, otherwise this runs forever
+        self.clock.start()
+        while until is None or self.current_time < until:
             print('New loop, time: {}'.format(self.current_time))
             dungeon_changes = False
 
@@ -134,7 +167,7 @@ class DungeonMaster:
 
             # 2. Check to see if any bands don't have anything to do
             for band_id, band in self.bands.items():
-                if not any(t.get('id') == band_id for t in self.to_do):
+                if not self.to_do.has_pending(band_id):
                     print('Band {} has nothing to do'.format(band.name))
 
                     # possible actions
@@ -167,9 +200,8 @@ class DungeonMaster:
                     
             # 3. Find the soonest action
 
-            self.to_do.sort(key=lambda a: a['schedule'])
-            do = self.to_do.pop(0)
-            time.sleep(do['schedule'] - self.current_time)
+            do = self.to_do.pop()
+            self.clock.sleep(do['schedule'] - self.current_time)
             self.current_time = do['schedule']
 
             f = getattr(self, 'action_' + do['action'])
@@ -180,6 +212,9 @@ class DungeonMaster:
             if dungeon_changes:
                 self.region.emit_dungeon_locales()
 
+            # write behind storage only goes out when its batch is due
+            self.db.maybe_flush()
+
 
     def action_exp(self, do):
         band = self.bands[do['id']]
@@ -187,15 +222,16 @@ class DungeonMaster:
 
         if exp.over():
 
+            # the API reads these back when the messages arrive, so they get written first
             self.region.remove_dungeon(exp.dungeon)
-            self.region.emit_del_dungeon(exp.dungeon.id)
             self.region.persist()
 
             exp.dungeon.complete = True
             exp.dungeon.persist()
+            exp.persist()
 
+            self.region.emit_del_dungeon(exp.dungeon.id)
             exp.emit_delete()
-            exp.persist()
             dungeon_changes = True
 
             del self.expeditions[band.id]
@@ -204,6 +240,7 @@ class DungeonMaster:
             if exp.failed():
                 self.region.emit_narrative('{} have been defeated with the dungeon, who knows if any survive.'.format(band.name), band.id)
                 del self.bands[band.id]
+                self.to_do.cancel_all(band.id)
                 band.active = False
                 band.persist()
             else:
@@ -228,6 +265,7 @@ class DungeonMaster:
 
             exp.register_emitter(self.emitfn)
             exp.register_processor(self.outputfn)
+            exp.register_event(self.eventsaver)
             exp.emit_new()
             self.region.emit_narrative('{} have planned an expedition to {}.'.format(band.name, dungeon.name), band.id)
 
@@ -246,9 +284,10 @@ class DungeonMaster:
         self.region.place_dungeon(d)
         self.dungeon_changes = True
 
+        self.region.persist()
+
         self.region.emit_narrative('{} have been asking around and heard rumors about the location of {}.'.format(band.name, d.name), band.id)
         self.region.emit_new_dungeon(d)
-        self.region.persist()
 
         # adding a little extra chance to keep the dungeon count topped up
         if random.choice([True, False]):
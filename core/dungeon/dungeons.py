@@ -1,6 +1,9 @@
 import uuid
 import json
+import base64
+import re
 
+from array import array
 from typing import NamedTuple
 from enum import IntEnum
 
@@ -14,6 +17,12 @@ class Dungeon(Persister):
         it can be child classed into block/wall versions later if needed
     '''
 
+    # every step costs the same, see getWeight, so pathfinding can skip the weighted search
+    UNIFORM_WEIGHT = True
+
+    # the layout is finished before the dungeon is first saved, see state_format
+    IMMUTABLE = ('cells',)
+
     def __init__(self, serialized=None):
 
         self.id = str(uuid.uuid1())        
@@ -23,23 +32,37 @@ class Dungeon(Persister):
         # gonna solve that right now
         self.regionPalette = 1
         self.region_map = {}
+        # room number (1 based, see Room.num) of every room cell, kept up to date by carveRoom
+        self.room_index = {}
         self.complete = False
 
         self.name = strings.StringTool.random('dungeon_names')
 
         if serialized:
-            document = json.loads(serialized)
-            self.initialize(document.get('height'), document.get('width'))
+            # either the serialize() string or a stored data_format() document
+            document = json.loads(serialized) if isinstance(serialized, str) else serialized
+            height = document.get('height')
+            width = document.get('width')
 
-            for code, coords in document.get('cells', {}).items():
-                type = int(code[1])
-                for c in coords:
-                    self.getCell(c[0], c[1]).type = type
+            cells = document.get('cells', {})
+            if isinstance(cells, str):
+                cells = json.loads(cells)
+
+            if cells.get('v') == CELL_FORMAT:
+                self.load_tiles(height, width, decode_tiles(cells['rle'], height * width))
+            else:
+                # the original layout, a list of coordinates per tile type
+                self.initialize(height, width)
+                for code, coords in cells.items():
+                    type = Tiles(int(code[1]))
+                    for c in coords:
+                        self.update_cell((c[0], c[1]), type)
 
             for r in document.get('rooms', []):
                 room = Room(serialized = r)
                 self.rooms.append(room)
-                room.num = self.rooms.index(room) + 1
+                room.num = len(self.rooms)
+                self.index_room(room)
 
     def initialize(self, height, width):
         for i in range(height):
@@ -95,14 +118,28 @@ class Dungeon(Persister):
     def allRoomCells(self, roomNo):
         # a bit more efficient than making room no an allCells filter
         if type(roomNo) == Room:
-            roomNo = self.rooms.index(roomNo)
-        room = self.rooms[roomNo]
+            room = roomNo
+        else:
+            room = self.rooms[roomNo]
         cells = []
         for i in range(room.height):
             for j in range(room.width):
-                cells.append(self.grid[i + room.coords[0]][j + room.coords[1]])
+                cells.append(self.getCell(i + room.coords[0], j + room.coords[1]))
         return cells
 
+    def rows(self):
+        # row by row access for the display code
+        return self.grid
+
+    def tile_bytes(self):
+        # every tile type in row order, one byte each
+        return bytes(c.type for row in self.grid for c in row)
+
+    def load_tiles(self, height, width, tiles):
+        # builds the whole grid from tile_bytes() output, in place of initialize
+        types = {t: Tiles(t) for t in set(tiles)}
+        self.grid = [[view(DungeonCell, (i, j, types[t])) for j, t in enumerate(tiles[i * width:(i + 1) * width])] for i in range(height)]
+
     def getNeighbors(self, cell):
         # get all the navigable neighbors of this cell
         # return [x for x in cell.all() if x]
@@ -114,10 +151,18 @@ class Dungeon(Persister):
 
     # def getRoomForCell(self, cell):
     def roomAt(self, cell):
-        for room in self.rooms:
-            if cell in room:
-                return room
-        return None
+        number = self.room_number(cell)
+        return self.rooms[number - 1] if number else None
+
+    def room_number(self, cell):
+        if cell is None:
+            return 0
+        return self.room_index.get((cell[0], cell[1]), 0)
+
+    def index_room(self, room):
+        for i in range(room.coords[0], room.coords[0] + room.height):
+            for j in range(room.coords[1], room.coords[1] + room.width):
+                self.room_index[(i, j)] = room.num
 
     def roomBrethren(self, cell):
         # get all the cells that match the room of a given cell
@@ -125,7 +170,7 @@ class Dungeon(Persister):
         return self.allRoomCells(r)
 
     def basicPrint(self):
-        for index, row in enumerate(self.grid):
+        for index, row in enumerate(self.rows()):
 
             display = '{}: '.format(str(index).rjust(4, ' '))
 
@@ -135,7 +180,7 @@ class Dungeon(Persister):
             print(display)
 
     def prettyPrint(self, highlight=None):
-        for index, row in enumerate(self.grid):
+        for index, row in enumerate(self.rows()):
 
             display = '{}: '.format(str(index).rjust(4, ' '))
 
@@ -144,7 +189,7 @@ class Dungeon(Persister):
                     display += 'P'
                 elif cell.type == Tiles.ROOM:
                     room = self.roomAt(cell)
-                    roomNumber = self.rooms.index(room) + 1
+                    roomNumber = room.num
 
                     # currently this expects min room dimensions of 3 and will break if the total room counts is 3 digits
                     displayLine = room.coords[0] + int(room.height / 2)
@@ -165,12 +210,18 @@ class Dungeon(Persister):
 
             print(display)
 
+    # keyed by position, so a cell stays in its region when its tile changes
     def region_for(self, cell):
-        return self.region_map.get(cell, None)
+        if cell is None:
+            return None
+        return self.region_map.get((cell[0], cell[1]), None)
+
+    def set_region(self, cell, region):
+        self.region_map[(cell[0], cell[1])] = region
 
     def regionPrint(self):
 
-        for index, row in enumerate(self.grid):
+        for index, row in enumerate(self.rows()):
 
             display = '{}: '.format(str(index).rjust(4, ' '))
 
@@ -181,7 +232,12 @@ class Dungeon(Persister):
             print(display)
 
     def data_format(self):
-        box = {
+        box = self.state_format()
+        box['cells'] = self.encode_cells()
+        return box
+
+    def state_format(self):
+        return {
             'id': self.id,
             'name': self.name,
             'complete': self.complete,
@@ -190,36 +246,20 @@ class Dungeon(Persister):
             'rooms': [r.serialize() for r in self.rooms]
         }
 
-        cells = {}
-        for t in DungeonCell.REAL:
-            code = 't' + str(t)
-            cells[code] = []
-            for cell in self.allCells():
-                if cell.type == t:
-                    cells[code].append((cell.h, cell.w))
-        box['cells'] = json.dumps(cells)
-
-        return box
-
     def serialize(self, includeOccupants=False):
         # just need a basic way to encode the dungeon as a single string, nothing fancy
         box = {
             'width': self.width(),
             'height': self.height(),
-            'cells': {},
+            'cells': self.encode_cells(),
             'rooms': [r.serialize() for r in self.rooms]
         }
 
-        # TODO: save some space by switching to a single string approach
-        for t in DungeonCell.REAL:
-            code = 't' + str(t)
-            box['cells'][code] = []
-            for cell in self.allCells():
-                if cell.type == t:
-                    box['cells'][code].append(cell.coords)
-
         return json.dumps(box)
 
+    def encode_cells(self):
+        return {'v': CELL_FORMAT, 'rle': encode_tiles(self.tile_bytes())}
+
     # all the purely construction functions
 
     def newRegion(self):
@@ -266,25 +306,27 @@ class Dungeon(Persister):
         room.coords = coords
 
         self.rooms.append(room)
-        room.num = self.rooms.index(room) + 1
+        room.num = len(self.rooms)
+        self.index_room(room)
+        self.fill_room(room)
 
-        top_bound = coords[0]
-        bottom_bound = coords[0] + room.height
+        self.newRegion()
+
+    def fill_room(self, room):
+        top_bound = room.coords[0]
+        bottom_bound = room.coords[0] + room.height
 
-        left_bound = coords[1]
-        right_bound = coords[1] + room.width
+        left_bound = room.coords[1]
+        right_bound = room.coords[1] + room.width
 
         for i in range(top_bound, bottom_bound):
             for j in range(left_bound, right_bound):
-                self.update_cell((i, j), Tiles.ROOM)
-                self.region_map[self.grid[i][j]] = self.regionPalette
-                
-        self.newRegion()
+                self.set_region(self.update_cell((i, j), Tiles.ROOM), self.regionPalette)
 
     def carvePassage(self, cell):
         # cells are immutable, so only work with the new one
         newcell = self.update_cell(cell, Tiles.PASSAGE)
-        self.region_map[newcell] = self.regionPalette
+        self.set_region(newcell, self.regionPalette)
         return newcell
 
     def isSafeCarvable(self, cell, ignore=[]):
@@ -319,6 +361,30 @@ class Dungeon(Persister):
 
         return options
 
+# Cell layout written by data_format and serialize. Version 2 is the tile type of every cell in row
+# order, run length encoded as (count, tile) byte pairs with runs of at most 255, then base64'd so it
+# survives JSON. Documents without a version are the original per type coordinate lists.
+CELL_FORMAT = 2
+
+# a run of one repeated byte, capped to what fits in the count byte
+TILE_RUN = re.compile(rb'(.)\1{0,254}', re.DOTALL)
+
+def encode_tiles(tiles):
+    runs = bytearray()
+    for match in TILE_RUN.finditer(tiles):
+        runs.append(match.end() - match.start())
+        runs.append(tiles[match.start()])
+    return base64.b64encode(runs).decode('ascii')
+
+def decode_tiles(encoded, size):
+    runs = base64.b64decode(encoded)
+    tiles = bytearray()
+    for i in range(0, len(runs) - 1, 2):
+        tiles += runs[i + 1:i + 2] * runs[i]
+    if len(tiles) != size:
+        raise ValueError('Encoded cells cover {} tiles, expected {}'.format(len(tiles), size))
+    return tiles
+
 class Tiles(IntEnum):
     SOLID = 1
     ROOM = 2
@@ -434,17 +500,181 @@ class DungeonCell(NamedTuple):
         else:
             return [self.type, self.h, self.w]
 
+# builds a cell straight from a tuple, skipping the NamedTuple constructor which is most of the cost of a view
+view = tuple.__new__
+
+
+class CompactDungeon(Dungeon):
+    '''
+        The same dungeon stored as flat arrays instead of a grid of cell tuples: one byte per tile
+        type plus an int per cell for the generation region (0 is no region).
+
+        DungeonCell objects are only built when something asks for one, so they are read only views,
+        and updating a tile is just a byte write. Regions are kept by position, so a cell keeps its
+        region when its tile changes.
+    '''
+
+    # tile byte -> Tiles, so views don't pay for an enum lookup
+    TILE_TYPES = [None] + [Tiles(t) for t in DungeonCell.ALL_TYPE]
+
+    @property
+    def grid(self):
+        # full grid of views, only here for code that wants the nested lists
+        return list(self.rows())
+
+    @grid.setter
+    def grid(self, rows):
+        self._height = len(rows)
+        self._width = len(rows[0]) if rows else 0
+        self.tiles = bytearray(c.type for row in rows for c in row)
+        self.regions = array('I', bytes(4 * len(self.tiles)))
+        self.room_index = array('H', bytes(2 * len(self.tiles)))
+
+    def initialize(self, height, width):
+        self._height = height
+        self._width = width
+        self.tiles = bytearray([Tiles.SOLID]) * (height * width)
+        self.regions = array('I', bytes(4 * height * width))
+        self.room_index = array('H', bytes(2 * height * width))
+
+    def height(self):
+        return self._height
+
+    def width(self):
+        return self._width
+
+    def getCell(self, x, y):
+        if x < 0 or y < 0 or x >= self._height or y >= self._width:
+            return None
+        return view(DungeonCell, (x, y, CompactDungeon.TILE_TYPES[self.tiles[x * self._width + y]]))
+
+    def set_tile(self, x, y, newtype):
+        self.tiles[x * self._width + y] = newtype
+
+    def update_cell(self, cell, newtype):
+        self.tiles[cell[0] * self._width + cell[1]] = newtype
+        return view(DungeonCell, (cell[0], cell[1], CompactDungeon.TILE_TYPES[newtype]))
+
+    def allCells(self, typeFilter=None, navigable=None):
+        if navigable:
+            wanted = DungeonCell.NAVIGABLE
+        elif typeFilter != None:
+            wanted = [typeFilter]
+        else:
+            wanted = DungeonCell.ALL_TYPE
+
+        width = self._width
+        types = CompactDungeon.TILE_TYPES
+        return [view(DungeonCell, (i // width, i % width, types[t])) for i, t in enumerate(self.tiles) if t in wanted]
+
+    def rows(self):
+        types = CompactDungeon.TILE_TYPES
+        for i in range(self._height):
+            start = i * self._width
+            yield [view(DungeonCell, (i, j, types[t])) for j, t in enumerate(self.tiles[start:start + self._width])]
+
+    def tile_bytes(self):
+        return bytes(self.tiles)
+
+    def load_tiles(self, height, width, tiles):
+        self.initialize(height, width)
+        self.tiles[:] = tiles
+
+    def region_for(self, cell):
+        if cell is None:
+            return None
+        region = self.regions[cell[0] * self._width + cell[1]]
+        return region if region else None
+
+    def set_region(self, cell, region):
+        self.regions[cell[0] * self._width + cell[1]] = region
+
+    def room_number(self, cell):
+        if cell is None:
+            return 0
+        return self.room_index[cell[0] * self._width + cell[1]]
+
+    def index_room(self, room):
+        numbers = array('H', [room.num]) * room.width
+        for i in range(room.coords[0], room.coords[0] + room.height):
+            start = i * self._width + room.coords[1]
+            self.room_index[start:start + room.width] = numbers
+
+    def fill_room(self, room):
+        tiles = bytes([Tiles.ROOM]) * room.width
+        regions = array('I', [self.regionPalette]) * room.width
+        for i in range(room.coords[0], room.coords[0] + room.height):
+            start = i * self._width + room.coords[1]
+            self.tiles[start:start + room.width] = tiles
+            self.regions[start:start + room.width] = regions
+
+    # offsets for the orthogonal neighbors followed by the diagonals, the same order as cell.all() + cell.extras()
+    NEIGHBORHOOD = [(-1, 0), (1, 0), (0, 1), (0, -1), (-1, 1), (-1, -1), (1, 1), (1, -1)]
+
+    def isSafeCarvable(self, cell, ignore=[]):
+        skip = {(c[0], c[1]) for c in ignore if c is not None}
+        return self._safe(cell[0], cell[1], skip, None in ignore)
+
+    def getPossibleCarves(self, cell, ignores=[]):
+        # same rules as the grid version, just reading bytes instead of building cells to test
+        skip = {(c[0], c[1]) for c in cell.all()}
+        skip.add((cell[0], cell[1]))
+        # off map neighbors show up as None in the grid version's ignore list, which lets edges through
+        skip_edges = any(self.getCell(*c) is None for c in cell.all())
+
+        options = []
+        for dir in Directions:
+            x, y = cell.byCode(dir)
+            if x < 0 or y < 0 or x >= self._height or y >= self._width:
+                continue
+            if self.tiles[x * self._width + y] != Tiles.PASSAGE and self._safe(x, y, skip, skip_edges):
+                options.append(dir)
+
+        return options
+
+    def _safe(self, x, y, skip, skip_edges):
+        height = self._height
+        width = self._width
+        tiles = self.tiles
+        for dx, dy in CompactDungeon.NEIGHBORHOOD:
+            nx = x + dx
+            ny = y + dy
+            if (nx, ny) in skip:
+                continue
+            if nx < 0 or ny < 0 or nx >= height or ny >= width:
+                if skip_edges:
+                    continue
+                return False
+            if tiles[nx * width + ny] != Tiles.SOLID:
+                return False
+        return True
+
+    def canRoomFit(self, room, coords):
+        if coords[0] == 0 or coords[1] == 0:
+            return False
+        if room.height + coords[0] >= self._height:
+            return False
+        if room.width + coords[1] >= self._width:
+            return False
+
+        # the room plus a one cell border all has to be solid
+        span = room.width + 2
+        for i in range(coords[0] - 1, coords[0] + room.height + 1):
+            start = i * self._width + coords[1] - 1
+            if self.tiles[start:start + span].count(Tiles.SOLID) != span:
+                return False
+        return True
+
 class Room:
 
     def __init__(self, coords=None, props=None, serialized=None):
         if serialized:
-            i = serialized['i']
-            self.height = i[0]
-            self.width = i[1]
-            self.coords = (i[2], i[3])
+            self.height, self.width = serialized['d']
+            self.coords = tuple(serialized['c'])
             self.locals = []
-            self.num = 0
-            for o in serialized['occ']:
+            self.num = serialized.get('n', 0)
+            # empty rooms don't write out an occupant list
+            for o in serialized.get('occ', []):
                 self.populate(core.critters.Monster(serialized=o))
         else:
             if not props.get('height', None):
@@ -1,13 +1,226 @@
 import random
+import time
 import uuid
+from collections import Counter
 
 from core.dungeon.dungeons import Dungeon
+from core.dungeon.dungeons import CompactDungeon
+from core.dungeon.dungeons import Directions
 from core.dungeon.dungeons import Room
 from core.dungeon.dungeons import DungeonCell
 from core.dungeon.dungeons import Tiles
 import core.critters
 import strings
 
+# numpy is optional, without it generation takes the plain python path
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+
+class RegionSets:
+    '''
+        Disjoint sets of region numbers for stage 3 of generation. Union by size with path halving,
+        so a merge or lookup is close enough to constant time. Regions never seen are their own set.
+    '''
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, region):
+        parent = self.parent
+        while parent.get(region, region) != region:
+            # point each step at its grandparent on the way up
+            grandparent = parent.get(parent[region], parent[region])
+            parent[region] = grandparent
+            region = grandparent
+        return region
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return a
+        if self.size.get(a, 1) < self.size.get(b, 1):
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] = self.size.get(a, 1) + self.size.get(b, 1)
+        return a
+
+
+class Occupancy:
+    '''
+        The cells rooms have claimed during stage 1 as one int bitmask per row, so checking whether
+        a room and its border are clear is a shift and a mask per row instead of a tile lookup per
+        cell, and filling a room is an or per row.
+
+        With anchors tracked it also keeps the list of top left corners where the smallest room
+        would still fit, so placement can pick from those instead of trying occupied ground.
+    '''
+
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.rows = [0] * height
+        self.anchors = None
+
+    def track_anchors(self, min_height, min_width):
+        self.min_height = min_height
+        self.min_width = min_width
+        self.anchors = [(i, j) for i in range(1, self.height - min_height) for j in range(1, self.width - min_width)]
+        self.anchor_index = {coords: index for index, coords in enumerate(self.anchors)}
+
+    def fits(self, room, coords):
+        # the same rules as Dungeon.canRoomFit for a map that only has rooms on it so far
+        if coords[0] == 0 or coords[1] == 0:
+            return False
+        if room.height + coords[0] >= self.height or room.width + coords[1] >= self.width:
+            return False
+
+        mask = ((1 << (room.width + 2)) - 1) << (coords[1] - 1)
+        for i in range(coords[0] - 1, coords[0] + room.height + 1):
+            if self.rows[i] & mask:
+                return False
+        return True
+
+    def fill(self, coords, height, width):
+        mask = ((1 << width) - 1) << coords[1]
+        for i in range(coords[0], coords[0] + height):
+            self.rows[i] |= mask
+
+        if self.anchors is not None:
+            # corners whose smallest room would now overlap this one or its border
+            for i in range(max(1, coords[0] - self.min_height), coords[0] + height + 1):
+                for j in range(max(1, coords[1] - self.min_width), coords[1] + width + 1):
+                    self.drop_anchor((i, j))
+
+    def drop_anchor(self, coords):
+        index = self.anchor_index.pop(coords, None)
+        if index is None:
+            return
+        last = self.anchors.pop()
+        if index < len(self.anchors):
+            self.anchors[index] = last
+            self.anchor_index[last] = index
+
+
+class CarveMask:
+    '''
+        For each cell of a compact map, how many of its eight neighbours are carved or off the map,
+        counted once with numpy and then kept up to date as passages are carved. A cell is safe to
+        carve when that count is zero, which replaces building and testing the neighbourhood on
+        every growing tree step. Answers exactly what isSafeCarvable and getPossibleCarves would.
+    '''
+
+    # direction, step to the target cell and the step to the cells beside the cursor that the
+    # carvability check ignores, in the order getPossibleCarves tries them
+    STEPS = [(d, x - 5, y - 5, y - 5, x - 5) for d in Directions for x, y in [DungeonCell(5, 5).byCode(d)]]
+
+    def __init__(self, dungeon):
+        self.dungeon = dungeon
+        self.height = dungeon.height()
+        self.width = dungeon.width()
+
+        tiles = numpy.frombuffer(dungeon.tiles, dtype=numpy.uint8).reshape(self.height, self.width)
+        # off the map counts as open, so pad with it
+        carved = numpy.pad(tiles != Tiles.SOLID, 1, constant_values=True).astype(numpy.uint8)
+        counts = numpy.zeros((self.height, self.width), dtype=numpy.uint8)
+        for dx, dy in CompactDungeon.NEIGHBORHOOD:
+            counts += carved[1 + dx:1 + dx + self.height, 1 + dy:1 + dy + self.width]
+        self.open = bytearray(counts.tobytes())
+
+    def safe(self, x, y):
+        return self.open[x * self.width + y] == 0
+
+    def carve(self, cell):
+        # the neighbours of a newly carved cell each have one more open neighbour
+        x, y = cell[0], cell[1]
+        if self.dungeon.tiles[x * self.width + y] == Tiles.SOLID:
+            for dx, dy in CompactDungeon.NEIGHBORHOOD:
+                nx = x + dx
+                ny = y + dy
+                if 0 <= nx < self.height and 0 <= ny < self.width:
+                    self.open[nx * self.width + ny] += 1
+        return self.dungeon.carvePassage(cell)
+
+    def possible(self, cell):
+        # the cursor and the two cells beside it are let off, they sit next to every target
+        tiles = self.dungeon.tiles
+        width = self.width
+        x, y = cell[0], cell[1]
+
+        options = []
+        for direction, dx, dy, px, py in CarveMask.STEPS:
+            tx = x + dx
+            ty = y + dy
+            if tx < 0 or ty < 0 or tx >= self.height or ty >= width:
+                continue
+            if tiles[tx * width + ty] == Tiles.PASSAGE:
+                continue
+            allowed = 1 if tiles[x * width + y] != Tiles.SOLID else 0
+            for sx, sy in ((x + px, y + py), (x - px, y - py)):
+                if tiles[sx * width + sy] != Tiles.SOLID:
+                    allowed += 1
+            if self.open[tx * width + ty] == allowed:
+                options.append(direction)
+        return options
+
+
+class GenerationStats:
+    '''
+        Opt in record of what generateDungeon spent its time on. Pass one in and it collects wall
+        time per stage plus counters for the interesting branches: room attempts and successes,
+        trees grown, regions merged, remediations, dead ends removed and so on. Passing the same
+        one to many generations adds them all up, and stats from other processes can be merged in.
+    '''
+
+    def __init__(self):
+        self.maps = 0
+        self.stages = Counter()
+        self.counters = Counter()
+        self.current = None
+        self.started = 0
+
+    def stage(self, title):
+        now = time.perf_counter()
+        if self.current is not None:
+            self.stages[self.current] += now - self.started
+        self.current = title
+        self.started = now
+
+    def finish(self):
+        self.stage(None)
+        self.maps += 1
+
+    def fail(self):
+        # the map was thrown away, its time still counts
+        self.stage(None)
+        self.counters['failures'] += 1
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def merge(self, other):
+        self.maps += other.maps
+        self.stages.update(other.stages)
+        self.counters.update(other.counters)
+
+    def report(self):
+        total = sum(self.stages.values())
+        maps = max(self.maps, 1)
+        lines = ['{} maps, {:.3f}s per map'.format(self.maps, total / maps)]
+        for title, elapsed in self.stages.items():
+            lines.append('  {:<28} {:>9.3f}s {:>6.1f}%'.format(title, elapsed / maps, 100 * elapsed / total if total else 0))
+        for name, value in sorted(self.counters.items()):
+            lines.append('  {:<28} {:>10.1f}'.format(name, value / maps))
+        return '\n'.join(lines)
+
+    def __getstate__(self):
+        # a stage in progress doesn't mean anything in another process
+        return {'maps': self.maps, 'stages': self.stages, 'counters': self.counters, 'current': None, 'started': 0}
 
 
 class DungeonFactoryAlpha:
@@ -42,12 +255,20 @@ class DungeonFactoryAlpha:
         # percent chance to let a dead end live
         'CHANCE_KEEP_DEADEND': 5,
         # max number of runs of the sparseness removal process, -1 for no limit
-        'MAX_SPARENESS_RUNS': 20
+        'MAX_SPARENESS_RUNS': 20,
+        # store the map as flat tile/region arrays instead of a grid of cell tuples
+        'COMPACT_GRID': False,
+        # use numpy for the whole map passes when it's installed, compact grid only
+        'VECTORIZE': True,
+        # 'random' tries room corners anywhere on the map, 'free' only where a room could still fit
+        'ROOM_PLACEMENT': 'random'
     }       
     CURRENT_SETTINGS = {}
+    # GenerationStats for the map being generated, None unless the caller asked for them
+    CURRENT_STATS = None
 
     @classmethod
-    def generateDungeon(self, options={}):
+    def generateDungeon(self, options={}, stats=None):
         self.CURRENT_SETTINGS = self.DEFAULT_SETTINGS.copy()
         self.CURRENT_SETTINGS.update(options)
 
@@ -66,8 +287,32 @@ class DungeonFactoryAlpha:
             raise ValueError('Maximum room width can not be greater than {} [map width - 6]'.format(self.CURRENT_SETTINGS['DEFAULT_WIDTH'] - 6))
         if self.CURRENT_SETTINGS['ROOM_WIDTH_RANGE'][0] < 2:
             raise ValueError('Minimum root width can not be less than 2')
+        if self.CURRENT_SETTINGS['ROOM_PLACEMENT'] not in ['random', 'free']:
+            raise ValueError('Room placement must be random or free')
+
+        # a map that blows up part way still has its time counted, and the next map doesn't inherit its stats
+        self.CURRENT_STATS = stats
+        try:
+            dungeon = self.buildDungeon()
+        except Exception:
+            if stats is not None:
+                stats.fail()
+            raise
+        finally:
+            self.CURRENT_STATS = None
+
+        if stats is not None:
+            stats.finish()
+        self.header('Exuent')
 
-        dungeon = Dungeon()
+        return dungeon
+
+    @classmethod
+    def buildDungeon(self):
+        if self.CURRENT_SETTINGS['COMPACT_GRID']:
+            dungeon = CompactDungeon()
+        else:
+            dungeon = Dungeon()
 
         self.header('Stage 0: Blank Slate')
         dungeon.initialize(self.CURRENT_SETTINGS['DEFAULT_HEIGHT'], self.CURRENT_SETTINGS['DEFAULT_WIDTH'])
@@ -76,15 +321,29 @@ class DungeonFactoryAlpha:
         # =============================================================================================
         self.header('Stage 1: Carve Rooms')
         room_attempts = 0
+        occupancy = Occupancy(dungeon.height(), dungeon.width())
+        if self.CURRENT_SETTINGS['ROOM_PLACEMENT'] == 'free':
+            # room width is rolled from the height range as well, so go with the smaller of the two
+            smallest = min(self.CURRENT_SETTINGS['ROOM_HEIGHT_RANGE'][0], self.CURRENT_SETTINGS['ROOM_WIDTH_RANGE'][0])
+            occupancy.track_anchors(smallest, smallest)
+
         while dungeon.roomCount() < self.CURRENT_SETTINGS['MAX_ROOMS'] and room_attempts < self.CURRENT_SETTINGS['MAX_ROOM_ATTEMPTS']:
-            # note that row/col zero are reserved for border
-            # also note that coords are generated outside of the room to avoid recording bad attempts at all
-            coords = (random.randint(1, dungeon.height()), random.randint(1, dungeon.width()))
+            if occupancy.anchors is None:
+                # note that row/col zero are reserved for border
+                # also note that coords are generated outside of the room to avoid recording bad attempts at all
+                coords = (random.randint(1, dungeon.height()), random.randint(1, dungeon.width()))
+            elif len(occupancy.anchors) > 0:
+                coords = random.choice(occupancy.anchors)
+            else:
+                # not even the smallest room fits anywhere
+                break
 
             room = Room(coords, self.roomProps())
 
-            if dungeon.canRoomFit(room, coords):
+            if occupancy.fits(room, coords):
                 dungeon.carveRoom(room, coords)
+                occupancy.fill(coords, room.height, room.width)
+                self.count('rooms')
 
             # we only need this if we're debugging a problem seed
             # self.header('Attempt {}'.format(room_attempts))
@@ -92,6 +351,8 @@ class DungeonFactoryAlpha:
 
             room_attempts += 1
 
+        self.count('room_attempts', room_attempts)
+
         # print()
         # dungeon.prettyPrint()
 
@@ -99,18 +360,19 @@ class DungeonFactoryAlpha:
         self.header('Stage 2: Passage Carving')
 
         treeCount = 0
+        vectorize = self.vectorized(dungeon)
+        mask = CarveMask(dungeon) if vectorize else None
 
         for i in range(1, dungeon.height() - 1):
             for j in range(1, dungeon.width() - 1):
 
-                cursor = dungeon.getCell(i, j)
-
-                if dungeon.isSafeCarvable(cursor):
+                if (mask.safe(i, j) if mask else dungeon.isSafeCarvable(dungeon.getCell(i, j))):
                     treeCount += 1
+                    cursor = dungeon.getCell(i, j)
 
                     # print('Starting new tree at {}'.format(cursor))
 
-                    self.startGrowingTree(cursor, dungeon)
+                    self.startGrowingTree(cursor, dungeon, mask)
 
                     dungeon.newRegion()
 
@@ -118,6 +380,7 @@ class DungeonFactoryAlpha:
         # dungeon.prettyPrint()
 
         # print('Tree count: {}'.format(treeCount))
+        self.count('trees', treeCount)
 
         # =============================================================================================
         self.header('Stage 3: Connections')
@@ -128,27 +391,32 @@ class DungeonFactoryAlpha:
         # sub step 1: label connectors
         # Just loop through all uncarved squares and label them if they border two distinct regions
         # We will also create a handy lookup map so we don't gotta fuss about finding them later
-        # A dictionary where the index is a cell that is a connector and the value is a list of two regions it bridges
+        # A dictionary where the index is a cell that is a connector and the value is the two regions it bridges
         connectorCells = {}
+        # connectors bucketed by the pair of regions they bridge, links[a][b] and links[b][a] are the same list
+        links = {}
 
-        for i in range(1, dungeon.height() - 1):
-            for j in range(1, dungeon.width() - 1):
+        if vectorize:
+            self.labelConnectors(dungeon, connectorCells, links)
+        else:
+            for i in range(1, dungeon.height() - 1):
+                for j in range(1, dungeon.width() - 1):
 
-                cursor = dungeon.getCell(i, j)
+                    cursor = dungeon.getCell(i, j)
 
-                if cursor.type == Tiles.SOLID:
-                    e = dungeon.region_for(dungeon.getCell(*cursor.east()))
-                    w = dungeon.region_for(dungeon.getCell(*cursor.west()))
+                    if cursor.type == Tiles.SOLID:
+                        e = dungeon.region_for(dungeon.getCell(*cursor.east()))
+                        w = dungeon.region_for(dungeon.getCell(*cursor.west()))
                     
-                    n = dungeon.region_for(dungeon.getCell(*cursor.north()))
-                    s = dungeon.region_for(dungeon.getCell(*cursor.south()))
+                        n = dungeon.region_for(dungeon.getCell(*cursor.north()))
+                        s = dungeon.region_for(dungeon.getCell(*cursor.south()))
                     
-                    if (e != None and w != None and e != w):
-                        dungeon.update_cell(cursor, Tiles.CONNECTOR)
-                        connectorCells[(i, j)] = [e, w]
-                    elif n != None and s != None and n != s:
-                        dungeon.update_cell(cursor, Tiles.CONNECTOR)
-                        connectorCells[(i, j)] = [n, s]
+                        if (e != None and w != None and e != w):
+                            dungeon.update_cell(cursor, Tiles.CONNECTOR)
+                            self.addConnector(connectorCells, links, (i, j), e, w)
+                        elif n != None and s != None and n != s:
+                            dungeon.update_cell(cursor, Tiles.CONNECTOR)
+                            self.addConnector(connectorCells, links, (i, j), n, s)
 
         # print('After connector creation')
         # dungeon.regionPrint()
@@ -159,16 +427,31 @@ class DungeonFactoryAlpha:
         regionCollapse = dungeon.region_for(dungeon.getCell(*roomCursor.coords))
 
         # print('Collapsing to: {}'.format(regionCollapse))
-
-        remainingRegions = self.countRemainingRegions(connectorCells)
-
-        while(remainingRegions > 1):
+        self.count('connectors', len(connectorCells))
+
+        # Regions joined to the starting one are tracked as a disjoint set rather than relabelling
+        # their cells on every merge, the cells get relabelled once at the end.
+        # frontier holds every connector from the joined regions to the rest, bridged connectors are
+        # left in it and skipped when picked. across holds the same connectors per outside region.
+        regions = RegionSets()
+        frontier = []
+        across = {}
+        self.absorbRegion(regions, links, frontier, across, regionCollapse, regionCollapse)
+
+        while(len(connectorCells) > 0):
             # sub step 3: opening and collapsing
 
-            # get a list of all connections from the collapseTo region to pick a new target region
-            validConnectorCoords = [coords for coords, regions in connectorCells.items() if regionCollapse in regions]
-
-            if len(validConnectorCoords) == 0:
+            # pick a random connection from the collapseTo region to find a new target region
+            selectedConnector = None
+            while len(frontier) > 0:
+                index = random.randrange(len(frontier))
+                if frontier[index] in connectorCells:
+                    selectedConnector = frontier[index]
+                    break
+                frontier[index] = frontier[-1]
+                frontier.pop()
+
+            if selectedConnector is None:
                 # this scenario occurs when a map is generated where a set of regions is more than one cell away from the remaining regions
                 # its more likely crop up when the map dimensions are small and the passage carving is unable to create anything between
                 # two rooms that start with 2 cells between them
@@ -192,10 +475,10 @@ class DungeonFactoryAlpha:
                             for n2 in c1.all():
                                 c2 = dungeon.getCell(*n2) 
                                 if c2 and c2.type in [Tiles.PASSAGE, Tiles.ROOM]:
-                                    if dungeon.region_map[c2] == regionCollapse:
+                                    if regions.find(dungeon.region_for(c2)) == regions.find(regionCollapse):
                                         homeOptions.append( (c1, c2.type) )
-                                    if dungeon.region_map[c2] != regionCollapse:
-                                        awayOptions.append( (c1, c2.type, dungeon.region_map[c2]) )
+                                    else:
+                                        awayOptions.append( (c1, c2.type, dungeon.region_for(c2)) )
 
                         # now that we have a 
                         if len(homeOptions) > 0 and len(awayOptions) > 0:
@@ -204,14 +487,14 @@ class DungeonFactoryAlpha:
                             # now that we've found a valid set of three cells, we can carve them manually
                             # before proceeding onto the region collapse sub-step for our "away" region
                             cell = dungeon.update_cell(cell, Tiles.PASSAGE)
-                            dungeon.region_map[cell] = regionCollapse
+                            dungeon.set_region(cell, regionCollapse)
                             
                             homeCell = home[0]
                             homeType = home[1]
 
                             newType = Tiles.PASSAGE if homeType == Tiles.PASSAGE else Tiles.DOORWAY
                             homeCell = dungeon.update_cell(homeCell, newType)
-                            dungeon.region_map[homeCell] = regionCollapse
+                            dungeon.set_region(homeCell, regionCollapse)
                             
                             awayCell = away[0]
                             awayType = away[1]
@@ -219,38 +502,40 @@ class DungeonFactoryAlpha:
 
                             newType = Tiles.PASSAGE if awayType == Tiles.PASSAGE else Tiles.DOORWAY
                             awayCell = dungeon.update_cell(awayCell, newType)
-                            dungeon.region_map[awayCell] = regionCollapse
+                            dungeon.set_region(awayCell, regionCollapse)
                             
                             remediated = True
                             openedRegion = awayRegion
-                            # in this case there were never any connectors between our regions so there are 
-                            relevantConnectorCoords = []
 
                 if not remediated:
                     # T he previous solution will work in all possible scenarios but we should make a fuss
                     # since it will stack trace later regardless
                     raise RuntimeError('Map generation detected a divided region scenario it was unable to remediate.')
+
+                self.count('remediations')
+
+                # in this case there were never any connectors between our regions
+                adjacencyChecks = []
             else:
                 # this is the regular scenario section for when the distance problem doesn't occur      
-                selectedConnector = random.choice(validConnectorCoords)
 
                 # change the connector into a doorway, it needs a region since it used to be nothing
                 # print('Opening connector at: {}'.format(selectedConnector))
                 selectedCell = dungeon.getCell(*selectedConnector)
                 self.makeDoor(dungeon, selectedCell, regionCollapse)
 
-                # find the region opposite the doorway and collapse it, there should only ever be 2 items in those lists
-
-                openedRegion = [ x for x in connectorCells[selectedConnector] if x != regionCollapse ][0]
+                # find the region opposite the doorway and collapse it
+                first, second = connectorCells[selectedConnector]
+                openedRegion = second if regions.find(first) == regions.find(regionCollapse) else first
 
-                # get the list of connectors shared between the main and collapsing region, they will be cleaned up in the next stage
-                relevantConnectorCoords = [coords for coords, regions in connectorCells.items() if regionCollapse in regions and openedRegion in regions]
+                adjacencyChecks = [selectedCell]
 
-            self.collapseRegion(dungeon, connectorCells, openedRegion, regionCollapse)
+            # the connectors shared between the main and collapsing region, they're cleaned up in the next stage
+            relevantConnectorCoords = self.absorbRegion(regions, links, frontier, across, regionCollapse, openedRegion)
+            self.count('merges')
 
             # sub step 4: cleaning remaining connectors for starting region
             # always remove connectors adjacent to new or auxilliary doorways
-            adjacencyChecks = [selectedCell]
             for coords in relevantConnectorCoords:
                 if coords == selectedConnector:
                     connectorCells.pop(coords)
@@ -271,12 +556,7 @@ class DungeonFactoryAlpha:
                     doorCell = dungeon.getCell(*coords)
                     self.makeDoor(dungeon, doorCell, regionCollapse)
                     adjacencyChecks.append(doorCell)
-
-                    regions = connectorCells[coords]
-                    remaining = [ x for x in connectorCells[coords] if x != regionCollapse ]
-                    if len(remaining) > 0:
-                        # print('Found new region to collapse: {}'.format(remaining[0]))
-                        self.collapseRegion(dungeon, connectorCells, remaining[0], regionCollapse)
+                    self.count('extra_doors')
                 else:
                     toClose = dungeon.getCell(*coords)
                     dungeon.update_cell(toClose, Tiles.SOLID)
@@ -285,7 +565,14 @@ class DungeonFactoryAlpha:
 
             # dungeon.regionPrint()
 
-            remainingRegions = self.countRemainingRegions(connectorCells)
+        # everything joined up is now one region
+        root = regions.find(regionCollapse)
+        for i in range(1, dungeon.height() - 1):
+            for j in range(1, dungeon.width() - 1):
+                c = dungeon.getCell(i, j)
+                region = dungeon.region_for(c)
+                if region != None and region != regionCollapse and regions.find(region) == root:
+                    dungeon.set_region(c, regionCollapse)
 
 
         # =============================================================================================
@@ -293,49 +580,45 @@ class DungeonFactoryAlpha:
 
         # Sparseness removal is the process of removing some percentage of dead ends to reduce the
         # amount of wasted time exploring the dungeon
-        # This particular implementation is particularly ham handed, trading a lot of loop cycles for
-        # simplicity of implementation. A more methodical approach could also implement max dead end
-        # length if it actually followed paths
+        # Each run removes the dead ends found by the last one, which shortens every dead end path by a
+        # cell. Only the neighbours of removed cells can turn into new dead ends so those are all that
+        # get looked at next run instead of the whole map. A more methodical approach could also
+        # implement max dead end length if it actually followed paths
 
         # print('Pre-sparseness removal')
         # dungeon.prettyPrint()
 
         runCount = 0
-        allDone = False
-        deadendWhitelist = []
-
-        while (self.CURRENT_SETTINGS['MAX_SPARENESS_RUNS'] == -1 and not allDone) or (runCount < self.CURRENT_SETTINGS['MAX_SPARENESS_RUNS'] and not allDone):
-
-            deadends = []
-            for cell in dungeon.allCells():
-                if cell.type == Tiles.PASSAGE:
-                    neighbors = [cell.east(), cell.west(), cell.north(), cell.south()]
-                    # paths = [x for x in neighbors if dungeon.getCell(*x).type in [Cell.PASSAGE, Cell.DOORWAY]]
-                    passages = [x for x in neighbors if dungeon.getCell(*x).type == Tiles.PASSAGE]
-                    doors = [x for x in neighbors if dungeon.getCell(*x).type == Tiles.DOORWAY]
-
-                    # print('{}, p: {}, d: {}'.format(cell, passages, doors))
-                    if len(passages) == 1 and len(doors) == 0:
-                        deadends.append(cell)
-
-            if len(deadends) > 0:
-                for cell in deadends:
-                    if random.randint(1,100) < self.CURRENT_SETTINGS['CHANCE_KEEP_DEADEND']:
-                        # print('Found a real keeper. Whitelisting {}'.format(cell))
-                        deadendWhitelist.append(cell)
-                    elif cell in deadendWhitelist:
-                        # print('Skipping whitelisted cell {}'.format(cell))
-                        continue
-                    else:
-                        dungeon.update_cell(cell, Tiles.SOLID)
+        deadendWhitelist = set()
+        candidates = [cell[:2] for cell in dungeon.allCells(Tiles.PASSAGE)]
 
-            else:
-                allDone = True
+        while len(candidates) > 0 and (self.CURRENT_SETTINGS['MAX_SPARENESS_RUNS'] == -1 or runCount < self.CURRENT_SETTINGS['MAX_SPARENESS_RUNS']):
 
+            # everything is checked before anything is removed so a run sees the map as it started
+            deadends = [coords for coords in candidates if self.isDeadend(dungeon, coords)]
+
+            nextCandidates = set()
+            for coords in deadends:
+                if random.randint(1,100) < self.CURRENT_SETTINGS['CHANCE_KEEP_DEADEND']:
+                    # print('Found a real keeper. Whitelisting {}'.format(coords))
+                    deadendWhitelist.add(coords)
+                    continue
+
+                cell = dungeon.update_cell(dungeon.getCell(*coords), Tiles.SOLID)
+                self.count('deadends_removed')
+                for n in (cell.east(), cell.west(), cell.north(), cell.south()):
+                    if n not in deadendWhitelist and dungeon.getCell(*n).type == Tiles.PASSAGE:
+                        nextCandidates.add(n)
+
+            # row by row like the first run, which keeps the random rolls in map order
+            candidates = sorted(nextCandidates)
             runCount += 1
             # print('Post Sparseness run {}'.format(runCount))
             # dungeon.prettyPrint()
 
+        self.count('sparseness_runs', runCount)
+        self.count('deadends_kept', len(deadendWhitelist))
+
         # =============================================================================================
         self.header('Stage 5: Define entrance')
 
@@ -348,8 +631,6 @@ class DungeonFactoryAlpha:
         # print('Now with entrance')
         # dungeon.prettyPrint()
 
-        self.header('Exuent')
-
         return dungeon
 
     @classmethod
@@ -361,38 +642,84 @@ class DungeonFactoryAlpha:
                 # print('!!!!! Found duplicate entry: {}, {}'.format(coords, regions))
 
     @classmethod
-    def countRemainingRegions(self, connectorCells):
-        uniqueRegions = []
-        for regions in connectorCells.values():
-            for r in regions:
-                if r not in uniqueRegions:
-                    uniqueRegions.append(r)
-        # print('Found {} remaining regions: {}'.format(len(uniqueRegions), uniqueRegions))
-        return len(uniqueRegions)
+    def vectorized(self, dungeon):
+        return self.CURRENT_SETTINGS['VECTORIZE'] and numpy is not None and isinstance(dungeon, CompactDungeon)
 
     @classmethod
-    def collapseRegion(self, dungeon, connectorCells, regionToCollapse, collapseTo):
-        # print('Collapsing: {}'.format(regionToCollapse))
-        for i in range(1, dungeon.height() - 1):
-            for j in range(1, dungeon.width() - 1):
-                c = dungeon.getCell(i, j)
-                region = dungeon.region_for(c)
-                if region == regionToCollapse:
-                    dungeon.region_map[c] = collapseTo
-                    
-        # The collapsed region no longer exists so we overwrite all instances of it in our mapping
-        # don't worry if we end up with two collapseTo regions in the list, those will get removed later [andy: What does this mean?]
-        for coords, regionList in connectorCells.items():
-            if regionToCollapse in regionList:
-                connectorCells[coords] = [collapseTo if x == regionToCollapse else x for x in connectorCells[coords]]
+    def labelConnectors(self, dungeon, connectorCells, links):
+        # the same labelling as the loop in stage 3, done with shifted copies of the region array
+        height = dungeon.height()
+        width = dungeon.width()
+        tiles = numpy.frombuffer(dungeon.tiles, dtype=numpy.uint8).reshape(height, width)
+        regions = numpy.frombuffer(dungeon.regions, dtype=numpy.uint32).reshape(height, width)
+
+        solid = tiles[1:-1, 1:-1] == Tiles.SOLID
+        east = regions[1:-1, 2:]
+        west = regions[1:-1, :-2]
+        north = regions[:-2, 1:-1]
+        south = regions[2:, 1:-1]
+
+        across = solid & (east != 0) & (west != 0) & (east != west)
+        down = solid & ~across & (north != 0) & (south != 0) & (north != south)
+        connectors = across | down
+
+        # row by row, the order the loop would have found them in
+        rows, columns = numpy.nonzero(connectors)
+        firsts = numpy.where(across, east, north)[connectors]
+        seconds = numpy.where(across, west, south)[connectors]
+        tiles[1:-1, 1:-1][connectors] = Tiles.CONNECTOR
+
+        for i, j, first, second in zip(rows.tolist(), columns.tolist(), firsts.tolist(), seconds.tolist()):
+            self.addConnector(connectorCells, links, (i + 1, j + 1), first, second)
+
+    @classmethod
+    def addConnector(self, connectorCells, links, coords, first, second):
+        connectorCells[coords] = (first, second)
+        bucket = links.setdefault(first, {}).get(second)
+        if bucket is None:
+            bucket = []
+            links[first][second] = bucket
+            links.setdefault(second, {})[first] = bucket
+        bucket.append(coords)
+
+    @classmethod
+    def absorbRegion(self, regions, links, frontier, across, collapseTo, regionToCollapse):
+        # joins a region to the collapseTo set and returns the connectors that now lead nowhere new,
+        # its connectors to regions still outside become part of the frontier
+        relevant = across.pop(regionToCollapse, [])
+        regions.union(collapseTo, regionToCollapse)
+        root = regions.find(collapseTo)
+
+        for other, bucket in links.pop(regionToCollapse, {}).items():
+            if regions.find(other) != root:
+                across.setdefault(other, []).extend(bucket)
+                frontier.extend(bucket)
+
+        return relevant
+
+    @classmethod
+    def isDeadend(self, dungeon, coords):
+        # a passage with one way in and no doors next to it
+        cell = dungeon.getCell(*coords)
+        if cell.type != Tiles.PASSAGE:
+            return False
+
+        passages = 0
+        for n in (cell.east(), cell.west(), cell.north(), cell.south()):
+            neighbor = dungeon.getCell(*n).type
+            if neighbor == Tiles.DOORWAY:
+                return False
+            if neighbor == Tiles.PASSAGE:
+                passages += 1
+        return passages == 1
 
     @classmethod
     def makeDoor(self, dungeon, cell, region):
         dungeon.update_cell(cell, Tiles.DOORWAY)
-        dungeon.region_map[cell] = region
+        dungeon.set_region(cell, region)
         
     @classmethod
-    def startGrowingTree(self, start, dungeon):
+    def startGrowingTree(self, start, dungeon, mask=None):
         '''
         This is a general algorithm, capable of creating Mazes of different textures. It requires storage up to the size of the Maze. Each time you carve a cell,
         add that cell to a list. Proceed by picking a cell from the list, and carving into an unmade cell next to it. If there are no unmade cells next to the current
@@ -405,7 +732,7 @@ class DungeonFactoryAlpha:
         '''
 
         # cells are immutable so we get a fresh boy back
-        cursor = dungeon.carvePassage(start)
+        cursor = mask.carve(start) if mask else dungeon.carvePassage(start)
         pile = [cursor]
 
         previous_direction = None
@@ -427,7 +754,7 @@ class DungeonFactoryAlpha:
             # print('Cursor: {}'.format(cursor))
 
 
-            options = dungeon.getPossibleCarves(cursor)
+            options = mask.possible(cursor) if mask else dungeon.getPossibleCarves(cursor)
 
             if len(options) == 0:
                 # this node is exhausted, remove it from the pile
@@ -447,7 +774,7 @@ class DungeonFactoryAlpha:
             next_cell = dungeon.getCell(*cursor.byCode(direction))
 
             # print('Next cell selected: {}'.format(next_cell))
-            newcell = dungeon.carvePassage(next_cell)
+            newcell = mask.carve(next_cell) if mask else dungeon.carvePassage(next_cell)
             pile.append(newcell)
             
         # print('Pile is empty')
@@ -464,14 +791,25 @@ class DungeonFactoryAlpha:
             'width': random.randint(*self.CURRENT_SETTINGS['ROOM_HEIGHT_RANGE'])
         }
 
+    @classmethod
+    def count(self, name, amount=1):
+        if self.CURRENT_STATS is not None:
+            self.CURRENT_STATS.count(name, amount)
+
     @classmethod
     def header(self, title):
+        # the stage headers double as the timing marks
+        if self.CURRENT_STATS is not None:
+            self.CURRENT_STATS.stage(title)
+        # print(self.banner(title))
+
+    @classmethod
+    def banner(self, title):
         diff = int( (self.CURRENT_SETTINGS['DEFAULT_WIDTH'] + 4 - len(title)) / 2)
 
         s = ' ' + '=' * (diff - 1)
         s += ' {} '.format(title)
-        s = s.ljust(156, '=')
-        # print(s)
+        return s.ljust(156, '=')
 
 if __name__ == "__main__":
 
@@ -0,0 +1,74 @@
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from core.dungeon.generate import DungeonFactoryAlpha
+
+
+def generate_map(settings, seed):
+    # runs in a worker process, each job gets its own seed so the maps aren't copies of each other
+    random.seed(seed)
+    return DungeonFactoryAlpha.generateDungeon(settings)
+
+
+class DungeonPool:
+    '''
+        Keeps a bounded stock of ready made dungeon maps, carved in background worker processes
+        so the DM loop doesn't stall while a map is generated.
+
+        Maps come out unpopulated and unsaved, the caller is expected to stock and persist them.
+        take() returns None when nothing is ready yet so the caller can fall back to generating inline.
+    '''
+
+    def __init__(self, settings, size=4, workers=None):
+        self.settings = settings
+        self.size = size
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.ready = deque()
+        self.pending = []
+
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def top_up(self):
+        self._collect()
+        while len(self.ready) + len(self.pending) < self.size:
+            self.pending.append(self.executor.submit(generate_map, self.settings, random.getrandbits(64)))
+
+    def take(self):
+        self._collect()
+
+        if self.ready:
+            self.hits += 1
+            dungeon = self.ready.popleft()
+        else:
+            self.misses += 1
+            dungeon = None
+
+        self.top_up()
+        return dungeon
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'failures': self.failures,
+            'ready': len(self.ready),
+            'pending': len(self.pending)
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _collect(self):
+        still_pending = []
+        for future in self.pending:
+            if not future.done():
+                still_pending.append(future)
+            elif future.exception():
+                # generation can bail out on maps it can't connect, just drop those and make another
+                self.failures += 1
+            else:
+                self.ready.append(future.result())
+        self.pending = still_pending
@@ -0,0 +1,158 @@
+from collections import Counter, deque
+import atexit
+import json
+import queue
+import threading
+import time
+
+import pika
+import pika.exceptions
+
+
+class MemoryEmitter:
+    '''
+        Emitter that keeps messages in process instead of publishing them, for headless runs.
+        Only the most recent messages are kept, everything is counted by message type.
+    '''
+
+    def __init__(self, history=1000, decode=False):
+        self.messages = deque(maxlen=history)
+        self.counts = Counter()
+        self.total = 0
+        # decoding costs a json parse per message, only needed if something wants the type counts
+        self.decode = decode
+
+    def __call__(self, message):
+        self.total += 1
+        self.messages.append(message)
+        if self.decode:
+            self.counts[json.loads(message).get('type')] += 1
+
+
+class RabbitPublisher:
+    '''
+        Emitter that hands messages to a background thread which publishes them to a fanout
+        exchange over its own connection, so the run loop never waits on RabbitMQ. The thread
+        takes everything queued at once and publishes it in order inside one channel transaction,
+        so the broker is waited on once per batch rather than once per message.
+
+        The queue holds at most capacity messages. When it's full, because the broker is slow or
+        unreachable, the caller waits up to put_timeout seconds for room and only then drops the
+        message and counts it. A lost connection is reopened after reconnect_delay seconds and the
+        batch that failed is sent again, the broker throws away an uncommitted transaction so
+        nothing is duplicated. After retries failed attempts the batch is given up on so flush()
+        can't wait forever.
+    '''
+
+    FLUSH = object()
+    CLOSE = object()
+
+    def __init__(self, parameters, exchange='dungeon', capacity=10000, batch_size=500, put_timeout=0.05, reconnect_delay=1.0, retries=5, connect=pika.BlockingConnection):
+        self.parameters = parameters
+        self.exchange = exchange
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self.reconnect_delay = reconnect_delay
+        self.retries = retries
+        self.connect = connect
+        self.queue = queue.Queue(maxsize=capacity)
+        self.connection = None
+        self.channel = None
+
+        self.published = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failures = 0
+        self.reconnects = 0
+        self.max_depth = 0
+        self.started = time.monotonic()
+
+        self.thread = threading.Thread(target=self._run, name='rabbit-publisher', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def __call__(self, message):
+        try:
+            self.queue.put(message, timeout=self.put_timeout)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        if self.thread.is_alive():
+            self.queue.put(RabbitPublisher.FLUSH)
+            self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(RabbitPublisher.CLOSE)
+            self.thread.join()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'published': self.published,
+            'per_second': round(self.published / elapsed, 1) if elapsed else 0,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'reconnects': self.reconnects,
+            'queued': self.queue.qsize(),
+            'max_queued': self.max_depth
+        }
+
+    def _run(self):
+        closing = False
+
+        while not closing:
+            batch = [self.queue.get()]
+            self.max_depth = max(self.max_depth, self.queue.qsize() + 1)
+            # everything that piled up while the last batch went out goes in this one
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            messages = [m for m in batch if m is not RabbitPublisher.FLUSH and m is not RabbitPublisher.CLOSE]
+            closing = any(m is RabbitPublisher.CLOSE for m in batch)
+            if messages:
+                self._publish(messages)
+            for i in range(len(batch)):
+                self.queue.task_done()
+
+        self._disconnect()
+
+    def _publish(self, messages):
+        for attempt in range(self.retries):
+            try:
+                if self.channel is None:
+                    self._open()
+                for message in messages:
+                    self.channel.basic_publish(exchange=self.exchange, routing_key='*', body=message)
+                # returns once the broker has taken the whole batch, or raises and it's all discarded
+                self.channel.tx_commit()
+                self.published += len(messages)
+                self.batches += 1
+                return
+            except (pika.exceptions.AMQPError, OSError) as e:
+                print('Exception publishing to rabbit, reconnecting: {}'.format(e))
+                self._disconnect()
+                time.sleep(self.reconnect_delay)
+        self.failures += len(messages)
+
+    def _open(self):
+        if self.connection is not None:
+            self.reconnects += 1
+        self.connection = self.connect(self.parameters)
+        channel = self.connection.channel()
+        channel.exchange_declare(self.exchange, exchange_type='fanout', durable=True)
+        channel.tx_select()
+        self.channel = channel
+
+    def _disconnect(self):
+        self.channel = None
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.close()
+            except (pika.exceptions.AMQPError, OSError):
+                pass
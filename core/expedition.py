@@ -5,7 +5,9 @@ import uuid
 
 from core.battle import Battle
 from core.dungeon.dungeons import DungeonCell
+from core.exploration import Exploration
 from core.mdb import Persister
+import core.pathfinding as pathfinding
 import core.strings as strings
 from core.dice import Dice
 import core.doodads as doodads
@@ -75,9 +77,9 @@ class Expedition(Persister):
         # general data holder for individual steps that doesn't require making top level properties
         self.localstate = {}
 
-        # Got to log which sections of the map have already been explored
-        # So for now we're gonna keep the cell coords in an array to reference
-        self.history = []
+        # Got to log which sections of the map have already been explored, this also keeps track
+        # of the edge of the explored area so finding the next unexplored cell stays cheap
+        self.history = Exploration(dungeon)
         # self.history.append(self.cursor)
 
         self.processors = []
@@ -99,9 +101,9 @@ class Expedition(Persister):
     def register_event(self, callback):
         self.event_saver = callback
 
-    def save_event(self, type, objects, msg):
+    def save_event(self, type, objects, msg, transient=False):
         if callable(self.event_saver):
-            self.event_saver(type, objects, msg)
+            self.event_saver(type, objects, msg, transient)
 
     def prefix(self):
         return self.id[0:10]
@@ -148,12 +150,14 @@ class Expedition(Persister):
         self.emit(msg)
 
     def emit_new(self):
+        self.settle()
         msg = {
             'type': 'EXPEDITION-NEW',
         }
         self.emit(msg)
 
     def emit_delete(self):
+        self.settle()
         msg = {
             'type': 'EXPEDITION-DEL',
         }
@@ -170,6 +174,7 @@ class Expedition(Persister):
         self.emit(msg)
 
     def emit_band(self):
+        self.settle()
         msg = {
             'type': 'BAND',
         }
@@ -277,7 +282,7 @@ class Expedition(Persister):
     def runstate_rdy(self, local):
         self.emit_narrative('The band enters the dungeon, adjusting to the dim light.')
         self.dungeon_cursor = self.dungeon.entrance()
-        self.history.append(self.dungeon_cursor)
+        self.history.visit(self.dungeon_cursor)
         self.path = []
         self._set_state(Expedition.EXPLORE)
 
@@ -303,11 +308,10 @@ class Expedition(Persister):
 
                 # TODO: move this to the encounter complete section?
                 for cell in self.dungeon.roomBrethren(self.dungeon_cursor):
-                    if cell not in self.history:
-                        self.history.append(cell)
+                    self.history.visit(cell)
 
             else:
-                self.history.append(self.dungeon_cursor)
+                self.history.visit(self.dungeon_cursor)
         else:
             self.process_message('Moving algorithm did not produce a destination')
             self._set_state(Expedition.ERROR)
@@ -365,7 +369,7 @@ class Expedition(Persister):
                     return Expedition.TASK_DURATIONS['round_divider']
 
         else:
-            self.battle = Battle(self.process_message, self.emit)
+            self.battle = Battle(self.process_message, self.emit, self.save_event)
 
             for m in room.locals:
                 self.battle.addParticipant('monster', m)
@@ -489,7 +493,7 @@ class Expedition(Persister):
 
     def history_map(self):
         if self.indungeon():
-            for index, row in enumerate(self.dungeon.grid):
+            for index, row in enumerate(self.dungeon.rows()):
                 display = '{}: '.format(str(index).rjust(4, ' '))
 
                 for cell in row:
@@ -519,70 +523,25 @@ class Expedition(Persister):
         if easyDirections:
             return [random.choice(easyDirections)]
         else:
-            # time to Dijkstra
-            return self.generate_path(self.dungeon_cursor, self.dungeon)
+            # the closest unexplored cell is on the frontier of the explored area
+            return self.history.nearest(self.dungeon_cursor)
 
     def generate_path(self, start, grid, target=None):
-        # just a basic dijkstra implementation that stops once it finds an unexplored cell
-
-        if type(start) == tuple:
-            start = grid.getCell(*start)
-
-        if type(target) == tuple:
-            target = grid.getCell(*target)
-
+        # stops at the target if there is one, otherwise at the closest unexplored cell
         pathingStart = time.perf_counter()
 
-        distance = {}
-        previous = {}
-        q = []
-        destination = None
-
-        for cell in grid.allCells(navigable=True):
-            distance[cell] = 1000000
-            previous[cell] = None
-            q.append(cell)
-
-        distance[start] = 0
-
-        count = 0
-        while len(q) > 0:
-            count += 1
-            lowest = q[0]
-            for cell in q:
-                if distance[cell] < distance[lowest]:
-                    lowest = cell
-            q.remove(lowest)
-
-            # Our break points are finding the optionally provided target cell, or otherwise the closest unexplored cell
-            if target and lowest == target:
-                destination = lowest
-                break
-            elif not target and lowest not in self.history:
-                destination = lowest
-                break
-
-            neighbors = grid.getNeighbors(lowest)
-            for neighbor in [n for n in neighbors if n in q]:
-                weight = grid.getWeight(neighbor)
-                newDistance = distance[lowest] + weight if distance[lowest] else weight
-
-                if newDistance < distance[neighbor]:
-                    distance[neighbor] = newDistance
-                    previous[neighbor] = lowest
+        if target:
+            path = pathfinding.find_path(grid, start, target=target)
+        else:
+            path = pathfinding.find_path(grid, start, goal=lambda c: c not in self.history)
 
         delta = time.perf_counter() - pathingStart
 
-        self.process_message('** Pathfinding run complete. Time: {}. Cells examined: {}, Cells remaining: {}'.format(str(delta), count, len(q)))
+        self.process_message('** Pathfinding run complete. Time: {}. Path length: {}'.format(str(delta), len(path) if path else 0))
 
-        if not destination:
+        if not path:
             # this *shouldn't* be possible as long as mapgen has no significant bugs
             self.process_message('Pathfinding did not produce a destination')
             return None
-        
-        path = [destination]
-        while(previous.get(destination, False)):
-            path.append(previous[destination])
-            destination = previous[destination]
 
-        return path
\ No newline at end of file
+        return path
@@ -0,0 +1,49 @@
+import core.pathfinding as pathfinding
+
+
+class Exploration:
+    '''
+        Tracks which cells of a dungeon a party has explored, along with the frontier: the unexplored
+        navigable cells sitting right next to explored ones.
+
+        Both are kept up to date as cells are visited. Any route to an unexplored cell has to cross
+        the frontier first, so the closest unexplored cell is the closest frontier cell and the search
+        for it never has to leave the explored area. Once the frontier is empty the dungeon is done,
+        no search required.
+    '''
+
+    def __init__(self, dungeon):
+        self.dungeon = dungeon
+        # both hold plain coordinates so they don't care which cell object they get handed
+        self.visited = set()
+        self.frontier = set()
+
+    def __contains__(self, cell):
+        return (cell[0], cell[1]) in self.visited
+
+    def __len__(self):
+        return len(self.visited)
+
+    def visit(self, cell):
+        coords = (cell[0], cell[1])
+        if coords in self.visited:
+            return False
+
+        self.visited.add(coords)
+        self.frontier.discard(coords)
+
+        for neighbor in self.dungeon.getNeighbors(cell):
+            n = (neighbor[0], neighbor[1])
+            if n not in self.visited:
+                self.frontier.add(n)
+
+        return True
+
+    def complete(self):
+        return len(self.frontier) == 0
+
+    def nearest(self, start):
+        # path to the closest unexplored cell, or None if there's nothing left to find
+        if self.complete():
+            return None
+        return pathfinding.bfs(self.dungeon, start, goal=lambda c: (c[0], c[1]) in self.frontier)
@@ -1,13 +1,48 @@
 import uuid
+import copy
 import time
+import atexit
+from datetime import datetime, timedelta, timezone
+import queue
+import threading
+from collections import deque
 
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import PyMongoError
 
 class MongoService:
+    '''
+        With write behind turned on, save/persist/persist_prop only queue the write. Writes to the
+        same object are coalesced, and the queue goes out as one bulk_write per collection once it
+        is flush_interval seconds old or holds flush_ops writes, or whenever flush() is called.
+        Anything still queued at exit is lost, so call flush() on the way out. flush_writes() sends
+        just the queued writes, for when something is about to read them back.
+    '''
 
     client = None
     db = None
 
+    FLUSH_INTERVAL = 1.0
+    FLUSH_OPS = 500
+    # what setup() was given, the defaults above are left alone so a later setup() starts from them
+    flush_interval = FLUSH_INTERVAL
+    flush_ops = FLUSH_OPS
+
+    write_behind = False
+    # (collection, id) -> [document to replace with or None, fields to $set, upsert]
+    pending = {}
+    pending_writes = 0
+    last_flush = 0
+
+    # calls made against the server versus writes asked for, to see how much batching saves
+    round_trips = 0
+    writes = 0
+    # queued writes whose bulk_write failed, they go back in the queue for the next flush
+    failures = 0
+
+    # when set events go through this instead of an insert each, see EventSink
+    event_sink = None
+
     COLLECTION_MAP= {
         '<class \'core.dungeon.dungeons.Dungeon\'>': 'dungeons',
         '<class \'core.critters.Delver\'>': 'delvers',
@@ -17,8 +52,23 @@ class MongoService:
         '<class \'core.region.City\'>': 'cities'
     }
 
+    # events are read newest first per object and paged on _id, see the API's events endpoints
+    EVENT_INDEX = [('object', ASCENDING), ('_id', DESCENDING)]
+
+    # seconds transient events (battle chatter) are kept, Mongo's TTL monitor deletes them after
+    TRANSIENT_RETENTION = 24 * 3600
+    transient_retention = TRANSIENT_RETENTION
+
     @classmethod
-    def setup(self, host):
+    def setup(self, host, write_behind=False, interval=None, ops=None, event_batch=None, transient_retention=None):
+        self.write_behind = write_behind
+        self.transient_retention = transient_retention or self.TRANSIENT_RETENTION
+        self.flush_interval = interval or self.FLUSH_INTERVAL
+        self.flush_ops = ops or self.FLUSH_OPS
+        self.pending = {}
+        self.pending_writes = 0
+        self.last_flush = time.monotonic()
+
         try:
             self.client = MongoClient(host)
             self.db = self.client.dungeondb
@@ -27,10 +77,35 @@ class MongoService:
             print('Exception during mongo connection')
             print(e)
 
+        if self.db is not None:
+            self.ensure_indexes()
+
+        if event_batch:
+            self.event_sink = EventSink(self.db.events, batch_size=event_batch)
+
+    @classmethod
+    def ensure_indexes(self):
+        # create_index does nothing for an index that already exists so this is safe on every start
+        indexes = [(collection, [('id', ASCENDING)], {'unique': True}) for collection in self.COLLECTION_MAP.values()]
+        indexes.append(('events', self.EVENT_INDEX, {}))
+        # expiry is stamped on each event so changing the retention doesn't mean rebuilding this
+        indexes.append(('events', [('expire_at', ASCENDING)], {'expireAfterSeconds': 0}))
+
+        for collection, keys, options in indexes:
+            try:
+                getattr(self.db, collection).create_index(keys, **options)
+            except PyMongoError as e:
+                print('Exception creating index {} on {}'.format(keys, collection))
+                print(e)
+
     @classmethod
     def get_collection(self, obj):
-        flat_type = str(type(obj))
-        return MongoService.COLLECTION_MAP.get(flat_type, False)
+        # subclasses share their parent's collection, a CompactDungeon is still a dungeon
+        for kind in type(obj).__mro__:
+            collection = MongoService.COLLECTION_MAP.get(str(kind))
+            if collection:
+                return collection
+        return False
 
     @classmethod
     def hard_reset(self):
@@ -48,7 +123,12 @@ class MongoService:
 
             # Note: Mongo collections don't implement a basic truthiness function so you gotta compare it
             if c != None:
-                c.insert_one(object.data_format())
+                if self.write_behind:
+                    self.queue(collection, object.id, document=object.data_format(), upsert=True)
+                else:
+                    self.round_trips += 1
+                    self.writes += 1
+                    c.insert_one(object.data_format())
             else: 
                 raise ValueError('No collection object found for: {}'.format(collection))
         else:
@@ -62,7 +142,12 @@ class MongoService:
             c = getattr(self.db, collection)
 
             if c != None:
-                c.replace_one({'id': object.id}, object.data_format())
+                if self.write_behind:
+                    self.queue(collection, object.id, document=object.data_format())
+                else:
+                    self.round_trips += 1
+                    self.writes += 1
+                    c.replace_one({'id': object.id}, object.data_format())
             else: 
                 raise ValueError('No collection object found for: {}'.format(collection))
         else:
@@ -70,24 +155,278 @@ class MongoService:
 
     @classmethod
     def persist_prop(self, object, prop, value):
+        values = {}
+        values[prop] = value
+        self.persist_fields(object, values)
+
+    @classmethod
+    def persist_fields(self, object, values):
         collection = self.get_collection(object)
 
         if collection:
             c = getattr(self.db, collection)
 
             if c != None:
-                values = {}
-                values[prop] = value
-                c.update_one({'id': object.id}, {'$set': values})
+                if self.write_behind:
+                    self.queue(collection, object.id, values=values)
+                else:
+                    self.round_trips += 1
+                    self.writes += 1
+                    c.update_one({'id': object.id}, {'$set': values})
             else: 
                 raise ValueError('No collection object found for: {}'.format(collection))
         else:
             raise ValueError('Did not find collection map for type "{}"'.format(collection))        
 
+    @classmethod
+    def queue(self, collection, id, document=None, values=None, upsert=False):
+        self.writes += 1
+        self.pending_writes += 1
+
+        key = (collection, id)
+        if key not in self.pending:
+            self.pending[key] = [None, {}, False]
+        entry = self.pending[key]
+
+        if document is not None:
+            # a full replace supersedes anything queued before it
+            entry[0] = document
+            entry[1] = {}
+        if values:
+            if entry[0] is not None:
+                entry[0].update(values)
+            else:
+                entry[1].update(values)
+        # a queued save hasn't been inserted yet, so whatever replaces it has to insert
+        entry[2] = entry[2] or upsert
+
+        self.maybe_flush()
+
+    @classmethod
+    def maybe_flush(self):
+        if not self.pending:
+            return False
+        if self.pending_writes >= self.flush_ops or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+            return True
+        return False
+
+    @classmethod
+    def flush(self):
+        if self.event_sink:
+            self.event_sink.flush()
+        self.flush_writes()
+
+    @classmethod
+    def flush_writes(self):
+        if not self.pending:
+            return
+
+        pending = self.pending
+        self.pending = {}
+        self.pending_writes = 0
+        self.last_flush = time.monotonic()
+
+        batches = {}
+        for (collection, id), (document, values, upsert) in pending.items():
+            if document is not None:
+                op = ReplaceOne({'id': id}, document, upsert=upsert)
+            else:
+                op = UpdateOne({'id': id}, {'$set': values})
+            batches.setdefault(collection, []).append(op)
+
+        for collection, ops in batches.items():
+            self.round_trips += 1
+            try:
+                getattr(self.db, collection).bulk_write(ops, ordered=False)
+            except PyMongoError as e:
+                # persist() has already marked these fields as sent and won't send them again, so
+                # the writes are requeued rather than lost. Resending the ones that did land is
+                # harmless, replaces and $sets give the same result twice.
+                print('Exception during write behind flush to {}'.format(collection))
+                print(e)
+                self.failures += len(ops)
+                for key, entry in pending.items():
+                    if key[0] == collection:
+                        self.pending[key] = entry
+                        self.pending_writes += 1
+
     @classmethod
     def save_event(self, type, uuids, msg, transient=False):
-        print('Save {}, {}'.format(type, msg))
-        self.db.events.insert_one({
+        event = {
+            'message': msg,
+            'object': uuids,
+            'type': type,
+            'transient': transient,
+            'time': time.time()
+            }
+        if transient:
+            event['expire_at'] = datetime.now(timezone.utc) + timedelta(seconds=self.transient_retention)
+
+        if self.event_sink:
+            self.event_sink.put(event)
+        else:
+            self.round_trips += 1
+            self.db.events.insert_one(event)
+
+
+class EventSink:
+    '''
+        Buffers events and writes them from a background thread with insert_many, a batch goes
+        out once it holds batch_size events or its oldest event is max_age seconds old.
+
+        The queue holds at most capacity events, past that put() blocks until the writer catches
+        up so a burst of battle chatter can't run away from the database. flush() waits until
+        everything put so far is written, and anything left at interpreter exit gets written too.
+    '''
+
+    FLUSH = object()
+    CLOSE = object()
+
+    def __init__(self, collection, batch_size=200, max_age=1.0, capacity=10000):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.queue = queue.Queue(maxsize=capacity)
+
+        self.inserted = 0
+        self.batches = 0
+        self.failures = 0
+
+        self.thread = threading.Thread(target=self._run, name='event-sink', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, event):
+        self.queue.put(event)
+
+    def flush(self):
+        if self.thread.is_alive():
+            self.queue.put(EventSink.FLUSH)
+            self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(EventSink.CLOSE)
+            self.thread.join()
+
+    def stats(self):
+        return {
+            'inserted': self.inserted,
+            'batches': self.batches,
+            'failures': self.failures,
+            'queued': self.queue.qsize()
+        }
+
+    def _run(self):
+        batch = []
+        started = 0
+        # taken off the queue but not marked done yet, flush() waits on those
+        unfinished = 0
+        closing = False
+
+        while not closing:
+            timeout = max(0, started + self.max_age - time.monotonic()) if batch else None
+            try:
+                event = self.queue.get(timeout=timeout)
+                unfinished += 1
+            except queue.Empty:
+                event = None
+
+            if event is EventSink.CLOSE:
+                closing = True
+            elif event is not None and event is not EventSink.FLUSH:
+                if not batch:
+                    started = time.monotonic()
+                batch.append(event)
+                if len(batch) < self.batch_size and time.monotonic() - started < self.max_age:
+                    continue
+
+            # the batch is full or old, or someone asked for it
+            if batch:
+                self._write(batch)
+                batch = []
+            for i in range(unfinished):
+                self.queue.task_done()
+            unfinished = 0
+
+    def _write(self, batch):
+        self.batches += 1
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            self.inserted += len(batch)
+        except Exception as e:
+            # anything escaping here would kill the writer and leave flush() waiting forever
+            self.failures += len(batch)
+            print('Exception during event batch insert')
+            print(e)
+
+
+class MemoryService:
+    '''
+        Stand in for MongoService that keeps everything in process memory. It mirrors the
+        MongoService calls so it can be handed to the DM as its db for headless runs.
+    '''
+
+    # only the most recent events are kept around, the rest are just counted
+    EVENT_HISTORY = 1000
+
+    collections = {}
+    events = deque(maxlen=EVENT_HISTORY)
+    event_count = 0
+
+    @classmethod
+    def setup(self, host=None):
+        self.collections = {name: {} for name in MongoService.COLLECTION_MAP.values()}
+        self.events = deque(maxlen=self.EVENT_HISTORY)
+        self.event_count = 0
+
+    @classmethod
+    def get_collection(self, obj):
+        collection = MongoService.get_collection(obj)
+        if not collection:
+            raise ValueError('Did not find collection map for type "{}"'.format(type(obj)))
+        return self.collections.setdefault(collection, {})
+
+    @classmethod
+    def hard_reset(self):
+        self.setup()
+
+    @classmethod
+    def save(self, object):
+        collection = self.get_collection(object)
+        collection[object.id] = object.data_format()
+
+    @classmethod
+    def persist(self, object):
+        collection = self.get_collection(object)
+        collection[object.id] = object.data_format()
+
+    @classmethod
+    def persist_prop(self, object, prop, value):
+        self.persist_fields(object, {prop: value})
+
+    @classmethod
+    def persist_fields(self, object, values):
+        self.get_collection(object).setdefault(object.id, {}).update(values)
+
+    @classmethod
+    def maybe_flush(self):
+        # writes land immediately, there's never anything to flush
+        return False
+
+    @classmethod
+    def flush(self):
+        pass
+
+    @classmethod
+    def flush_writes(self):
+        pass
+
+    @classmethod
+    def save_event(self, type, uuids, msg, transient=False):
+        self.event_count += 1
+        self.events.append({
             'message': msg,
             'object': uuids,
             'type': type,
@@ -97,6 +436,16 @@ class MongoService:
 
 
 class Persister:
+    '''
+        Once an object has been saved, persist() only sends the fields that changed since the
+        last write, compared against a copy of what was sent. Fields listed in IMMUTABLE never
+        change after the first save so they're left out of the comparison and never sent again.
+    '''
+
+    # storage backend shared by every persisted entity, the DM swaps this out for headless runs
+    service = MongoService
+
+    IMMUTABLE = ()
 
     def __init__(self):
         pass
@@ -107,8 +456,14 @@ class Persister:
     def data_format(self):
         raise ValueError('You must override the data_format method.')
 
+    def state_format(self):
+        # the data_format fields that can change, classes with an expensive immutable field
+        # override this so the field isn't built just to be thrown away
+        return {k: v for k, v in self.data_format().items() if k not in self.IMMUTABLE}
+
     def save(self):
-        MongoService.save(self)
+        self.service.save(self)
+        self._sent = copy.deepcopy(self.state_format())
 
         for child in self._children():
             child.save()
@@ -116,13 +471,32 @@ class Persister:
         return self.id
 
     def persist(self):
-        MongoService.persist(self)
+        state = self.state_format()
+        sent = getattr(self, '_sent', None)
+
+        if sent is None:
+            # not written from here before, so there's nothing to compare against
+            self.service.persist(self)
+        else:
+            changes = {k: v for k, v in state.items() if k not in sent or sent[k] != v}
+            if changes:
+                self.service.persist_fields(self, changes)
+        self._sent = copy.deepcopy(state)
 
         for child in self._children():
             child.persist()
 
         return self.id
 
+    def settle(self):
+        # feed messages that name stored data get it read back by the API, so anything write
+        # behind is still holding has to land before one goes out
+        self.service.flush_writes()
+
     def persist_prop(self, prop, value):
-        MongoService.persist_prop(self, prop, value)
+        self.service.persist_prop(self, prop, value)
+
+        sent = getattr(self, '_sent', None)
+        if sent is not None and prop in sent:
+            sent[prop] = copy.deepcopy(value)
         return self.id
\ No newline at end of file
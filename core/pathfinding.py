@@ -0,0 +1,102 @@
+import heapq
+import itertools
+import random
+from collections import deque
+
+'''
+    Shared pathfinding for anything grid shaped, currently dungeons and regions.
+
+    A grid needs getCell(a, b), getNeighbors(cell) which returns navigable neighbors, and
+    getWeight(cell) which is the cost of stepping into a cell. Grids with UNIFORM_WEIGHT set
+    get the plain breadth first search since every step costs the same.
+
+    Searches stop at the provided target cell, or the first cell the goal predicate accepts,
+    whichever comes up first. Paths come back destination first and end with the start cell,
+    which is the order the expedition pops them off in.
+'''
+
+
+def find_path(grid, start, target=None, goal=None):
+    if getattr(grid, 'UNIFORM_WEIGHT', False):
+        return bfs(grid, start, target, goal)
+    return dijkstra(grid, start, target, goal)
+
+
+def bfs(grid, start, target=None, goal=None):
+    start = _resolve(grid, start)
+    target = _resolve(grid, target)
+
+    previous = {start: None}
+    queue = deque([start])
+
+    while queue:
+        cell = queue.popleft()
+
+        if _reached(cell, target, goal):
+            return _unwind(previous, cell)
+
+        for neighbor in grid.getNeighbors(cell):
+            if neighbor not in previous:
+                previous[neighbor] = cell
+                queue.append(neighbor)
+
+    return None
+
+
+def dijkstra(grid, start, target=None, goal=None, randomize=False):
+    # randomize breaks distance ties randomly instead of first come first served, roads use it
+    # so they wander a bit instead of running in straight lines and right angles
+    start = _resolve(grid, start)
+    target = _resolve(grid, target)
+
+    distance = {start: 0}
+    previous = {start: None}
+    done = set()
+
+    counter = itertools.count()
+    heap = [(0, 0, next(counter), start)]
+
+    while heap:
+        dist, _, _, cell = heapq.heappop(heap)
+
+        # stale entry for a cell that was already reached by a shorter route
+        if cell in done:
+            continue
+        done.add(cell)
+
+        if _reached(cell, target, goal):
+            return _unwind(previous, cell)
+
+        for neighbor in grid.getNeighbors(cell):
+            if neighbor in done:
+                continue
+
+            newDistance = dist + grid.getWeight(neighbor)
+            if neighbor not in distance or newDistance < distance[neighbor]:
+                distance[neighbor] = newDistance
+                previous[neighbor] = cell
+                tiebreak = random.random() if randomize else 0
+                heapq.heappush(heap, (newDistance, tiebreak, next(counter), neighbor))
+
+    return None
+
+
+def _resolve(grid, cell):
+    # coordinates are accepted in place of cells
+    if type(cell) == tuple:
+        return grid.getCell(*cell)
+    return cell
+
+
+def _reached(cell, target, goal):
+    if target and cell == target:
+        return True
+    return goal is not None and goal(cell)
+
+
+def _unwind(previous, destination):
+    path = [destination]
+    while previous[destination] is not None:
+        destination = previous[destination]
+        path.append(destination)
+    return path
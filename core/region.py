@@ -1,12 +1,13 @@
 import uuid
 import json
 import random
-import time
 
 from typing import NamedTuple
 from enum import IntEnum
 
 from core.mdb import Persister
+from core.dungeon.dungeons import CELL_FORMAT, encode_tiles
+import core.pathfinding as pathfinding
 import core.strings as strings
 from core.dice import Dice
 import core.doodads as doodads
@@ -15,6 +16,9 @@ import core.critters as critters
 
 class Region(Persister):
 
+    # the terrain is settled before the region is first saved, see state_format
+    IMMUTABLE = ('cells',)
+
     def __init__(self, serialized=None):
         self.grid = []
         self.name = strings.StringTool.random('region_names')
@@ -22,10 +26,13 @@ class Region(Persister):
         self.dungeons = {}
         self.emitters = []
         self.event_saver = None
+        # encoded terrain, built on first use and dropped whenever a cell changes
+        self.encoded_cells = None
 
     def initialize(self, height, width, terrain=None):
         if not terrain:
             raise ValueError('Must provide default terrain to region init.')
+        self.encoded_cells = None
         for i in range(height):
             self.grid.append([])
 
@@ -74,6 +81,7 @@ class Region(Persister):
         self.emit(msg)
 
     def emit_self(self):
+        self.settle()
         msg = {
             'type': 'REGION',
             'context': {
@@ -83,6 +91,7 @@ class Region(Persister):
         self.emit(msg)
 
     def emit_bands(self):
+        self.settle()
         msg = {
             'type': 'BANDS',
             'context': {
@@ -92,6 +101,7 @@ class Region(Persister):
         self.emit(msg)
 
     def emit_band(self, band):
+        self.settle()
         msg = {
             'type': 'BAND',
             'context': {
@@ -112,6 +122,7 @@ class Region(Persister):
         self.emit(msg)
 
     def emit_new_dungeon(self, dungeon):
+        self.settle()
         msg = {
             'type': 'DUNGEON-NEW',
             'context': {
@@ -124,6 +135,7 @@ class Region(Persister):
         # self.emit('DNG-NEW;{}'.format(dungeon.data_format()))
 
     def emit_del_dungeon(self, did):
+        self.settle()
         msg = {
             'type': 'DUNGEON-DEL',
             'context': {
@@ -147,6 +159,7 @@ class Region(Persister):
     def update_cell(self, cell, newtype):
         newcell = self.grid[cell[0]][cell[1]]._replace(type=newtype)
         self.grid[cell[0]][cell[1]] = newcell
+        self.encoded_cells = None
         return newcell
 
     def allCells(self, typeFilter=None, navigable=None):
@@ -208,6 +221,17 @@ class Region(Persister):
             print(display)
 
     def data_format(self):
+        box = self.state_format()
+        box['cells'] = self.encode_cells()
+        return box
+
+    def encode_cells(self):
+        # same layout as dungeon cells, the terrain type of every cell in row order run length encoded
+        if self.encoded_cells is None:
+            self.encoded_cells = {'v': CELL_FORMAT, 'rle': encode_tiles(bytes(c.type for row in self.grid for c in row))}
+        return self.encoded_cells
+
+    def state_format(self):
         return {
             'id': self.id,
             'name': self.name,
@@ -215,7 +239,6 @@ class Region(Persister):
             'height': self.height,
             'homebase': self.homebase,
             'dungeons': self.raw_dungeons(),
-            'cells': json.dumps([c.serialize(False) for c in self.allCells()]),
             'city': self.city.id
         }
 
@@ -576,70 +599,14 @@ class RegionGenerate:
         if type(start) == tuple:
             start = grid.getCell(*start)
 
-        if type(target) == tuple:
-            target = grid.getCell(*target)
-
-        pathingStart = time.perf_counter()
-
-        distance = {}
-        previous = {}
-        q = []
-        destination = None
-
-        for cell in grid.allCells(navigable=True):
-            distance[cell] = 1000000
-            previous[cell] = None
-            q.append(cell)
-
-        distance[start] = 0
-
-        count = 0
-        while len(q) > 0:
-            count += 1
-            lowest = q[0]
-
-            # This extras business is to randomize directions so the paths are a little random instead of 90 degree angles
-            extras = [lowest]
-            for cell in q:
-                if distance[cell] < distance[lowest]:
-                    lowest = cell
-                    extras = [lowest]
-                elif distance[cell] == distance[lowest]:
-                    extras.append(cell)
-            lowest = random.choice(extras)
-            q.remove(lowest)
-
-            # Our break points are finding the target (the capital) or encountering an existing road network
-            if target and lowest == target:
-                destination = lowest
-                break
-            # ideally we'd stop if we hit a road or another town but that can create disconnected road networks
-            elif lowest.type in [Terrain.ROAD] and lowest != start:
-                destination = lowest
-                break
-
-            neighbors = grid.getNeighbors(lowest)
-            for neighbor in [n for n in neighbors if n in q]:
-                weight = grid.getWeight(neighbor)
-                newDistance = distance[lowest] + weight if distance[lowest] else weight
-
-                if newDistance < distance[neighbor]:
-                    distance[neighbor] = newDistance
-                    previous[neighbor] = lowest
-
-        delta = time.perf_counter() - pathingStart
-
-        # self.processMessage('** Pathfinding run complete. Time: {}. Cells examined: {}, Cells remaining: {}'.format(str(delta), count, len(q)))
-
-        if not destination:
+        # Our break points are finding the target (the capital) or encountering an existing road network
+        # ideally we'd stop if we hit a road or another town but that can create disconnected road networks
+        path = pathfinding.dijkstra(grid, start, target, goal=lambda c: c.type == Terrain.ROAD and c != start, randomize=True)
+
+        if not path:
             # this *shouldn't* be possible as long as mapgen has no significant bugs
-            self.processMessage('Pathfinding did not produce a destination')
+            print('Pathfinding did not produce a destination')
             return None
-        
-        path = [destination]
-        while(previous.get(destination, False)):
-            path.append(previous[destination])
-            destination = previous[destination]
 
         return path
 
@@ -0,0 +1,89 @@
+import heapq
+import itertools
+
+
+class Scheduler:
+    '''
+        Heap ordered queue of DM tasks.
+
+        Tasks are the plain dicts the DM already builds ({'action', 'id', 'schedule', ...}). They come
+        back out in schedule order, with ties going to whichever task was added first. Every task is
+        also indexed by its entity id so checking whether a band has anything pending doesn't require
+        a scan of the whole queue.
+
+        Cancelled tasks are left in the heap and skipped when they surface, which keeps cancellation cheap.
+    '''
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        # entity id -> number of live tasks for that entity
+        self._pending = {}
+        # id(task) -> heap entry, so a task can be cancelled with just the dict in hand
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __bool__(self):
+        return len(self._entries) > 0
+
+    def __iter__(self):
+        # not in schedule order, this is just for inspection
+        return (entry[2] for entry in self._entries.values())
+
+    def add(self, task):
+        entry = [task['schedule'], next(self._counter), task]
+        self._entries[id(task)] = entry
+        self._pending[task['id']] = self._pending.get(task['id'], 0) + 1
+        heapq.heappush(self._heap, entry)
+        return task
+
+    def peek(self):
+        self._discard_cancelled()
+        if self._heap:
+            return self._heap[0][2]
+        return None
+
+    def pop(self):
+        self._discard_cancelled()
+        if not self._heap:
+            raise IndexError('pop from an empty scheduler')
+
+        entry = heapq.heappop(self._heap)
+        task = entry[2]
+        self._forget(task)
+        return task
+
+    def has_pending(self, entity_id):
+        return self._pending.get(entity_id, 0) > 0
+
+    def pending(self, entity_id):
+        return [entry[2] for entry in self._entries.values() if entry[2]['id'] == entity_id]
+
+    def cancel(self, task):
+        entry = self._entries.get(id(task))
+        if entry is None:
+            return False
+        # the entry stays in the heap and gets thrown away once it reaches the top
+        entry[2] = None
+        self._forget(task)
+        return True
+
+    def cancel_all(self, entity_id):
+        tasks = self.pending(entity_id)
+        for task in tasks:
+            self.cancel(task)
+        return len(tasks)
+
+    def _forget(self, task):
+        del self._entries[id(task)]
+        remaining = self._pending[task['id']] - 1
+        if remaining:
+            self._pending[task['id']] = remaining
+        else:
+            del self._pending[task['id']]
+
+    def _discard_cancelled(self):
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
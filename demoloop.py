@@ -1,7 +1,10 @@
 import argparse
+import contextlib
+import cProfile
+import os
 import random
 import uuid
-from functools import partial, reduce
+from functools import reduce
 
 from pymongo import MongoClient
 from pymongo.errors import ServerSelectionTimeoutError
@@ -9,19 +12,17 @@ from bson import ObjectId
 import pika
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+import core.clock
 import core.dm
+from core.emitters import MemoryEmitter, RabbitPublisher
 # import core.region as region
 # from core.dice import Dice
 # import core.dungeon.generate
 # from core.dungeon.dungeons import Dungeon
-from core.mdb import MongoService
+from core.mdb import MongoService, MemoryService
 
 _advHandlerSettings = {}
 
-def rabbit_handler(channel, message):
-    # print('$$$$$$$ Emit {}'.format(message))
-    channel.basic_publish(exchange='dungeon', routing_key='*', body=message)
-
 def stdout_processor(str):
     print('>>> {}'.format(str))
 
@@ -41,6 +42,15 @@ if __name__ == "__main__":
     parser.add_argument('-s', '--seed', help="Override random seed generation with the provided value.")
     parser.add_argument('-b', '--bands', type=int, default=2, help="Number of bands to simulate. Default is 2.")
     parser.add_argument('-d', '--dungeons', type=int, default=4, help="Number of potential dungeons to maintain.")
+    parser.add_argument('-f', '--fast-forward', action='store_true', help="Run on a virtual clock, skipping the waits between events.")
+    parser.add_argument('-u', '--until', type=float, help="Stop once this many seconds of simulated time have passed.")
+    parser.add_argument('-p', '--pool', type=int, default=0, help="Keep this many dungeons pre-generated by background workers. Default is 0, generate inline.")
+    parser.add_argument('--headless', action='store_true', help="Keep all persistence and messaging in memory, no Mongo or RabbitMQ required.")
+    parser.add_argument('-w', '--write-behind', action='store_true', help="Batch Mongo writes and flush them together instead of writing on every change.")
+    parser.add_argument('-e', '--event-batch', type=int, help="Write events from a background thread in batches of up to this many.")
+    parser.add_argument('-r', '--retention', type=float, help="Hours to keep transient battle events before Mongo deletes them. Default is 24.")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Discard the DM's console output while the loop runs.")
+    parser.add_argument('--profile', help="Profile the run loop and write the cProfile stats to this file.")
     args = parser.parse_args()
 
     print(args)
@@ -52,38 +62,74 @@ if __name__ == "__main__":
     print('Seed: {}'.format(seed))
     random.seed(seed)
 
-    settings = Settings()
-
-    if args.local:
-        mongo_host = 'localhost'
-        rabbit_host = 'localhost'
+    if args.headless:
+        db = MemoryService
+        db.setup()
+        emitfn = MemoryEmitter()
     else:
-        mongo_host = settings.mongo_host
-        rabbit_host = settings.rabbit_host
-
-    MongoService.setup('mongodb://{}:{}@{}:{}'.format(settings.mongo_user, settings.mongo_password, mongo_host, settings.mongo_port))
-    creds = pika.PlainCredentials(settings.rabbit_user, settings.rabbit_password)
-    parameters = (pika.ConnectionParameters(host=rabbit_host, credentials=creds))
-    
-    connection = pika.BlockingConnection(parameters)
-    channel = connection.channel()
-    channel.exchange_declare('dungeon', exchange_type='fanout', durable=True)
-
-    MongoService.hard_reset()
-    emitfn = partial(rabbit_handler, channel)
+        settings = Settings()
+
+        if args.local:
+            mongo_host = 'localhost'
+            rabbit_host = 'localhost'
+        else:
+            mongo_host = settings.mongo_host
+            rabbit_host = settings.rabbit_host
+
+        db = MongoService
+        db.setup('mongodb://{}:{}@{}:{}'.format(settings.mongo_user, settings.mongo_password, mongo_host, settings.mongo_port), write_behind=args.write_behind, event_batch=args.event_batch,
+            transient_retention=args.retention * 3600 if args.retention else None)
+        creds = pika.PlainCredentials(settings.rabbit_user, settings.rabbit_password)
+        parameters = (pika.ConnectionParameters(host=rabbit_host, credentials=creds))
+
+        db.hard_reset()
+        # publishes from its own thread and connection, the run loop only queues messages
+        emitfn = RabbitPublisher(parameters, 'dungeon')
+
+    if args.fast_forward:
+        clock = core.clock.VirtualClock()
+    else:
+        clock = core.clock.RealClock()
 
     dm = core.dm.DungeonMaster({
-        'db': MongoService,
+        'db': db,
         'rabbit': emitfn,
         'output': stdout_processor,
         'bands': args.bands,
-        'dungeons': args.dungeons
+        'dungeons': args.dungeons,
+        'clock': clock,
+        'pool': args.pool
         })
 
     dm.setup()
 
+    profiler = cProfile.Profile() if args.profile else None
+    output = open(os.devnull, 'w') if args.quiet else None
+
     try:
-        dm.run()
+        with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+            if profiler:
+                profiler.runcall(dm.run, args.until)
+            else:
+                dm.run(args.until)
     except Exception as e:
         print('Top level except exit:', e)
         raise e
+    finally:
+        dm.shutdown()
+        if output:
+            output.close()
+        if profiler:
+            profiler.dump_stats(args.profile)
+            print('Profile written to {}'.format(args.profile))
+        if dm.pool:
+            print('Dungeon pool: {}'.format(dm.pool.stats()))
+        if args.headless:
+            print('Events saved: {}, messages emitted: {}'.format(db.event_count, emitfn.total))
+        else:
+            print('Mongo round trips: {} for {} writes, {} failed and requeued'.format(db.round_trips, db.writes, db.failures))
+            if db.event_sink:
+                print('Event sink: {}'.format(db.event_sink.stats()))
+            emitfn.close()
+            print('Rabbit publisher: {}'.format(emitfn.stats()))
+        print('Simulated {:.1f}s in {:.1f}s of wall time, {:.1f} simulated seconds per wall second.'.format(clock.simulated, clock.elapsed(), clock.rate()))
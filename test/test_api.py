@@ -0,0 +1,358 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+# the API reads its settings at import, none of them are used here
+for name in ['MONGO_USER', 'MONGO_PASSWORD', 'MONGO_HOST', 'MONGO_PORT', 'RABBIT_USER', 'RABBIT_PASSWORD', 'RABBIT_HOST']:
+    os.environ.setdefault(name, 'test')
+
+from api.main import ConnectionManager, ResponseCache, WorldState
+
+
+class FakeWebSocket:
+    # records what it's sent, until the gate is cleared every send waits on it
+
+    def __init__(self):
+        self.received = []
+        self.closed = None
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def accept(self):
+        pass
+
+    async def send_bytes(self, body):
+        await self.gate.wait()
+        self.received.append(json.loads(body))
+
+    async def close(self, code=1000):
+        self.closed = code
+
+
+class FakeMessage:
+
+    def __init__(self, doc):
+        self.body = json.dumps(doc).encode() if isinstance(doc, dict) else doc
+
+
+class FakeCursor:
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self):
+        return self.docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for d in self.docs:
+            yield d
+
+
+class FakeCollection:
+    # equality queries only, a delay makes each read take that long
+
+    def __init__(self, docs=(), delay=0):
+        self.docs = [dict(d) for d in docs]
+        self.delay = delay
+
+    def _match(self, query):
+        return [dict(d) for d in self.docs if all(d.get(k) == v for k, v in query.items())]
+
+    async def find_one(self, query, projection=None):
+        await asyncio.sleep(self.delay)
+        found = self._match(query)
+        return found[0] if found else None
+
+    def find(self, query, projection=None):
+        return FakeCursor(self._match(query))
+
+
+class FakeDatabase:
+
+    def __init__(self):
+        self.regions = FakeCollection([{'id': 'r1', 'name': 'Region', 'dungeons': {}}])
+        self.cities = FakeCollection([{'id': 'c1', 'name': 'City'}])
+        self.bands = FakeCollection([{'id': 'b1', 'active': True}, {'id': 'b2', 'active': False}])
+        self.dungeons = FakeCollection([{
+            'id': 'd1',
+            'complete': False,
+            'rooms': [{'occ': [{'id': 'm1', 'chp': 5, 'status': 'ok'}]}]
+        }])
+        self.expeditions = FakeCollection([{'id': 'e1', 'complete': False, 'location': None}])
+
+
+class FakeRequest:
+
+    def __init__(self, etag=None):
+        self.headers = {'if-none-match': etag} if etag else {}
+
+
+async def settle(condition=lambda: False, rounds=50):
+    # lets the sender tasks run until the condition holds or the rounds are used up
+    for i in range(rounds):
+        await asyncio.sleep(0)
+        if condition():
+            return
+
+
+class TestConnectionManager:
+
+    def test_policy(self):
+        with pytest.raises(ValueError):
+            ConnectionManager(policy='shrug')
+
+    def test_in_order(self):
+        async def scenario():
+            manager = ConnectionManager()
+            sockets = [FakeWebSocket() for i in range(3)]
+            for s in sockets:
+                await manager.connect(s)
+            for i in range(10):
+                manager.publish(json.dumps({'n': i}).encode())
+            await settle(lambda: all(len(s.received) == 10 for s in sockets))
+            return sockets
+
+        for s in asyncio.run(scenario()):
+            assert [m['n'] for m in s.received] == list(range(10))
+
+    def test_drop_oldest(self):
+        async def scenario():
+            manager = ConnectionManager(backlog=5)
+            slow = FakeWebSocket()
+            await manager.connect(slow)
+
+            # the first message is in flight when the rest arrive
+            slow.gate.clear()
+            manager.publish(b'{"n": 0}')
+            await settle()
+            for i in range(1, 20):
+                manager.publish(json.dumps({'n': i}).encode())
+            slow.gate.set()
+            await settle(lambda: len(slow.received) == 6)
+            return manager, slow
+
+        manager, slow = asyncio.run(scenario())
+        # skipped ahead to the oldest message still held
+        assert [m['n'] for m in slow.received] == [0, 15, 16, 17, 18, 19]
+        assert manager.dropped == 14
+        assert slow.closed is None
+
+    def test_disconnect(self):
+        async def scenario():
+            manager = ConnectionManager(backlog=5, policy=ConnectionManager.DISCONNECT)
+            slow = FakeWebSocket()
+            fast = FakeWebSocket()
+            await manager.connect(slow)
+            await manager.connect(fast)
+
+            slow.gate.clear()
+            manager.publish(b'{"n": 0}')
+            await settle()
+            # the fast one keeps up message by message
+            for i in range(1, 20):
+                manager.publish(json.dumps({'n': i}).encode())
+                await settle(lambda: len(fast.received) == i + 1)
+            slow.gate.set()
+            await settle(lambda: slow.closed is not None)
+            # senders still running get cancelled on the way out of asyncio.run, so look now
+            return manager, slow, fast, list(manager.active_connections)
+
+        manager, slow, fast, active = asyncio.run(scenario())
+        assert slow.closed == 1013
+        assert manager.disconnected == 1
+        assert active == [fast]
+        assert len(fast.received) == 20
+
+    def test_send_timeout(self):
+        async def scenario():
+            manager = ConnectionManager(send_timeout=0.05)
+            stuck = FakeWebSocket()
+            await manager.connect(stuck)
+            stuck.gate.clear()
+            manager.publish(b'{"n": 0}')
+            await asyncio.sleep(0.2)
+            return manager, stuck
+
+        manager, stuck = asyncio.run(scenario())
+        assert stuck.closed == 1013
+        assert not manager.active_connections
+
+
+class TestSnapshot:
+
+    def test_sequence(self):
+        async def scenario():
+            world = WorldState(FakeDatabase())
+            await world.load()
+            manager = ConnectionManager()
+            manager.world = world
+
+            await manager.broadcast(FakeMessage({'type': 'NARRATIVE', 'message': 'Hello'}))
+            await manager.broadcast(FakeMessage({'type': 'CURSOR', 'coords': [1, 2], 'context': {'expedition': 'e1'}}))
+
+            socket = FakeWebSocket()
+            await manager.connect(socket, snapshot=True)
+            await manager.broadcast(FakeMessage({'type': 'CURSOR', 'coords': [1, 3], 'context': {'expedition': 'e1'}}))
+            await settle(lambda: len(socket.received) == 2)
+            return socket
+
+        snapshot, cursor = asyncio.run(scenario()).received
+        # the snapshot covers everything up to its seq and the feed carries on from there
+        assert snapshot['type'] == 'SNAPSHOT' and snapshot['seq'] == 2
+        assert snapshot['expeditions'][0]['location'] == [1, 2]
+        assert [b['id'] for b in snapshot['bands']] == ['b1']
+        assert snapshot['region']['city']['id'] == 'c1'
+        assert cursor['seq'] == 3 and cursor['coords'] == [1, 3]
+
+    def test_broadcast_order(self):
+        # a message waiting on a slow read still goes out ahead of the ones behind it
+        async def scenario():
+            db = FakeDatabase()
+            db.bands.delay = 0.05
+            world = WorldState(db)
+            await world.load()
+            manager = ConnectionManager()
+            manager.world = world
+
+            await asyncio.gather(
+                manager.broadcast(FakeMessage({'type': 'BAND', 'context': {'band': 'b1'}})),
+                manager.broadcast(FakeMessage({'type': 'NARRATIVE', 'message': 'After'})),
+                manager.broadcast(FakeMessage(b'not json')),
+                manager.broadcast(FakeMessage(b'[1, 2]')),
+                manager.broadcast(FakeMessage({'type': 'NARRATIVE', 'message': 'Last'})))
+            return manager, world
+
+        manager, world = asyncio.run(scenario())
+        messages = list(manager.messages)
+        assert [json.loads(m)['type'] for m in messages[:2]] == ['BAND', 'NARRATIVE']
+        assert [json.loads(m)['seq'] for m in messages[:2]] == [1, 2]
+        # bodies that aren't JSON objects go out as they came and keep their place
+        assert messages[2:4] == [b'not json', b'[1, 2]']
+        assert json.loads(messages[4])['seq'] == 5
+        assert json.loads(world.snapshot(manager.sequence))['seq'] == 5
+
+    def test_apply(self):
+        async def scenario():
+            db = FakeDatabase()
+            world = WorldState(db)
+            await world.load()
+
+            async def apply(doc):
+                world.apply(doc, await world.fetch(doc))
+
+            first = world.snapshot(0)
+            db.dungeons.docs.append({'id': 'd2', 'complete': False, 'rooms': []})
+            db.regions.docs[0]['dungeons'] = {'d2': [3, 4]}
+            await apply({'type': 'DUNGEON-NEW', 'context': {'dungeon': 'd2'}})
+            assert set(world.dungeons) == {'d1', 'd2'}
+            assert world.region['dungeons'] == {'d2': [3, 4]}
+            assert world.snapshot(0) != first
+
+            await apply({'type': 'DUNGEON-DEL', 'context': {'dungeon': 'd1'}})
+            assert set(world.dungeons) == {'d2'}
+
+            db.bands.docs[0]['active'] = False
+            await apply({'type': 'BAND', 'context': {'band': 'b1'}})
+            assert world.bands == {}
+
+            db.expeditions.docs.append({'id': 'e2', 'complete': False, 'location': None})
+            await apply({'type': 'EXPEDITION-NEW', 'context': {'expedition': 'e2'}})
+            await apply({'type': 'CURSOR', 'coords': [7, 7], 'context': {'expedition': 'e2'}})
+            assert world.expeditions['e2']['location'] == [7, 7]
+            await apply({'type': 'EXPEDITION-DEL', 'context': {'expedition': 'e2'}})
+            assert set(world.expeditions) == {'e1'}
+
+            db.dungeons.docs[1]['rooms'] = [{'occ': [{'id': 'm2', 'chp': 4}]}]
+            await apply({'type': 'DUNGEON-NEW', 'context': {'dungeon': 'd2'}})
+            await apply({'type': 'BATTLE-UPDATE', 'context': {'dungeon': 'd2'}, 'details': {'target': 'm2', 'newhp': 1, 'status': 'hurt'}})
+            assert world.dungeons['d2']['rooms'][0]['occ'][0]['chp'] == 1
+
+            # a region change gets a fresh snapshot
+            before = world.snapshot(0)
+            db.regions.docs[0]['name'] = 'Renamed'
+            await apply({'type': 'REGION', 'context': {'region': 'r1'}})
+            assert json.loads(world.snapshot(0))['region']['name'] == 'Renamed'
+            assert world.snapshot(0) != before
+
+        asyncio.run(scenario())
+
+
+class TestResponseCache:
+
+    def respond(self, cache, endpoint, id, value, etag=None):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return value
+
+        response = asyncio.run(cache.respond(FakeRequest(etag), endpoint, id, fetch))
+        return response, len(calls)
+
+    def test_hit_and_etag(self):
+        cache = ResponseCache()
+        first, fetched = self.respond(cache, 'bands', None, [{'id': 'b1'}])
+        assert fetched == 1 and first.status_code == 200
+        assert json.loads(first.body) == [{'id': 'b1'}]
+
+        second, fetched = self.respond(cache, 'bands', None, 'ignored')
+        assert fetched == 0 and second.body == first.body
+
+        # handing the tag back gets an empty 304, weak or in a list
+        for etag in [first.headers['etag'], 'W/' + first.headers['etag'], '"other", ' + first.headers['etag']]:
+            response, fetched = self.respond(cache, 'bands', None, 'ignored', etag)
+            assert response.status_code == 304 and response.body == b''
+        assert cache.stats() == {'entries': 1, 'hits': 4, 'misses': 1, 'not_modified': 3}
+
+    def test_ttl(self):
+        cache = ResponseCache(ttl=-1)
+        self.respond(cache, 'bands', None, [])
+        response, fetched = self.respond(cache, 'bands', None, [])
+        assert fetched == 1
+
+    def test_scoped_eviction(self):
+        cache = ResponseCache()
+        self.respond(cache, 'band', 'b1', {'id': 'b1'})
+        self.respond(cache, 'band', 'b2', {'id': 'b2'})
+        self.respond(cache, 'bands', None, [])
+
+        cache.invalidate({'type': 'BAND', 'context': {'band': 'b1'}})
+        assert self.respond(cache, 'band', 'b1', {'id': 'b1'})[1] == 1
+        assert self.respond(cache, 'band', 'b2', {'id': 'b2'})[1] == 0
+        assert self.respond(cache, 'bands', None, [])[1] == 1
+
+        # no id in the context clears every band
+        cache.invalidate({'type': 'BANDS', 'context': {'region': 'r1'}})
+        assert self.respond(cache, 'band', 'b2', {'id': 'b2'})[1] == 1
+
+        # messages that don't change anything cached leave it alone
+        cache.invalidate({'type': 'CURSOR', 'context': {'band': 'b2'}})
+        assert self.respond(cache, 'band', 'b2', {'id': 'b2'})[1] == 0
+
+    def test_generation_guard(self):
+        # a read that an eviction lands in the middle of is served but not kept
+        cache = ResponseCache()
+
+        async def fetch():
+            cache.invalidate({'type': 'DUNGEON-NEW', 'context': {'dungeon': 'd1'}})
+            return {'stale': True}
+
+        response = asyncio.run(cache.respond(FakeRequest(), 'region', None, fetch))
+        assert json.loads(response.body) == {'stale': True}
+        assert self.respond(cache, 'region', None, {'stale': False})[1] == 1
+
+    def test_clear(self):
+        async def scenario():
+            cache = ResponseCache()
+            manager = ConnectionManager()
+            manager.cache = cache
+            await cache.respond(FakeRequest(), 'bands', None, lambda: asyncio.sleep(0, []))
+            await manager.broadcast(FakeMessage(b'not json'))
+            return cache
+
+        assert asyncio.run(scenario()).stats()['entries'] == 0
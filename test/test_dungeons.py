@@ -1,6 +1,13 @@
+import base64
+import concurrent.futures
+import json
+import random
+
 import pytest
 
 import core.dungeon.dungeons as dungeons
+import core.dungeon.generate as generate
+from core.dungeon.pool import DungeonPool
 import core.critters
 import definitions.model
 
@@ -60,6 +67,253 @@ class TestDungeon:
         assert len(options3) == 3
         assert dungeons.Directions.EAST not in options3
 
+    @pytest.mark.parametrize('kind', [dungeons.Dungeon, dungeons.CompactDungeon])
+    def test_room_at(self, kind):
+        dungeon = kind()
+        dungeon.initialize(12, 20)
+        first = dungeons.Room(props={'height': 3, 'width': 4})
+        second = dungeons.Room(props={'height': 4, 'width': 3})
+        dungeon.carveRoom(first, (1, 1))
+        dungeon.carveRoom(second, (6, 10))
+
+        assert dungeon.roomAt(dungeon.getCell(2, 3)) is first
+        assert dungeon.roomAt(dungeon.getCell(9, 12)) is second
+        assert dungeon.roomAt(dungeon.getCell(5, 5)) is None
+        assert dungeon.roomAt(None) is None
+
+        brethren = dungeon.roomBrethren(dungeon.getCell(7, 11))
+        assert len(brethren) == 12
+        assert all(c in second for c in brethren)
+
+    @pytest.mark.parametrize('kind', [dungeons.Dungeon, dungeons.CompactDungeon])
+    def test_region_by_position(self, kind):
+        # a cell keeps its region when its tile changes
+        dungeon = kind()
+        dungeon.initialize(5, 10)
+        dungeon.newRegion()
+        passage = dungeon.carvePassage(dungeon.getCell(2, 5))
+        region = dungeon.region_for(passage)
+
+        door = dungeon.update_cell(passage, dungeons.Tiles.DOORWAY)
+        assert region is not None
+        assert dungeon.region_for(door) == region
+        assert dungeon.region_for(dungeon.getCell(2, 5)) == region
+        assert dungeon.region_for(dungeon.getCell(2, 6)) is None
+
+    def test_room_at_deserialized(self):
+        document = {
+            'height': 10,
+            'width': 10,
+            'cells': {'t2': [(2, 2), (2, 3), (3, 2), (3, 3)]},
+            'rooms': [{'n': 1, 'd': (2, 2), 'c': (2, 2)}]
+        }
+        dungeon = dungeons.Dungeon(serialized=json.dumps(document))
+
+        room = dungeon.roomAt(dungeon.getCell(3, 3))
+        assert room is dungeon.rooms[0]
+        assert room.num == 1 and room.coords == (2, 2)
+        assert not room.occupied()
+        assert dungeon.roomAt(dungeon.getCell(4, 4)) is None
+
+
+class TestCellEncoding:
+
+    def test_runs(self):
+        tiles = bytes([1] * 300 + [2, 2, 3] + [1] * 10)
+        encoded = dungeons.encode_tiles(tiles)
+
+        # 300 solid tiles need two runs since a count is a single byte
+        assert base64.b64decode(encoded) == bytes([255, 1, 45, 1, 2, 2, 1, 3, 10, 1])
+        assert dungeons.decode_tiles(encoded, len(tiles)) == tiles
+
+        with pytest.raises(ValueError):
+            dungeons.decode_tiles(encoded, len(tiles) + 1)
+
+    @pytest.mark.parametrize('kind', [dungeons.Dungeon, dungeons.CompactDungeon])
+    def test_round_trip(self, kind):
+        random.seed('encoding')
+        original = generate.DungeonFactoryAlpha.generateDungeon()
+
+        for serialized in [original.serialize(), original.data_format()]:
+            copy = kind(serialized=serialized)
+            assert list(copy.rows()) == list(original.rows())
+            assert [r.coords for r in copy.rooms] == [r.coords for r in original.rooms]
+
+    def test_legacy(self):
+        # documents written before the cell format was versioned
+        cells = {'t2': [(1, 1), (1, 2)], 't3': [(2, 2)], 't4': [], 't5': [(3, 2)]}
+        document = {'height': 10, 'width': 10, 'cells': json.dumps(cells), 'rooms': []}
+
+        dungeon = dungeons.Dungeon(serialized=document)
+        assert dungeon.getCell(1, 2).type == dungeons.Tiles.ROOM
+        assert dungeon.getCell(2, 2).type == dungeons.Tiles.PASSAGE
+        assert dungeon.entrance()[:2] == (3, 2)
+        assert len(dungeon.allCells(navigable=True)) == 4
+
+
+class TestCompactDungeon:
+
+    def test_carving(self):
+        dungeon = dungeons.CompactDungeon()
+        dungeon.grid = TestDungeon().convert_grid(TestDungeon.basic_grid)
+
+        c = dungeon.carvePassage(dungeon.getCell(2, 5))
+        assert c.type == dungeons.Tiles.PASSAGE
+        assert dungeon.getCell(2, 5) == c
+
+        assert len(dungeon.getPossibleCarves(c)) == 4
+        options = dungeon.getPossibleCarves(dungeon.getCell(1, 1))
+        assert len(options) == 2
+        assert dungeons.Directions.NORTH not in options
+        assert dungeons.Directions.WEST not in options
+
+    @pytest.mark.parametrize('seed', ['a', 'b', 'c'])
+    def test_same_map(self, seed):
+        # the compact grid carves exactly what the tuple grid does for the same seed
+        random.seed(seed)
+        grid = generate.DungeonFactoryAlpha.generateDungeon()
+        random.seed(seed)
+        compact = generate.DungeonFactoryAlpha.generateDungeon({'COMPACT_GRID': True})
+
+        assert type(compact) == dungeons.CompactDungeon
+        assert list(compact.rows()) == list(grid.rows())
+        assert len(compact.rooms) == len(grid.rooms)
+
+    @pytest.mark.parametrize('seed', ['a', 'b', 'c'])
+    def test_vectorized(self, seed):
+        pytest.importorskip('numpy')
+        random.seed(seed)
+        plain = generate.DungeonFactoryAlpha.generateDungeon({'COMPACT_GRID': True, 'VECTORIZE': False})
+        random.seed(seed)
+        vectorized = generate.DungeonFactoryAlpha.generateDungeon({'COMPACT_GRID': True, 'VECTORIZE': True})
+
+        assert list(vectorized.rows()) == list(plain.rows())
+        assert vectorized.regions == plain.regions
+
+    def test_carve_mask(self):
+        # agrees with the byte by byte checks while passages get carved at random
+        pytest.importorskip('numpy')
+        random.seed('mask')
+        dungeon = dungeons.CompactDungeon()
+        dungeon.initialize(30, 40)
+        dungeon.carveRoom(dungeons.Room((5, 5), {'height': 6, 'width': 8}), (5, 5))
+        mask = generate.CarveMask(dungeon)
+
+        for i in range(300):
+            x, y = random.randint(1, 28), random.randint(1, 38)
+            cell = dungeon.getCell(x, y)
+            assert mask.safe(x, y) == dungeon.isSafeCarvable(cell)
+            if mask.safe(x, y):
+                cell = mask.carve(cell)
+            if cell.type == dungeons.Tiles.PASSAGE:
+                assert mask.possible(cell) == dungeon.getPossibleCarves(cell)
+
+
+class TestGeneration:
+
+    def reachable(self, dungeon):
+        start = dungeon.entrance()
+        seen = {start[:2]}
+        queue = [start]
+        while queue:
+            for neighbor in dungeon.getNeighbors(queue.pop()):
+                if neighbor[:2] not in seen:
+                    seen.add(neighbor[:2])
+                    queue.append(neighbor)
+        return seen
+
+    @pytest.mark.parametrize('seed', ['a', 'b', 'c', 'd', 'e'])
+    @pytest.mark.parametrize('settings', [{}, {'DEFAULT_HEIGHT': 80, 'DEFAULT_WIDTH': 120, 'MAX_ROOMS': 100, 'MAX_ROOM_ATTEMPTS': 800}])
+    def test_connected(self, seed, settings):
+        # every room and passage can be walked to from the entrance
+        random.seed(seed)
+        dungeon = generate.DungeonFactoryAlpha.generateDungeon(settings)
+
+        assert self.reachable(dungeon) == {c[:2] for c in dungeon.allCells(navigable=True)}
+        assert not dungeon.allCells(dungeons.Tiles.CONNECTOR)
+
+    @pytest.mark.parametrize('seed', ['a', 'b', 'c'])
+    def test_prune_all(self, seed):
+        # with no run limit and no keepers pruning stops once nothing is a dead end
+        random.seed(seed)
+        dungeon = generate.DungeonFactoryAlpha.generateDungeon({'MAX_SPARENESS_RUNS': -1, 'CHANCE_KEEP_DEADEND': 0})
+
+        deadends = [c for c in dungeon.allCells(dungeons.Tiles.PASSAGE) if generate.DungeonFactoryAlpha.isDeadend(dungeon, c[:2])]
+        # the entrance goes in after pruning and isn't a passage any more, its neighbours can look like dead ends
+        entrance = dungeon.entrance()
+        assert all(entrance.adjacent(c[:2]) for c in deadends)
+        assert self.reachable(dungeon) == {c[:2] for c in dungeon.allCells(navigable=True)}
+
+    def test_occupancy(self):
+        # agrees with the tile by tile check on a map that only has rooms carved so far
+        random.seed('occupancy')
+        dungeon = dungeons.Dungeon()
+        dungeon.initialize(40, 60)
+        occupancy = generate.Occupancy(40, 60)
+        occupancy.track_anchors(3, 3)
+
+        for i in range(500):
+            coords = (random.randint(1, 40), random.randint(1, 60))
+            room = dungeons.Room(coords, {'height': random.randint(3, 12), 'width': random.randint(3, 12)})
+            assert occupancy.fits(room, coords) == dungeon.canRoomFit(room, coords)
+            if occupancy.fits(room, coords):
+                dungeon.carveRoom(room, coords)
+                occupancy.fill(coords, room.height, room.width)
+
+        # every corner left still takes the smallest room
+        smallest = dungeons.Room(None, {'height': 3, 'width': 3})
+        assert all(dungeon.canRoomFit(smallest, coords) for coords in occupancy.anchors)
+
+    @pytest.mark.parametrize('seed', ['a', 'b', 'c'])
+    def test_free_placement(self, seed):
+        random.seed(seed)
+        dungeon = generate.DungeonFactoryAlpha.generateDungeon({'ROOM_PLACEMENT': 'free'})
+
+        assert dungeon.roomCount() > 0
+        assert self.reachable(dungeon) == {c[:2] for c in dungeon.allCells(navigable=True)}
+
+    def test_stats(self):
+        stats = generate.GenerationStats()
+        for seed in ['a', 'b']:
+            random.seed(seed)
+            generate.DungeonFactoryAlpha.generateDungeon({}, stats)
+
+        assert stats.maps == 2
+        assert [title[:7] for title in stats.stages] == ['Stage {}'.format(i) for i in range(6)]
+        assert 0 < stats.counters['rooms'] <= stats.counters['room_attempts']
+        assert stats.counters['merges'] > 0
+
+        total = generate.GenerationStats()
+        total.merge(stats)
+        total.merge(stats)
+        assert total.maps == 4
+        assert total.counters['rooms'] == 2 * stats.counters['rooms']
+
+        # without stats nothing is recorded anywhere
+        generate.DungeonFactoryAlpha.generateDungeon()
+        assert stats.maps == 2
+
+    def test_stats_failure(self):
+        # with no rooms stage 3 has nothing to start from and throws
+        stats = generate.GenerationStats()
+        with pytest.raises(IndexError):
+            generate.DungeonFactoryAlpha.generateDungeon({'MAX_ROOMS': 0}, stats)
+
+        assert generate.DungeonFactoryAlpha.CURRENT_STATS is None
+        assert stats.current is None
+        assert stats.maps == 0 and stats.counters['failures'] == 1
+
+    def test_region_sets(self):
+        regions = generate.RegionSets()
+        regions.union(1, 2)
+        regions.union(3, 4)
+        assert regions.find(2) == regions.find(1)
+        assert regions.find(3) != regions.find(1)
+
+        regions.union(4, 2)
+        assert len({regions.find(r) for r in [1, 2, 3, 4]}) == 1
+        assert regions.find(5) == 5
+
 
 class TestRoom:
 
@@ -129,3 +383,31 @@ class TestCell:
 
         assert c1.adjacent( (3, 5) )
         assert not c1.adjacent( (10, 12) )
+
+
+class TestDungeonPool:
+
+    settings = {
+        'DEFAULT_HEIGHT': 10,
+        'DEFAULT_WIDTH': 30,
+        'ROOM_HEIGHT_RANGE': (3,4),
+        'ROOM_WIDTH_RANGE': (3,8)
+    }
+
+    def test_take(self):
+        pool = DungeonPool(TestDungeonPool.settings, size=2, workers=1)
+        try:
+            # nothing has been started yet so the first ask is a miss
+            assert pool.take() is None
+            assert pool.misses == 1
+            assert len(pool.pending) == 2
+
+            concurrent.futures.wait(pool.pending, timeout=60)
+
+            d = pool.take()
+            assert type(d) == dungeons.Dungeon
+            assert d.height() == 10 and d.width() == 30
+            assert pool.hits == 1
+            assert pool.stats()['ready'] + pool.stats()['pending'] == 2
+        finally:
+            pool.shutdown()
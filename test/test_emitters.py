@@ -0,0 +1,132 @@
+import threading
+
+import pika.exceptions
+
+from core.emitters import RabbitPublisher
+
+
+class FakeChannel:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.uncommitted = []
+
+    def exchange_declare(self, exchange, exchange_type, durable):
+        pass
+
+    def tx_select(self):
+        self.connection.transactional = True
+
+    def basic_publish(self, exchange, routing_key, body):
+        if self.connection.broker.fail_next:
+            self.connection.broker.fail_next -= 1
+            raise pika.exceptions.StreamLostError('gone')
+        self.uncommitted.append(body)
+
+    def tx_commit(self):
+        self.connection.broker.received.extend(self.uncommitted)
+        self.connection.broker.commits += 1
+        self.uncommitted = []
+
+
+class FakeConnection:
+    # stands in for a pika BlockingConnection, messages land in the broker it was made by
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.transactional = False
+        self.is_open = True
+
+    def channel(self):
+        return FakeChannel(self)
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeBroker:
+
+    def __init__(self, fail_next=0):
+        self.received = []
+        self.connections = []
+        self.commits = 0
+        self.fail_next = fail_next
+        self.open = threading.Event()
+        self.open.set()
+
+    def __call__(self, parameters):
+        self.open.wait()
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+
+class TestRabbitPublisher:
+
+    def test_in_order(self):
+        broker = FakeBroker()
+        broker.open.clear()
+        publisher = RabbitPublisher(None, connect=broker)
+        try:
+            for i in range(100):
+                publisher(str(i).encode())
+            broker.open.set()
+            publisher.flush()
+            assert broker.received == [str(i).encode() for i in range(100)]
+            assert broker.connections[0].transactional
+            # the thread holds at most what it took before connecting, the rest is one more batch
+            assert broker.commits <= 2
+            assert publisher.stats()['batches'] == broker.commits
+            assert publisher.stats()['published'] == 100
+        finally:
+            publisher.close()
+
+    def test_reconnect(self):
+        broker = FakeBroker(fail_next=2)
+        publisher = RabbitPublisher(None, reconnect_delay=0, connect=broker)
+        try:
+            publisher(b'one')
+            publisher(b'two')
+            publisher.flush()
+            assert broker.received == [b'one', b'two']
+            assert len(broker.connections) == 3
+            assert publisher.stats()['reconnects'] == 2
+        finally:
+            publisher.close()
+
+    def test_give_up(self):
+        broker = FakeBroker(fail_next=3)
+        publisher = RabbitPublisher(None, reconnect_delay=0, retries=3, connect=broker)
+        try:
+            publisher(b'lost')
+            publisher.flush()
+            publisher(b'kept')
+            publisher.flush()
+            assert broker.received == [b'kept']
+            assert publisher.stats()['failures'] == 1
+        finally:
+            publisher.close()
+
+    def test_drop_when_full(self):
+        broker = FakeBroker()
+        publisher = RabbitPublisher(None, capacity=1, put_timeout=0.01, connect=broker)
+        publisher.close()
+        # nothing is reading any more so the queue stays full after the first
+        publisher(b'one')
+        publisher(b'two')
+        assert publisher.stats()['dropped'] == 1
+
+    def test_wait_for_room(self):
+        broker = FakeBroker()
+        broker.open.clear()
+        publisher = RabbitPublisher(None, capacity=1, put_timeout=5, connect=broker)
+        try:
+            # the broker comes back well inside the timeout, so nothing is dropped
+            threading.Timer(0.1, broker.open.set).start()
+            for i in range(5):
+                publisher(str(i).encode())
+            publisher.flush()
+            assert broker.received == [str(i).encode() for i in range(5)]
+            assert publisher.stats()['dropped'] == 0
+        finally:
+            publisher.close()
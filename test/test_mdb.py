@@ -0,0 +1,337 @@
+import random
+import time
+from datetime import datetime, timezone
+
+import pytest
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import AutoReconnect
+
+import core.critters
+import core.dungeon.dungeons as dungeons
+import core.region
+import core.dungeon.generate as generate
+from core.mdb import EventSink, MemoryService, MongoService, Persister
+
+
+@pytest.fixture
+def memory():
+    MemoryService.setup()
+    Persister.service = MemoryService
+
+    yield MemoryService
+
+    Persister.service = MongoService
+
+
+class TestMemoryService:
+
+    def test_persistence(self, memory):
+        band = core.critters.Band()
+        band.save()
+        assert memory.collections['bands'][band.id]['wealth'] == 0
+
+        band.add_wealth(10)
+        band.persist()
+        assert memory.collections['bands'][band.id]['wealth'] == 10
+
+        band.persist_prop('active', False)
+        assert memory.collections['bands'][band.id]['active'] is False
+
+    def test_compact_dungeon(self, memory):
+        # stored with the other dungeons and read back as either grid
+        random.seed('compact')
+        dungeon = generate.DungeonFactoryAlpha.generateDungeon({'COMPACT_GRID': True})
+        dungeon.save()
+
+        document = memory.collections['dungeons'][dungeon.id]
+        for kind in [dungeons.Dungeon, dungeons.CompactDungeon]:
+            copy = kind(serialized=document)
+            assert list(copy.rows()) == list(dungeon.rows())
+            assert [r.coords for r in copy.rooms] == [r.coords for r in dungeon.rooms]
+
+    def test_unmapped(self, memory):
+        with pytest.raises(ValueError):
+            memory.save(object())
+
+    def test_events(self, memory):
+        for i in range(memory.EVENT_HISTORY + 5):
+            memory.save_event('general', ['x'], 'Message {}'.format(i))
+
+        assert memory.event_count == memory.EVENT_HISTORY + 5
+        assert len(memory.events) == memory.EVENT_HISTORY
+        assert memory.events[-1]['message'] == 'Message {}'.format(memory.EVENT_HISTORY + 4)
+
+
+class RecordingCollection:
+    # just enough of a pymongo collection to see what the write behind buffer sends
+
+    def __init__(self):
+        self.batches = []
+        self.indexes = []
+
+    def bulk_write(self, ops, ordered=True):
+        self.batches.append(ops)
+
+    def create_index(self, keys, **options):
+        self.indexes.append((keys, options))
+
+    def insert_one(self, document):
+        self.batches.append([document])
+
+
+class FailingCollection(RecordingCollection):
+    # the first few bulk writes fail like a server that went away
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def bulk_write(self, ops, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('gone')
+        super().bulk_write(ops, ordered)
+
+
+class RecordingDatabase:
+
+    def __init__(self):
+        for name in MongoService.COLLECTION_MAP.values():
+            setattr(self, name, RecordingCollection())
+        self.events = RecordingCollection()
+
+
+@pytest.fixture
+def write_behind():
+    MongoService.db = RecordingDatabase()
+    MongoService.write_behind = True
+    MongoService.pending = {}
+    MongoService.pending_writes = 0
+    MongoService.round_trips = 0
+    MongoService.failures = 0
+    MongoService.last_flush = time.monotonic()
+    # only explicit flushes for the tests
+    MongoService.flush_interval = 3600
+
+    yield MongoService
+
+    MongoService.db = None
+    MongoService.write_behind = False
+    MongoService.flush_interval = MongoService.FLUSH_INTERVAL
+
+
+class TestWriteBehind:
+
+    def test_coalesce(self, write_behind):
+        band = core.critters.Band()
+        band.save()
+        band.add_wealth(10)
+        band.persist()
+        band.persist_prop('active', False)
+
+        other = core.critters.Band()
+        other.persist_prop('wealth', 5)
+        other.persist_prop('active', False)
+
+        assert write_behind.round_trips == 0
+        write_behind.flush()
+
+        # one round trip for the whole collection, one op per band
+        bands = write_behind.db.bands
+        assert write_behind.round_trips == 1
+        assert len(bands.batches) == 1 and len(bands.batches[0]) == 2
+
+        replace, update = bands.batches[0]
+        assert type(replace) == ReplaceOne
+        assert replace._doc['wealth'] == 10 and replace._doc['active'] is False
+        # the band was never inserted, the replace has to do it
+        assert replace._upsert
+
+        assert type(update) == UpdateOne
+        assert update._doc == {'$set': {'wealth': 5, 'active': False}}
+
+        assert write_behind.pending == {}
+
+    def test_flush_on_count(self, write_behind):
+        write_behind.flush_ops = 3
+        try:
+            band = core.critters.Band()
+            band.persist_prop('wealth', 1)
+            band.persist_prop('wealth', 2)
+            assert write_behind.db.bands.batches == []
+
+            band.persist_prop('wealth', 3)
+            assert len(write_behind.db.bands.batches) == 1
+            assert write_behind.db.bands.batches[0][0]._doc == {'$set': {'wealth': 3}}
+        finally:
+            write_behind.flush_ops = write_behind.FLUSH_OPS
+
+    def test_setup_defaults(self, write_behind, monkeypatch):
+        # settings given to one setup() don't become the defaults for the next
+        class Client:
+            dungeondb = RecordingDatabase()
+
+        monkeypatch.setattr('core.mdb.MongoClient', lambda host: Client())
+        write_behind.setup('mongodb://nowhere', write_behind=True, interval=5, ops=10, transient_retention=60)
+        assert (write_behind.flush_interval, write_behind.flush_ops, write_behind.transient_retention) == (5, 10, 60)
+
+        write_behind.setup('mongodb://nowhere', write_behind=True)
+        assert write_behind.flush_interval == write_behind.FLUSH_INTERVAL == 1.0
+        assert write_behind.flush_ops == write_behind.FLUSH_OPS == 500
+        assert write_behind.transient_retention == write_behind.TRANSIENT_RETENTION == 24 * 3600
+
+    def test_failed_flush(self, write_behind):
+        # a failed batch goes back in the queue, persist() won't send those fields again
+        write_behind.db.bands = FailingCollection(1)
+        band = core.critters.Band()
+        band.save()
+        band.add_wealth(10)
+        band.persist()
+        other = core.critters.Delver.random()
+        other.save()
+
+        write_behind.flush()
+        assert write_behind.failures == 1
+        assert list(write_behind.pending) == [('bands', band.id)]
+        assert len(write_behind.db.delvers.batches) == 1
+
+        band.persist()
+        write_behind.flush()
+        replace, = write_behind.db.bands.batches[0]
+        assert replace._doc['wealth'] == 10 and replace._upsert
+        assert write_behind.pending == {}
+
+    def test_written_before_emit(self, write_behind):
+        # the API reads back what a feed message names, so queued writes go out first
+        sent = []
+        region = core.region.Region()
+        region.register_emitter(lambda body: sent.append(len(write_behind.db.bands.batches)))
+
+        band = core.critters.Band()
+        band.save()
+        region.emit_narrative('Nothing to read back.')
+        assert sent == [0]
+
+        region.emit_band(band)
+        assert sent == [0, 1]
+        assert write_behind.pending == {}
+
+
+class TestIndexes:
+
+    def test_ensure_indexes(self, write_behind):
+        MongoService.ensure_indexes()
+
+        for name in MongoService.COLLECTION_MAP.values():
+            assert getattr(MongoService.db, name).indexes == [([('id', 1)], {'unique': True})]
+        assert MongoService.db.events.indexes == [
+            ([('object', 1), ('_id', -1)], {}),
+            ([('expire_at', 1)], {'expireAfterSeconds': 0})
+        ]
+
+    def test_transient_expiry(self, write_behind):
+        MongoService.save_event('battle', ['a'], 'Swing and a miss.', transient=True)
+        MongoService.save_event('expedition', ['a'], 'The band sets out.')
+
+        transient, kept = [b[0] for b in MongoService.db.events.batches]
+        remaining = (transient['expire_at'] - datetime.now(timezone.utc)).total_seconds()
+        assert MongoService.transient_retention - 60 < remaining <= MongoService.transient_retention
+        assert 'expire_at' not in kept
+
+
+class RecordingEvents:
+
+    def __init__(self, delay=0):
+        self.batches = []
+        self.delay = delay
+
+    def insert_many(self, events, ordered=True):
+        time.sleep(self.delay)
+        self.batches.append(list(events))
+
+
+class TestEventSink:
+
+    def test_batch_size(self):
+        events = RecordingEvents()
+        sink = EventSink(events, batch_size=3, max_age=3600)
+        try:
+            for i in range(7):
+                sink.put({'message': i})
+            sink.flush()
+
+            assert [len(b) for b in events.batches] == [3, 3, 1]
+            assert [e['message'] for b in events.batches for e in b] == list(range(7))
+            assert sink.stats()['inserted'] == 7
+        finally:
+            sink.close()
+
+    def test_max_age(self):
+        events = RecordingEvents()
+        sink = EventSink(events, batch_size=100, max_age=0.05)
+        try:
+            sink.put({'message': 'a'})
+            sink.put({'message': 'b'})
+
+            deadline = time.monotonic() + 5
+            while not events.batches and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert len(events.batches) == 1 and len(events.batches[0]) == 2
+        finally:
+            sink.close()
+
+    def test_close(self):
+        events = RecordingEvents(delay=0.01)
+        sink = EventSink(events, batch_size=2, max_age=3600, capacity=2)
+        # a tiny queue and a slow writer, put has to wait for room but nothing gets lost
+        for i in range(10):
+            sink.put({'message': i})
+        sink.close()
+
+        assert not sink.thread.is_alive()
+        assert sum(len(b) for b in events.batches) == 10
+
+
+class TestDirtyFields:
+
+    @pytest.fixture
+    def sent(self, memory, monkeypatch):
+        # record what persist hands the service on top of letting it through
+        calls = []
+        persist_fields = memory.persist_fields
+        monkeypatch.setattr(memory, 'persist', lambda o: calls.append(('persist', None)))
+        monkeypatch.setattr(memory, 'persist_fields', lambda o, v: (calls.append(('fields', v)), persist_fields(o, v)))
+        yield calls
+
+    def test_changes_only(self, memory, sent):
+        band = core.critters.Band()
+        band.save()
+
+        band.persist()
+        assert sent == []
+
+        band.add_wealth(10)
+        band.persist()
+        assert sent == [('fields', {'wealth': 10, 'lifetime_wealth': 10})]
+        assert memory.collections['bands'][band.id]['wealth'] == 10
+        assert memory.collections['bands'][band.id]['name'] == band.name
+
+    def test_unsaved(self, memory, sent):
+        # nothing to compare with yet so the whole document goes
+        band = core.critters.Band()
+        band.persist()
+        assert sent == [('persist', None)]
+
+        band.active = False
+        band.persist()
+        assert sent[-1] == ('fields', {'active': False})
+
+    def test_immutable(self, memory, sent):
+        dungeon = generate.DungeonFactoryAlpha.generateDungeon()
+        dungeon.save()
+        assert 'cells' in memory.collections['dungeons'][dungeon.id]
+
+        dungeon.complete = True
+        dungeon.persist()
+        assert sent == [('fields', {'complete': True})]
+        assert 'cells' not in dungeon.state_format()
@@ -0,0 +1,88 @@
+import core.dungeon.dungeons as dungeons
+from core.exploration import Exploration
+import core.pathfinding as pathfinding
+import core.region as region
+
+
+def build_dungeon(rows):
+    dungeon = dungeons.Dungeon()
+    dungeon.initialize(len(rows), len(rows[0]))
+    for i, row in enumerate(rows):
+        for j, t in enumerate(row):
+            dungeon.update_cell((i, j), dungeons.Tiles(t))
+    return dungeon
+
+
+class TestPathfinding:
+
+    # 1 is solid, 3 is passage
+    corridor = [
+        [1, 1, 1, 1, 1, 1, 1],
+        [1, 3, 3, 3, 3, 3, 1],
+        [1, 3, 1, 1, 1, 3, 1],
+        [1, 3, 3, 3, 1, 3, 1],
+        [1, 1, 1, 1, 1, 1, 1]
+    ]
+
+    def test_bfs(self):
+        dungeon = build_dungeon(TestPathfinding.corridor)
+
+        path = pathfinding.find_path(dungeon, (3, 3), target=(3, 5))
+        # destination first, start last
+        assert path[0] == dungeon.getCell(3, 5)
+        assert path[-1] == dungeon.getCell(3, 3)
+        assert len(path) == 11
+        for a, b in zip(path, path[1:]):
+            assert a.adjacent(b[0:2])
+
+        assert pathfinding.find_path(dungeon, (1, 1), target=(1, 1)) == [dungeon.getCell(1, 1)]
+
+    def test_goal(self):
+        dungeon = build_dungeon(TestPathfinding.corridor)
+
+        path = pathfinding.find_path(dungeon, (1, 1), goal=lambda c: c.w == 5)
+        assert path[0] == dungeon.getCell(1, 5)
+        assert len(path) == 5
+
+        assert pathfinding.find_path(dungeon, (1, 1), goal=lambda c: False) is None
+
+    def test_weighted(self):
+        r = region.Region()
+        r.initialize(3, 5, region.Terrain.PLAIN)
+        # a road along the bottom is cheaper than walking straight across the plains
+        for j in range(5):
+            r.update_cell((2, j), region.Terrain.ROAD)
+
+        path = pathfinding.find_path(r, (1, 0), target=(1, 4))
+        assert path[0] == r.getCell(1, 4)
+        assert path[-1] == r.getCell(1, 0)
+        assert r.getCell(2, 2) in path
+
+        # the uniform search would have gone straight across
+        straight = pathfinding.bfs(r, (1, 0), target=(1, 4))
+        assert len(straight) == 5
+
+
+class TestExploration:
+
+    def test_frontier(self):
+        dungeon = build_dungeon(TestPathfinding.corridor)
+        explored = Exploration(dungeon)
+
+        assert explored.visit(dungeon.getCell(1, 1))
+        assert not explored.visit(dungeon.getCell(1, 1))
+        assert dungeon.getCell(1, 1) in explored
+        assert explored.frontier == {(1, 2), (2, 1)}
+
+        # walk down the left side, the closest unexplored cell is then back up top
+        for coords in [(2, 1), (3, 1), (3, 2), (3, 3)]:
+            explored.visit(dungeon.getCell(*coords))
+
+        path = explored.nearest(dungeon.getCell(3, 3))
+        assert path[0] == dungeon.getCell(1, 2)
+        assert len(path) == 6
+
+        for cell in dungeon.allCells(navigable=True):
+            explored.visit(cell)
+        assert explored.complete()
+        assert explored.nearest(dungeon.getCell(3, 3)) is None
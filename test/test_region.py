@@ -0,0 +1,40 @@
+import random
+
+import core.dungeon.dungeons as dungeons
+import core.region as region
+
+
+class TestRegionCells:
+
+    def build(self):
+        r = region.Region()
+        r.initialize(10, 20, region.Terrain.PLAIN)
+        return r
+
+    def test_encoding(self):
+        r = self.build()
+        r.update_cell((2, 3), region.Terrain.ROAD)
+
+        cells = r.encode_cells()
+        assert cells['v'] == dungeons.CELL_FORMAT
+
+        tiles = dungeons.decode_tiles(cells['rle'], 200)
+        assert tiles[2 * 20 + 3] == region.Terrain.ROAD
+        assert tiles.count(region.Terrain.PLAIN) == 199
+
+    def test_cached(self):
+        r = self.build()
+        first = r.encode_cells()
+        assert r.encode_cells() is first
+
+        # a terrain change has to show up in the next encoding
+        r.update_cell((0, 0), region.Terrain.WATER)
+        changed = r.encode_cells()
+        assert changed is not first
+        assert dungeons.decode_tiles(changed['rle'], 200)[0] == region.Terrain.WATER
+
+    def test_generated(self):
+        random.seed('region')
+        r = region.RegionGenerate.generate_region()
+        tiles = dungeons.decode_tiles(r.encode_cells()['rle'], r.height * r.width)
+        assert list(tiles) == [c.type for c in r.allCells()]
@@ -0,0 +1,64 @@
+import pytest
+
+from core.scheduler import Scheduler
+
+
+def task(action, id, schedule):
+    return {'action': action, 'id': id, 'schedule': schedule}
+
+
+class TestScheduler:
+
+    def test_ordering(self):
+        s = Scheduler()
+        s.add(task('exp', 'a', 30))
+        s.add(task('exp', 'b', 10))
+        s.add(task('exp', 'c', 20))
+
+        assert len(s) == 3
+        assert s.peek()['id'] == 'b'
+        assert [s.pop()['id'] for i in range(3)] == ['b', 'c', 'a']
+        assert not s
+
+        with pytest.raises(IndexError):
+            s.pop()
+
+    def test_ties(self):
+        # tasks scheduled for the same time come out in the order they were added
+        s = Scheduler()
+        for name in ['first', 'second', 'third']:
+            s.add(task(name, 'band', 5))
+
+        assert [s.pop()['action'] for i in range(3)] == ['first', 'second', 'third']
+
+    def test_pending(self):
+        s = Scheduler()
+        s.add(task('train', 'band', 10))
+        s.add(task('downtime_end', 'band', 20))
+        s.add(task('restock', 'venue', 15))
+
+        assert s.has_pending('band')
+        assert len(s.pending('band')) == 2
+        assert not s.has_pending('nobody')
+
+        s.pop()
+        assert s.has_pending('band')
+        s.pop()
+        s.pop()
+        assert not s.has_pending('band')
+
+    def test_cancel(self):
+        s = Scheduler()
+        t1 = s.add(task('exp', 'a', 10))
+        s.add(task('exp', 'b', 20))
+        s.add(task('exp', 'a', 30))
+
+        assert s.cancel(t1)
+        assert not s.cancel(t1)
+        assert len(s) == 2
+        assert s.peek()['id'] == 'b'
+
+        assert s.cancel_all('a') == 1
+        assert not s.has_pending('a')
+        assert s.pop()['id'] == 'b'
+        assert not s
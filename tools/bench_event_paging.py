@@ -0,0 +1,112 @@
+import argparse
+import time
+
+from pymongo import MongoClient
+
+from core.mdb import MongoService
+
+# Reading one object's events a page at a time out of a large events collection in a real mongod:
+# skip/limit paging with no index (how the API started out), skip/limit with the (object, _id)
+# index MongoService now creates, and keyset paging on that index with before=<_id>. Reports the
+# time for a page at a few depths and how many documents the server looked at for it. Writes to
+# a scratch database that gets dropped afterwards.
+# No results recorded yet: this hasn't been run against a real mongod, so the index and keyset
+# paging gains are still unmeasured.
+
+PAGE = 20
+
+
+def fill(events, count, objects):
+    batch = []
+    for i in range(count):
+        batch.append({
+            'message': 'Benchmark event {}'.format(i),
+            'object': ['object{}'.format(i % objects)],
+            'type': 'general',
+            'transient': False,
+            'time': time.time()
+        })
+        if len(batch) == 10000:
+            events.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        events.insert_many(batch, ordered=False)
+
+
+def examined(cursor):
+    stats = cursor.explain()['executionStats']
+    return stats['totalDocsExamined']
+
+
+def skip_page(events, target, page):
+    return events.find({'object': target}).sort({'_id': -1}).skip((page - 1) * PAGE).limit(PAGE)
+
+
+def keyset_page(events, target, before):
+    query = {'object': target}
+    if before is not None:
+        query['_id'] = {'$lt': before}
+    return events.find(query).sort({'_id': -1}).limit(PAGE)
+
+
+def timed(make, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        results = list(make())
+    return (time.perf_counter() - start) * 1000 / repeat, results
+
+
+def keyset_cursors(events, target, pages):
+    # the before value for each page, found by walking the pages the way a client would
+    cursors = [None]
+    before = None
+    for page in range(1, max(pages)):
+        results = list(keyset_page(events, target, before))
+        if not results:
+            break
+        before = results[-1]['_id']
+        cursors.append(before)
+    return cursors
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Events paging, skip/limit versus keyset, with and without the index.')
+    parser.add_argument('-m', '--mongo', default='mongodb://localhost:27017', help='Mongo connection string.')
+    parser.add_argument('-n', '--count', type=int, default=1000000, help='Events in the collection.')
+    parser.add_argument('-o', '--objects', type=int, default=100, help='Objects the events are spread over.')
+    parser.add_argument('-p', '--pages', type=int, nargs='+', default=[1, 10, 100, 400], help='Page depths to time.')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Times to read each page.')
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo)
+    db = client.dungeondb_bench
+    db.events.drop()
+
+    try:
+        fill(db.events, args.count, args.objects)
+        target = 'object0'
+
+        print('{:<16} {:>6} {:>10} {:>12}'.format('paging', 'page', 'ms', 'examined'))
+        for page in args.pages:
+            ms, results = timed(lambda: skip_page(db.events, target, page), args.repeat)
+            print('{:<16} {:>6} {:>10.2f} {:>12}'.format('skip, no index', page, ms, examined(skip_page(db.events, target, page))))
+
+        db.events.create_index(MongoService.EVENT_INDEX)
+
+        for page in args.pages:
+            ms, results = timed(lambda: skip_page(db.events, target, page), args.repeat)
+            print('{:<16} {:>6} {:>10.2f} {:>12}'.format('skip, index', page, ms, examined(skip_page(db.events, target, page))))
+
+        cursors = keyset_cursors(db.events, target, args.pages)
+        for page in args.pages:
+            if page > len(cursors):
+                break
+            before = cursors[page - 1]
+            ms, results = timed(lambda: keyset_page(db.events, target, before), args.repeat)
+            if results != list(skip_page(db.events, target, page)):
+                raise RuntimeError('Keyset page {} does not match the skip page'.format(page))
+            print('{:<16} {:>6} {:>10.2f} {:>12}'.format('keyset, index', page, ms, examined(keyset_page(db.events, target, before))))
+    finally:
+        client.drop_database('dungeondb_bench')
+        client.close()
@@ -0,0 +1,70 @@
+import argparse
+import time
+
+from pymongo import MongoClient
+
+from core.mdb import EventSink
+
+# Events per second into a real mongod, one insert_one per event (what save_event does without a
+# sink) against the batched EventSink. Writes to a scratch database that gets dropped afterwards.
+# No results recorded yet: this hasn't been run against a real mongod, so the EventSink speedup
+# is still unmeasured.
+
+
+def make_event(i):
+    return {
+        'message': 'Benchmark event {}'.format(i),
+        'object': ['bench'],
+        'type': 'general',
+        'transient': False,
+        'time': time.time()
+    }
+
+
+def single(collection, count):
+    start = time.perf_counter()
+    for i in range(count):
+        collection.insert_one(make_event(i))
+    return time.perf_counter() - start
+
+
+def batched(collection, count, batch_size, max_age):
+    sink = EventSink(collection, batch_size=batch_size, max_age=max_age)
+    start = time.perf_counter()
+    for i in range(count):
+        sink.put(make_event(i))
+    # the run isn't over until everything is in the database
+    sink.flush()
+    elapsed = time.perf_counter() - start
+    sink.close()
+    return elapsed, sink.stats()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Event insert throughput, one at a time versus the batched sink.')
+    parser.add_argument('-m', '--mongo', default='mongodb://localhost:27017', help='Mongo connection string.')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='Events to write per run.')
+    parser.add_argument('-b', '--batch', type=int, default=200, help='Sink batch size.')
+    parser.add_argument('-a', '--age', type=float, default=1.0, help='Sink max batch age in seconds.')
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo)
+    db = client.dungeondb_bench
+    db.events.drop()
+
+    try:
+        single_time = single(db.events, args.count)
+        db.events.drop()
+        batched_time, stats = batched(db.events, args.count, args.batch, args.age)
+
+        if db.events.count_documents({}) != args.count:
+            raise RuntimeError('Sink wrote {} of {} events'.format(db.events.count_documents({}), args.count))
+
+        print('{:<12} {:>12} {:>10}'.format('writes', 'events/s', 'batches'))
+        print('{:<12} {:>12.0f} {:>10}'.format('insert_one', args.count / single_time, args.count))
+        print('{:<12} {:>12.0f} {:>10}'.format('sink', args.count / batched_time, stats['batches']))
+        print('Speedup: {:.1f}x'.format(single_time / batched_time))
+    finally:
+        client.drop_database('dungeondb_bench')
+        client.close()
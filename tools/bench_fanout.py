@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import base64
+import os
+import socket
+import time
+
+# the API reads its settings at import, none of them matter here
+for name in ['MONGO_USER', 'MONGO_PASSWORD', 'MONGO_HOST', 'MONGO_PORT', 'RABBIT_USER', 'RABBIT_PASSWORD', 'RABBIT_HOST']:
+    os.environ.setdefault(name, 'bench')
+
+import uvicorn
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from websockets.asyncio.client import connect
+
+from api.main import ConnectionManager
+
+# Websocket fan-out with a crowd of local clients, a few of which never read anything. Compares
+# the ConnectionManager against the old broadcast that awaited every send in turn. Reports how
+# long the broadcasting side spent per message and how long the reading clients took to get
+# everything.
+
+
+class SequentialManager:
+    # the original broadcast, kept as the baseline
+
+    def __init__(self):
+        self.active_connections = []
+
+    async def connect(self, websocket):
+        await websocket.accept()
+        self.active_connections.append(websocket)
+
+    def disconnect(self, websocket):
+        self.active_connections.remove(websocket)
+
+    async def publish(self, body):
+        for connection in list(self.active_connections):
+            try:
+                await connection.send_bytes(body)
+            except Exception:
+                self.active_connections.remove(connection)
+
+
+def build_app(manager):
+    app = FastAPI()
+
+    @app.websocket('/feed')
+    async def feed(websocket: WebSocket):
+        await manager.connect(websocket)
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            manager.disconnect(websocket)
+
+    return app
+
+
+async def reader(url, count, connected, finished):
+    # no keepalive pings, with everything in one process a busy loop would read as dead peers
+    async with connect(url, max_size=None, ping_interval=None) as ws:
+        connected.release()
+        for i in range(count):
+            await ws.recv()
+        finished.append(time.perf_counter())
+
+
+async def stalled(port, connected, stop):
+    # does the websocket handshake by hand and then never reads again, with a small receive
+    # buffer so the server feels it quickly
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+    reader, writer = await asyncio.open_connection(sock=sock)
+    try:
+        writer.write((
+            'GET /feed HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+            'Sec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n\r\n').format(base64.b64encode(os.urandom(16)).decode()).encode())
+        await reader.readuntil(b'\r\n\r\n')
+        reader._transport.pause_reading()
+        connected.release()
+        await stop.wait()
+    finally:
+        writer.close()
+
+
+async def run(kind, args):
+    manager = SequentialManager() if kind == 'sequential' else ConnectionManager(args.backlog, args.policy, args.send_timeout)
+    server = uvicorn.Server(uvicorn.Config(build_app(manager), port=args.port, log_level='critical', ws='websockets', ws_ping_interval=None))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    url = 'ws://127.0.0.1:{}/feed'.format(args.port)
+    connected = asyncio.Semaphore(0)
+    stop = asyncio.Event()
+    finished = []
+
+    clients = [asyncio.create_task(stalled(args.port, connected, stop)) for i in range(args.stalled)]
+    clients += [asyncio.create_task(reader(url, args.messages, connected, finished)) for i in range(args.clients - args.stalled)]
+    for i in range(args.clients):
+        await connected.acquire()
+    while len(manager.active_connections) < args.clients:
+        await asyncio.sleep(0.05)
+
+    body = b'x' * args.size
+    publishing = 0
+    start = time.perf_counter()
+    timed_out = False
+    try:
+        for i in range(args.messages):
+            mark = time.perf_counter()
+            result = manager.publish(body)
+            # the old broadcast is only done once every client has taken the message
+            if asyncio.iscoroutine(result):
+                await asyncio.wait_for(result, args.timeout)
+            publishing += time.perf_counter() - mark
+            await asyncio.sleep(args.interval)
+
+        readers = args.clients - args.stalled
+        deadline = time.perf_counter() + args.timeout
+        while len(finished) < readers and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+    except asyncio.TimeoutError:
+        timed_out = True
+
+    delivered = (max(finished) - start) if len(finished) == args.clients - args.stalled else None
+
+    stop.set()
+    for c in clients:
+        c.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    server.should_exit = True
+    await serving
+
+    return {
+        'publish_ms': publishing * 1000 / args.messages,
+        'delivered_s': delivered,
+        'readers_done': len(finished),
+        'timed_out': timed_out,
+        'dropped': getattr(manager, 'dropped', 0),
+        'disconnected': getattr(manager, 'disconnected', 0)
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Websocket fan-out benchmark with local clients.')
+    parser.add_argument('-c', '--clients', type=int, default=1000, help='Connected clients.')
+    parser.add_argument('-s', '--stalled', type=int, default=10, help='How many of those never read.')
+    parser.add_argument('-m', '--messages', type=int, default=250, help='Messages to broadcast.')
+    parser.add_argument('--size', type=int, default=16384, help='Message size in bytes.')
+    parser.add_argument('--interval', type=float, default=0.005, help='Pause between broadcasts.')
+    parser.add_argument('--backlog', type=int, default=100, help='ConnectionManager backlog.')
+    parser.add_argument('--policy', default=ConnectionManager.DROP_OLDEST, help='Slow consumer policy.')
+    parser.add_argument('--send-timeout', type=float, default=5, help='ConnectionManager send timeout.')
+    parser.add_argument('--timeout', type=float, default=60, help='Give up on a run after this many seconds.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--skip-sequential', action='store_true', help="Don't run the old broadcast.")
+    args = parser.parse_args()
+
+    kinds = ['managed'] if args.skip_sequential else ['sequential', 'managed']
+    print('{:<12} {:>12} {:>12} {:>10} {:>10} {:>12}'.format('broadcast', 'publish ms', 'delivered s', 'readers', 'dropped', 'disconnected'))
+    for kind in kinds:
+        r = asyncio.run(run(kind, args))
+        delivered = '{:.2f}'.format(r['delivered_s']) if r['delivered_s'] is not None else 'stalled'
+        print('{:<12} {:>12.3f} {:>12} {:>10} {:>10} {:>12}'.format(
+            kind, r['publish_ms'], delivered, r['readers_done'], r['dropped'], r['disconnected']))
@@ -0,0 +1,47 @@
+import argparse
+import random
+import time
+
+import core.dungeon.generate
+
+# Time to generate maps with DungeonFactoryAlpha at a given size. Each map gets its own seed so
+# runs are repeatable and a before/after comparison carves the same layouts.
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Dungeon generation time at a given map size.')
+    parser.add_argument('-n', '--count', type=int, default=3, help='Maps to generate.')
+    parser.add_argument('--height', type=int, default=200, help='Map height.')
+    parser.add_argument('--width', type=int, default=300, help='Map width.')
+    parser.add_argument('-r', '--rooms', type=int, default=400, help='Most rooms to place.')
+    parser.add_argument('-a', '--attempts', type=int, default=3000, help='Room placement attempts.')
+    parser.add_argument('-s', '--seed', default='generation', help='Seed prefix.')
+    parser.add_argument('--compact', action='store_true', help='Generate on the compact grid.')
+    parser.add_argument('--stats', action='store_true', help='Break the time down by stage, with the generation counters.')
+    parser.add_argument('--placement', default='random', choices=['random', 'free'], help='Room placement mode.')
+    parser.add_argument('--no-vectorize', action='store_true', help="Don't use numpy even if it's installed.")
+    args = parser.parse_args()
+
+    settings = {
+        'DEFAULT_HEIGHT': args.height,
+        'DEFAULT_WIDTH': args.width,
+        'MAX_ROOMS': args.rooms,
+        'MAX_ROOM_ATTEMPTS': args.attempts,
+        'COMPACT_GRID': args.compact,
+        'ROOM_PLACEMENT': args.placement,
+        'VECTORIZE': not args.no_vectorize
+    }
+
+    stats = core.dungeon.generate.GenerationStats() if args.stats else None
+    times = []
+    for i in range(args.count):
+        random.seed('{}{}'.format(args.seed, i))
+        start = time.perf_counter()
+        dungeon = core.dungeon.generate.DungeonFactoryAlpha.generateDungeon(settings, stats)
+        times.append(time.perf_counter() - start)
+        print('{:>4} {:>8.2f}s {:>6} rooms'.format(i, times[-1], dungeon.roomCount()))
+
+    print('{}x{}: {:.2f}s per map, {:.2f}s slowest'.format(args.height, args.width, sum(times) / len(times), max(times)))
+    if stats:
+        print(stats.report())
@@ -0,0 +1,49 @@
+import argparse
+import random
+import time
+import tracemalloc
+
+import core.dungeon.generate
+
+# Compares the tuple grid and the compact array grid: memory held by a finished map (tracemalloc)
+# and the time to generate it. Both runs use the same seeds so they carve identical maps.
+
+
+def measure(compact, seeds, settings):
+    options = dict(settings, COMPACT_GRID=compact)
+    sizes = []
+    elapsed = 0
+
+    for seed in seeds:
+        random.seed(seed)
+        start = time.perf_counter()
+        tracemalloc.start()
+        dungeon = core.dungeon.generate.DungeonFactoryAlpha.generateDungeon(options)
+        # only the map storage, generation scratch space has been released by now
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        elapsed += time.perf_counter() - start
+        sizes.append(size)
+        del dungeon
+
+    return sum(sizes) / len(sizes), elapsed / len(seeds)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Memory and generation time of the tuple grid versus the compact grid.')
+    parser.add_argument('-n', '--count', type=int, default=5, help='Maps to generate per representation.')
+    parser.add_argument('--height', type=int, default=40, help='Map height.')
+    parser.add_argument('--width', type=int, default=60, help='Map width.')
+    args = parser.parse_args()
+
+    settings = {'DEFAULT_HEIGHT': args.height, 'DEFAULT_WIDTH': args.width}
+    seeds = ['grid{}'.format(i) for i in range(args.count)]
+
+    grid_size, grid_time = measure(False, seeds, settings)
+    compact_size, compact_time = measure(True, seeds, settings)
+
+    print('{:<10} {:>12} {:>10}'.format('grid', 'bytes/map', 's/map'))
+    print('{:<10} {:>12.0f} {:>10.3f}'.format('tuples', grid_size, grid_time))
+    print('{:<10} {:>12.0f} {:>10.3f}'.format('compact', compact_size, compact_time))
+    print('Memory ratio: {:.1f}x'.format(grid_size / compact_size))
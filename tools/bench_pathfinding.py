@@ -0,0 +1,92 @@
+import argparse
+import random
+import time
+
+import core.dungeon.generate
+import core.pathfinding as pathfinding
+import core.region
+
+# Compares the shared pathfinder against the list scan dijkstra that expeditions and road
+# generation used to carry around. The old version is kept here as the baseline.
+
+
+def legacy_path(start, grid, target):
+    distance = {}
+    previous = {}
+    q = []
+    destination = None
+
+    for cell in grid.allCells(navigable=True):
+        distance[cell] = 1000000
+        previous[cell] = None
+        q.append(cell)
+
+    distance[start] = 0
+
+    while len(q) > 0:
+        lowest = q[0]
+        for cell in q:
+            if distance[cell] < distance[lowest]:
+                lowest = cell
+        q.remove(lowest)
+
+        if lowest == target:
+            destination = lowest
+            break
+
+        neighbors = grid.getNeighbors(lowest)
+        for neighbor in [n for n in neighbors if n in q]:
+            weight = grid.getWeight(neighbor)
+            newDistance = distance[lowest] + weight if distance[lowest] else weight
+
+            if newDistance < distance[neighbor]:
+                distance[neighbor] = newDistance
+                previous[neighbor] = lowest
+
+    path = [destination]
+    while(previous.get(destination, False)):
+        path.append(previous[destination])
+        destination = previous[destination]
+
+    return path
+
+
+def run(label, grids, pairs):
+    jobs = []
+    for grid in grids:
+        cells = grid.allCells(navigable=True)
+        for i in range(pairs):
+            jobs.append((grid, random.choice(cells), random.choice(cells)))
+
+    start = time.perf_counter()
+    legacy = [legacy_path(s, g, t) for g, s, t in jobs]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    shared = [pathfinding.find_path(g, s, target=t) for g, s, t in jobs]
+    shared_time = time.perf_counter() - start
+
+    # both are shortest paths, they can take different routes between ties but never different lengths
+    cost = lambda g, p: sum(g.getWeight(c) for c in p[:-1])
+    mismatches = len([1 for (g, s, t), a, b in zip(jobs, legacy, shared) if cost(g, a) != cost(g, b)])
+
+    print('{:<20} {:>6} {:>12.2f} {:>12.2f} {:>8.1f}x {:>10}'.format(
+        label, len(jobs), legacy_time * 1000 / len(jobs), shared_time * 1000 / len(jobs), legacy_time / shared_time, mismatches))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Microbenchmark for the shared pathfinding module.')
+    parser.add_argument('-m', '--maps', type=int, default=3, help='Number of maps of each kind to generate.')
+    parser.add_argument('-p', '--pairs', type=int, default=20, help='Random start/target pairs per map.')
+    parser.add_argument('-s', '--seed', default='pathfinding', help='Random seed.')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    dungeons = [core.dungeon.generate.DungeonFactoryAlpha.generateDungeon() for i in range(args.maps)]
+    regions = [core.region.RegionGenerate.generate_region() for i in range(args.maps)]
+
+    print('{:<20} {:>6} {:>12} {:>12} {:>9} {:>10}'.format('grid', 'paths', 'old ms/path', 'new ms/path', 'speedup', 'mismatch'))
+    run('dungeon 40x60 (bfs)', dungeons, args.pairs)
+    run('region 40x80 (heap)', regions, args.pairs)
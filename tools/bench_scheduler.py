@@ -0,0 +1,77 @@
+import argparse
+import random
+import time
+
+from core.scheduler import Scheduler
+
+# Rough stand in for the DM loop's scheduling pattern. Every tick checks whether each band has
+# something queued, tops up the idle ones and then pops the soonest task, which gets rescheduled
+# for its band the way an expedition or downtime chain would. The old list based approach is kept
+# here as the baseline so the two can be compared side by side.
+
+DURATIONS = [1.5, 2, 20, 50, 100]
+VENUES = 6
+
+
+def legacy_loop(band_ids, events):
+    to_do = []
+    now = 1
+    for v in range(VENUES):
+        to_do.append({'action': 'restock', 'id': 'venue{}'.format(v), 'schedule': now + random.uniform(5000, 8000)})
+
+    for i in range(events):
+        for band_id in band_ids:
+            if not any(t.get('id') == band_id for t in to_do):
+                to_do.append({'action': 'downtime', 'id': band_id, 'schedule': now + random.choice(DURATIONS)})
+
+        to_do.sort(key=lambda a: a['schedule'])
+        do = to_do.pop(0)
+        now = do['schedule']
+
+        if do['action'] == 'restock':
+            to_do.append({'action': 'restock', 'id': do['id'], 'schedule': now + random.uniform(5000, 8000)})
+        elif random.random() < 0.8:
+            to_do.append({'action': 'exp', 'id': do['id'], 'schedule': now + random.choice(DURATIONS)})
+
+
+def scheduler_loop(band_ids, events):
+    to_do = Scheduler()
+    now = 1
+    for v in range(VENUES):
+        to_do.add({'action': 'restock', 'id': 'venue{}'.format(v), 'schedule': now + random.uniform(5000, 8000)})
+
+    for i in range(events):
+        for band_id in band_ids:
+            if not to_do.has_pending(band_id):
+                to_do.add({'action': 'downtime', 'id': band_id, 'schedule': now + random.choice(DURATIONS)})
+
+        do = to_do.pop()
+        now = do['schedule']
+
+        if do['action'] == 'restock':
+            to_do.add({'action': 'restock', 'id': do['id'], 'schedule': now + random.uniform(5000, 8000)})
+        elif random.random() < 0.8:
+            to_do.add({'action': 'exp', 'id': do['id'], 'schedule': now + random.choice(DURATIONS)})
+
+
+def measure(fn, bands, events, seed):
+    random.seed(seed)
+    band_ids = ['band{}'.format(i) for i in range(bands)]
+    start = time.perf_counter()
+    fn(band_ids, events)
+    return events / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compares DM event throughput of the list scheduler against the heap scheduler.')
+    parser.add_argument('-e', '--events', type=int, default=2000, help='Number of events to process per run.')
+    parser.add_argument('-b', '--bands', type=int, nargs='+', default=[10, 100, 1000], help='Band counts to test.')
+    parser.add_argument('-s', '--seed', default='scheduler', help='Random seed, both loops see the same sequence.')
+    args = parser.parse_args()
+
+    print('{:>8} {:>16} {:>16} {:>8}'.format('bands', 'list events/s', 'heap events/s', 'speedup'))
+    for bands in args.bands:
+        legacy = measure(legacy_loop, bands, args.events, args.seed)
+        heap = measure(scheduler_loop, bands, args.events, args.seed)
+        print('{:>8} {:>16.0f} {:>16.0f} {:>7.1f}x'.format(bands, legacy, heap, heap / legacy))
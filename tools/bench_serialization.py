@@ -0,0 +1,67 @@
+import argparse
+import json
+import random
+import time
+
+import core.dungeon.generate
+from core.dungeon.dungeons import Dungeon, DungeonCell
+
+# Compares the original cell layout, a coordinate list per tile type dumped to JSON, against the
+# run length encoded layout: size of the cells field and the time to encode and decode it.
+# The old encoder is kept here as the baseline, the old decoder is still what Dungeon uses for
+# documents without a version.
+
+
+def legacy_cells(dungeon):
+    cells = {}
+    for t in DungeonCell.REAL:
+        code = 't' + str(t)
+        cells[code] = []
+        for cell in dungeon.allCells():
+            if cell.type == t:
+                cells[code].append((cell.h, cell.w))
+    return json.dumps(cells)
+
+
+def timed(fn, items, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        results = [fn(item) for item in items]
+    return results, (time.perf_counter() - start) * 1000 / (repeat * len(items))
+
+
+def document(dungeon, cells):
+    return {'height': dungeon.height(), 'width': dungeon.width(), 'cells': cells}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Size and speed of the dungeon cell encodings.')
+    parser.add_argument('-n', '--count', type=int, default=10, help='Maps to generate.')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Times to repeat each encode/decode pass.')
+    parser.add_argument('-s', '--seed', default='serialization', help='Random seed.')
+    parser.add_argument('--compact', action='store_true', help='Generate maps on the compact grid.')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    dungeons = [core.dungeon.generate.DungeonFactoryAlpha.generateDungeon({'COMPACT_GRID': args.compact}) for i in range(args.count)]
+
+    old, old_encode = timed(legacy_cells, dungeons, args.repeat)
+    new, new_encode = timed(lambda d: d.encode_cells(), dungeons, args.repeat)
+
+    old_docs = [document(d, c) for d, c in zip(dungeons, old)]
+    new_docs = [document(d, c) for d, c in zip(dungeons, new)]
+    old_maps, old_decode = timed(lambda doc: Dungeon(serialized=doc), old_docs, args.repeat)
+    new_maps, new_decode = timed(lambda doc: Dungeon(serialized=doc), new_docs, args.repeat)
+
+    for d, a, b in zip(dungeons, old_maps, new_maps):
+        if list(a.rows()) != list(d.rows()) or list(b.rows()) != list(d.rows()):
+            raise RuntimeError('Decoded map does not match the original')
+
+    old_size = sum(len(c) for c in old) / len(old)
+    new_size = sum(len(json.dumps(c)) for c in new) / len(new)
+
+    print('{:<8} {:>12} {:>12} {:>12}'.format('format', 'bytes/map', 'encode ms', 'decode ms'))
+    print('{:<8} {:>12.0f} {:>12.3f} {:>12.3f}'.format('t2..t5', old_size, old_encode, old_decode))
+    print('{:<8} {:>12.0f} {:>12.3f} {:>12.3f}'.format('v2 rle', new_size, new_encode, new_decode))
+    print('Size ratio: {:.1f}x, encode {:.1f}x, decode {:.1f}x'.format(old_size / new_size, old_encode / new_encode, old_decode / new_decode))
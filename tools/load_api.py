@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+# Requests per second against a running API. Hits the region, band and dungeon reads with a
+# fixed number of concurrent clients for a set time, the dungeon id is picked from
+# /dungeon/basic. Run it against a build from before and after a change with the same database
+# behind both.
+# With --etag each client sends back the last ETag it got, like a browser revalidating.
+# Needs httpx, see tools/requirements.txt.
+# No results recorded yet: this hasn't been run against an API backed by a real mongod, so the
+# pooled client change it was written for is still unmeasured.
+
+
+async def worker(client, url, deadline, latencies, errors, etag):
+    headers = {}
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.get(url, headers=headers)
+            if response.status_code not in (200, 304):
+                errors.append(response.status_code)
+                continue
+            if etag and 'etag' in response.headers:
+                headers['If-None-Match'] = response.headers['etag']
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def load(base, path, clients, duration, etag):
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[worker(client, path, deadline, latencies, errors, etag) for i in range(clients)])
+
+    return latencies, errors
+
+
+def report(path, latencies, errors, duration):
+    if not latencies:
+        print('{:<48} no successful requests, {} errors'.format(path, len(errors)))
+        return
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print('{:<48} {:>10.1f} {:>10.1f} {:>10.1f} {:>8}'.format(
+        path, len(latencies) / duration, statistics.median(ordered) * 1000, p99 * 1000, len(errors)))
+
+
+async def main(args):
+    async with httpx.AsyncClient(base_url=args.url) as client:
+        dungeons = (await client.get('/dungeon/basic')).json()
+    if not dungeons:
+        raise RuntimeError('No dungeons to request, start the DM first')
+
+    paths = ['/region/', '/bands/', '/dungeon/basic', '/dungeon/{}'.format(dungeons[0]['id'])]
+
+    print('{:<48} {:>10} {:>10} {:>10} {:>8}'.format('endpoint', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+    for path in paths:
+        latencies, errors = await load(args.url, path, args.clients, args.duration, args.etag)
+        report(path, latencies, errors, args.duration)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Load test for the API read endpoints.')
+    parser.add_argument('-u', '--url', default='http://localhost:8081', help='API base url.')
+    parser.add_argument('-c', '--clients', type=int, default=50, help='Concurrent clients.')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='Seconds to run each endpoint.')
+    parser.add_argument('--etag', action='store_true', help='Revalidate with If-None-Match.')
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
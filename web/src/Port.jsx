@@ -7,7 +7,7 @@ import { About } from './About.jsx';
 import { Bands, Band, Delver } from './Bands.jsx';
 import { City } from './City.jsx';
 import { Dungeon, Dungeons } from './Dungeon.jsx';
-import { rootUrl } from './fetching.js';
+import { rootUrl, prepareRegion, decodeDungeonCells } from './fetching.js';
 import { LogContext } from './context.js';
 
 const REGION_EVENTS = ['REGION', 'DUNGEONS', 'DUNGEON-NEW', 'DUNGEON-DEL'];
@@ -26,7 +26,19 @@ function Port() {
     let doc = JSON.parse(msg);
 
     // =====================================================================================
-    if (doc['type'] == 'CURSOR') {
+    if (doc['type'] == 'SNAPSHOT') {
+      // the whole starting state in one go, the feed picks up right after it
+      let dungeons = doc['dungeons'].map((d) => ({...d, cells: decodeDungeonCells(d)}));
+
+      if (doc['region']) {
+        queryClient.setQueryData(['region'], prepareRegion(doc['region']));
+      }
+      queryClient.setQueryData(['bands'], doc['bands']);
+      queryClient.setQueryData(['dungeons'], dungeons);
+      queryClient.setQueryData(['expeditions'], doc['expeditions']);
+    }
+    // =====================================================================================
+    else if (doc['type'] == 'CURSOR') {
       let expId = doc['context']['expedition'];
       let loc = doc['coords'];
 
@@ -126,7 +138,7 @@ function Port() {
   useEffect(() => {
     if (socket.current == null) {
       console.log('!!! Declaring websocket', Date.now());
-      socket.current = new WebSocket('ws://' + rootUrl + '/feed/dungeon');
+      socket.current = new WebSocket('ws://' + rootUrl + '/feed/dungeon?snapshot=true');
       socket.current.onmessage = receiveMessage;
     }
   }, []);
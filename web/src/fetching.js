@@ -30,25 +30,72 @@ const getRegion = async function({ queryKey }) {
     throw new Error('Region fetch failed');
   }
 
-  // region cells are stored funny at the moment
-  let region = await response.json();
+  return prepareRegion(await response.json());
+}
 
-  let cells = JSON.parse(region['cells']);
+// builds the [x][y] tile grid the map drawing wants, shared with the feed snapshot
+const prepareRegion = function(region) {
+  // region cells are stored funny at the moment
   let grid = [...Array(region['width'])];
   for (var i in grid) {
     grid[i] = [...Array(region['height'])];
     grid[i].fill(1);
   }
-  for (i =0; i < cells.length; i++) {
-    var c = cells[i];
-    // backend does y,x so we reverse that when loading in
-    grid[c[2]][c[1]] = c[0];
+
+  if (typeof region['cells'] === 'string') {
+    // the old layout, a JSON list of [type, y, x]
+    let cells = JSON.parse(region['cells']);
+    for (i =0; i < cells.length; i++) {
+      var c = cells[i];
+      // backend does y,x so we reverse that when loading in
+      grid[c[2]][c[1]] = c[0];
+    }
+  } else {
+    // run length encoded like the dungeon cells, see decodeDungeonCells
+    let runs = atob(region['cells']['rle']);
+    let position = 0;
+    for (i = 0; i < runs.length; i += 2) {
+      let count = runs.charCodeAt(i);
+      let type = runs.charCodeAt(i + 1);
+      for (let k = 0; k < count; k++, position++) {
+        grid[position % region['width']][Math.floor(position / region['width'])] = type;
+      }
+    }
   }
   region['grid'] = grid;
 
   return region;
 }
 
+// dungeon cells come back either as the old JSON string of coordinates per tile type or as
+// version 2: base64 of (count, tile) byte pairs covering the map row by row.
+// Both turn into the old per type layout since that's what the map drawing wants
+const decodeDungeonCells = function(dungeon) {
+  let cells = dungeon['cells'];
+  if (typeof cells === 'string') {
+    return JSON.parse(cells);
+  }
+
+  let runs = atob(cells['rle']);
+  let decoded = {};
+  let position = 0;
+  for (let i = 0; i < runs.length; i += 2) {
+    let count = runs.charCodeAt(i);
+    let type = runs.charCodeAt(i + 1);
+    // solid is what the map starts out as so it doesn't need listing
+    if (type != 1) {
+      let code = 't' + type;
+      decoded[code] = decoded[code] || [];
+      for (let k = 0; k < count; k++) {
+        let p = position + k;
+        decoded[code].push([Math.floor(p / dungeon['width']), p % dungeon['width']]);
+      }
+    }
+    position += count;
+  }
+  return decoded;
+}
+
 const getDungeon = async function({ queryKey }) {
   let [_key, dId] = queryKey;
   let url = '//' + rootUrl + '/dungeon/' + dId;
@@ -58,7 +105,7 @@ const getDungeon = async function({ queryKey }) {
   }
 
   let dungeon = await response.json();
-  dungeon['cells'] = JSON.parse(dungeon['cells']);
+  dungeon['cells'] = decodeDungeonCells(dungeon);
   
   return dungeon;
 }
@@ -72,7 +119,7 @@ const getDungeons = async function({ queryKey }) {
   let dungeons = await response.json();
 
   for (var i in dungeons) {
-    dungeons[i]['cells'] = JSON.parse(dungeons[i]['cells']);
+    dungeons[i]['cells'] = decodeDungeonCells(dungeons[i]);
   }
   return dungeons;
 }
@@ -138,4 +185,4 @@ const getExpeditions = async function({ queryKey }) {
   return response.json();
 }
 
-export { rootUrl, getRegion, getDungeon, getDungeons, getBands, getBand, getBandEvents, getDelvers, getDelver, getDelverEvents, getExpeditions }
\ No newline at end of file
+export { rootUrl, prepareRegion, decodeDungeonCells, getRegion, getDungeon, getDungeons, getBands, getBand, getBandEvents, getDelvers, getDelver, getDelverEvents, getExpeditions }
\ No newline at end of file